@@ -1,7 +1,11 @@
 import os
-import sqlalchemy as db
+import sys
 import json
 
+# make the repository root importable wherever the script is run from
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.database import get_dll_for_tables
+
 def main():
 
     print("Enter data source's profile name:")
@@ -43,48 +47,18 @@ def main():
     confirm = input()
 
     if confirm == "Y":
-        print('checking connection...')
-        engine = db.create_engine(db_url)
-        connection = engine.connect()
-        print('connected to database')
-
         print("Enter table name (no schema name, seperated by ,), leave blank means all tables:")
         tables_string = input()
         if len(tables_string) > 0 and tables_string.strip() != '':
-            # Split text on commas
-            split_text = tables_string.split(",")
-
-            # Trim each string
-            if schema:
-                split_tables = [schema + '.' + x.strip() for x in split_text]
-            else:
-                split_tables = [x.strip() for x in split_text]
+            # Split text on commas and trim each string
+            split_tables = [x.strip() for x in tables_string.split(",")]
         else:
             split_tables = []
 
-        metadata = db.MetaData()
-        if schema:
-            metadata.reflect(bind=connection, schema=schema)
-        else:
-            metadata.reflect(bind=connection)
-        tables = metadata.tables
-        table_info = {}
-
-        for table_name, table in tables.items():
-            # If table name is provided, only generate DDL for those tables. Otherwise, generate DDL for all tables.
-            if len(split_tables) > 0 and table_name not in split_tables:
-                continue
-            # Start the DDL statement
-            ddl = f"CREATE TABLE {table_name} -- {table.comment} \n (\n"
-            column_descriptions = []
-            for column in table.columns:
-                # get column description
-                ddl += f"  {column.name} {column.type} -- {column.comment},\n"
-            ddl = ddl.rstrip(',\n') + "\n)"  # Remove the last comma and close the CREATE TABLE statement
-            table_info[table_name] = {}
-            table_info[table_name]['ddl'] = ddl
-            table_info[table_name]['description'] = table.comment
-
+        # columns, comments and keys of all tables are fetched with a few catalog queries
+        print('checking connection...')
+        table_info = get_dll_for_tables(db_url, False, schema, split_tables)
+        for table_name in table_info:
             print(f'added table {table_name}')
 
         with open(os.path.join(os.getcwd(), 'config_files', '1_config.json')) as f:
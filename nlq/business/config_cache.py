@@ -0,0 +1,55 @@
+import threading
+
+from utils.cache import LRUCache
+from utils.env_var import CONFIG_CACHE_TTL, CONFIG_CACHE_NEGATIVE_TTL
+
+_MISSING = object()
+_NOT_FOUND = object()
+
+
+class ConfigCache:
+    """
+    Process level read-through cache of the configuration items stored in DynamoDB.
+
+    Writers invalidate the keys they change, which bumps the version stamp of each key and of the whole cache.
+    A load which raced with a write of its key is returned but not stored, and callers can key their own
+    caches on get_version(). Missing items are remembered for negative_ttl seconds (0 disables that).
+    Writes from other processes become visible after at most ttl seconds.
+    """
+
+    def __init__(self, ttl=CONFIG_CACHE_TTL, negative_ttl=CONFIG_CACHE_NEGATIVE_TTL, max_size=1024):
+        self.negative_ttl = negative_ttl
+        self._entries = LRUCache(max_size=max_size, ttl=ttl)
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get_version(self, key=None) -> int:
+        """Version stamp of the key, or of the whole cache when key is None"""
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def get(self, key, loader):
+        value = self._entries.get(key, _MISSING)
+        if value is not _MISSING:
+            return None if value is _NOT_FOUND else value
+        version = self.get_version(key)
+        value = loader()
+        with self._lock:
+            if self._versions.get(key, 0) == version:
+                if value is not None:
+                    self._entries.set(key, value)
+                elif self.negative_ttl > 0:
+                    self._entries.set(key, _NOT_FOUND, ttl=self.negative_ttl)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._entries.delete(key)
+            self._versions[None] = self._versions.get(None, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions[None] = self._versions.get(None, 0) + 1
@@ -1,32 +1,44 @@
 from loguru import logger
 from nlq.data_access.dynamo_connection import ConnectConfigDao, ConnectConfigEntity
 from nlq.data_access.database import RelationDatabase
+from nlq.business.config_cache import ConfigCache
 
 class ConnectionManagement:
     connection_config_dao = ConnectConfigDao()
+    # keys: 'names' and ('connection', conn_name)
+    connection_cache = ConfigCache()
+
+    @classmethod
+    def _invalidate_cache(cls, conn_name):
+        cls.connection_cache.invalidate(('connection', conn_name), 'names')
 
     @classmethod
     def get_all_connections(cls):
         logger.info('get all connections...')
-        return [conn.conn_name for conn in cls.connection_config_dao.get_db_list()]
+        return cls.connection_cache.get('names', cls.connection_config_dao.get_db_names)
 
     @classmethod
     def add_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.add_url_db(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment)
+        cls._invalidate_cache(conn_name)
         logger.info(f"Connection {conn_name} added")
 
     @classmethod
     def get_conn_config_by_name(cls, conn_name):
-        return cls.connection_config_dao.get_by_name(conn_name)
+        return cls.connection_cache.get(('connection', conn_name),
+                                        lambda: cls.connection_config_dao.get_by_name(conn_name))
 
     @classmethod
     def update_connection(cls, conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment):
         cls.connection_config_dao.update_db_info(conn_name, db_type, db_host, db_port, db_user, db_pwd, db_name, comment)
+        cls._invalidate_cache(conn_name)
         logger.info(f"Connection {conn_name} updated")
 
     @classmethod
     def delete_connection(cls, conn_name):
-        if cls.connection_config_dao.delete(conn_name):
+        deleted = cls.connection_config_dao.delete(conn_name)
+        cls._invalidate_cache(conn_name)
+        if deleted:
             logger.info(f"Connection {conn_name} deleted")
         else:
             logger.warning(f"Failed to delete Connection {conn_name}")
@@ -35,13 +47,31 @@ class ConnectionManagement:
     def get_table_name_by_config(cls, conn_config: ConnectConfigEntity, schema_names):
         return RelationDatabase.get_all_tables_by_connection(conn_config, schema_names)
 
+    @classmethod
+    def refresh_schema_cache(cls, conn_config: ConnectConfigEntity):
+        RelationDatabase.refresh_metadata(conn_config)
+
     @classmethod
     def get_all_schemas_by_config(cls, conn_config: ConnectConfigEntity):
         return RelationDatabase.get_all_schema_names_by_connection(conn_config)
 
     @classmethod
-    def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schema_names, table_names):
-        return RelationDatabase.get_table_definition_by_connection(conn_config, schema_names, table_names)
+    def get_table_definition_by_config(cls, conn_config: ConnectConfigEntity, schema_names, table_names,
+                                       on_progress=None):
+        return RelationDatabase.get_table_definition_by_connection(conn_config, schema_names, table_names,
+                                                                   on_progress=on_progress)
+
+    @classmethod
+    def get_table_fingerprints_by_config(cls, conn_config: ConnectConfigEntity, schema_names, table_names):
+        return RelationDatabase.get_table_fingerprints_by_connection(conn_config, schema_names, table_names)
+
+    @classmethod
+    def get_table_definitions_by_configs(cls, requests: dict, on_progress=None):
+        """requests maps a connection name to (schema_names, table_names)"""
+        return RelationDatabase.get_table_definitions_by_connections(
+            {conn_name: (cls.get_conn_config_by_name(conn_name), schema_names, table_names)
+             for conn_name, (schema_names, table_names) in requests.items()},
+            on_progress=on_progress)
 
     @classmethod
     def get_db_url_by_name(cls, conn_name):
@@ -1,54 +1,174 @@
 from loguru import logger
+from nlq.business.config_cache import ConfigCache
+from nlq.business.connection import ConnectionManagement
 from nlq.data_access.dynamo_profile import ProfileConfigDao, ProfileConfigEntity
+from utils.column_stats import compute_column_stats
+from utils.llm import invalidate_llm_cache
+from utils.prompt import invalidate_compiled_prompts
+from utils.result_cache import invalidate_result_cache
 
 
 class ProfileManagement:
     profile_config_dao = ProfileConfigDao()
+    # keys: 'names', 'info' (light fields of all profiles) and ('profile', profile_name)
+    profile_cache = ConfigCache()
+
+    @classmethod
+    def get_cache_version(cls, profile_name=None):
+        """Version stamp of the cached profile (of all profiles when None), bumped by every write"""
+        return cls.profile_cache.get_version(None if profile_name is None else ('profile', profile_name))
+
+    @classmethod
+    def _invalidate_cache(cls, profile_name, lists=True):
+        keys = [('profile', profile_name)] + (['names', 'info'] if lists else [])
+        cls.profile_cache.invalidate(*keys)
 
     @classmethod
     def get_all_profiles(cls):
         logger.info('get all profiles...')
-        return [conn.profile_name for conn in cls.profile_config_dao.get_profile_list()]
+        return cls.profile_cache.get('names', cls.profile_config_dao.get_profile_names)
 
     @classmethod
     def get_all_profiles_with_info(cls):
+        """
+        Light info of all profiles. tables_info and column_stats are left out of the scan,
+        they are loaded with get_profile_details once a profile is selected ('details_loaded' is False until then).
+        """
         logger.info('get all profiles with info...')
-        profile_list = cls.profile_config_dao.get_profile_list()
+        profile_items = cls.profile_cache.get('info', lambda: cls.profile_config_dao.get_profile_items(
+            ['profile_name', 'conn_name', 'comments', 'statement_timeout', 'cost_guard']))
         profile_map = {}
-        for profile in profile_list:
-            profile_map[profile.profile_name] = {
+        for item in profile_items:
+            profile_map[item['profile_name']] = {
                 'db_url': '',
-                'conn_name': profile.conn_name,
-                'tables_info': profile.tables_info,
+                'conn_name': item.get('conn_name'),
+                'tables_info': None,
                 'hints': '',
                 'search_samples': [],
-                'comments':  profile.comments,
+                'comments': item.get('comments'),
+                'statement_timeout': item.get('statement_timeout'),
+                'cost_guard': item.get('cost_guard'),
+                'column_stats': None,
+                'details_loaded': False,
             }
 
         return profile_map
 
     @classmethod
-    def add_profile(cls, profile_name, conn_name, schemas, tables, comment):
-        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment)
+    def get_profile_details(cls, profile_name):
+        """The heavy fields of a profile left out by get_all_profiles_with_info"""
+        profile = cls.get_profile_by_name(profile_name)
+        return {
+            'tables_info': profile.tables_info if profile else None,
+            'column_stats': profile.column_stats if profile else None,
+            'details_loaded': True,
+        }
+
+    @classmethod
+    def add_profile(cls, profile_name, conn_name, schemas, tables, comment, statement_timeout=None, cost_guard=None):
+        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment,
+                                     statement_timeout=statement_timeout, cost_guard=cost_guard)
         cls.profile_config_dao.add(entity)
+        cls._invalidate_cache(profile_name)
         logger.info(f"Profile {profile_name} added")
 
     @classmethod
     def get_profile_by_name(cls, profile_name):
-        return cls.profile_config_dao.get_by_name(profile_name)
+        return cls.profile_cache.get(('profile', profile_name),
+                                     lambda: cls.profile_config_dao.get_by_name(profile_name))
 
     @classmethod
-    def update_profile(cls, profile_name, conn_name, schemas, tables, comment):
-        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment)
+    def update_profile(cls, profile_name, conn_name, schemas, tables, comment, statement_timeout=None,
+                       cost_guard=None):
+        entity = ProfileConfigEntity(profile_name, conn_name, schemas, tables, comment,
+                                     statement_timeout=statement_timeout, cost_guard=cost_guard)
         cls.profile_config_dao.update(entity)
+        cls._invalidate_cache(profile_name)
+        invalidate_llm_cache(profile_name)
+        invalidate_compiled_prompts(profile_name)
+        invalidate_result_cache(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def delete_profile(cls, profile_name):
         cls.profile_config_dao.delete(profile_name)
+        cls._invalidate_cache(profile_name)
+        invalidate_llm_cache(profile_name)
+        invalidate_compiled_prompts(profile_name)
+        invalidate_result_cache(profile_name)
         logger.info(f"Profile {profile_name} updated")
 
     @classmethod
     def update_table_def(cls, profile_name, tables_info):
         cls.profile_config_dao.update_table_def(profile_name, tables_info)
+        cls._invalidate_cache(profile_name, lists=False)
+        invalidate_llm_cache(profile_name)
+        invalidate_compiled_prompts(profile_name)
+        invalidate_result_cache(profile_name)
         logger.info(f"Table definition updated")
+
+    @classmethod
+    def patch_table_def(cls, profile_name, updated_tables: dict, removed_tables=()):
+        """
+        Write only the changed tables_info entries. LLM responses are cached by their full prompt,
+        so only the compiled prompts including the changed tables and the query results are dropped.
+        """
+        cls.profile_config_dao.update_table_entries(profile_name, updated_tables, removed_tables)
+        cls._invalidate_cache(profile_name, lists=False)
+        invalidate_compiled_prompts(profile_name, table_names=list(updated_tables) + list(removed_tables))
+        invalidate_result_cache(profile_name)
+        logger.info(f"Table definition of {profile_name} patched, updated: {list(updated_tables)}, "
+                    f"removed: {list(removed_tables)}")
+
+    @classmethod
+    def refresh_changed_tables(cls, profile_name):
+        """
+        Compare the catalog fingerprints of the profile tables with the ones stored in tables_info and
+        re-fetch the definitions of the changed tables only. Returns {'changed': [...], 'removed': [...]}
+        """
+        profile = cls.get_profile_by_name(profile_name)
+        if profile is None or not profile.tables_info:
+            return {'changed': [], 'removed': []}
+        conn_config = ConnectionManagement.get_conn_config_by_name(profile.conn_name)
+        fingerprints = ConnectionManagement.get_table_fingerprints_by_config(conn_config, profile.schemas,
+                                                                             list(profile.tables_info))
+        removed = [table_name for table_name, fingerprint in fingerprints.items() if fingerprint is None]
+        # entries stored before fingerprints existed take the current one instead of being fetched again
+        backfilled = {table_name: dict(profile.tables_info[table_name], fingerprint=fingerprint)
+                      for table_name, fingerprint in fingerprints.items()
+                      if fingerprint is not None and not profile.tables_info[table_name].get('fingerprint')}
+        if backfilled:
+            cls.profile_config_dao.update_table_entries(profile_name, backfilled)
+            cls._invalidate_cache(profile_name, lists=False)
+        changed = [table_name for table_name, fingerprint in fingerprints.items()
+                   if fingerprint is not None and table_name not in backfilled
+                   and fingerprint != profile.tables_info[table_name]['fingerprint']]
+        updated = {}
+        if changed:
+            updated = ConnectionManagement.get_table_definition_by_config(conn_config, profile.schemas, changed)
+        if updated or removed:
+            cls.patch_table_def(profile_name, updated, removed)
+            if profile.column_stats:
+                cls.update_column_stats(profile_name, table_names=list(updated))
+        return {'changed': list(updated), 'removed': removed}
+
+    @classmethod
+    def update_column_stats(cls, profile_name, table_names=None):
+        """
+        Compute the column statistics of the profile tables (only table_names, merged into the stored ones,
+        when given) and store them next to tables_info
+        """
+        profile = cls.get_profile_by_name(profile_name)
+        if profile is None or not profile.tables_info:
+            return {}
+        db_url = ConnectionManagement.get_db_url_by_name(profile.conn_name)
+        column_stats = dict(profile.column_stats or {}) if table_names is not None else {}
+        column_stats.update(compute_column_stats(db_url, profile.tables_info, table_names))
+        column_stats = {table_name: stats for table_name, stats in column_stats.items()
+                        if table_name in profile.tables_info}
+        cls.profile_config_dao.update_column_stats(profile_name, column_stats)
+        cls._invalidate_cache(profile_name, lists=False)
+        # the value hints are part of the rendered DDL, prompts of the profile are compiled again
+        invalidate_compiled_prompts(profile_name, table_names=table_names)
+        logger.info(f"Column statistics of {profile_name} updated for {len(column_stats)} tables")
+        return column_stats
@@ -0,0 +1,48 @@
+import threading
+
+from loguru import logger
+
+from nlq.business.profile import ProfileManagement
+from utils.env_var import SCHEMA_REFRESH_INTERVAL
+
+
+class SchemaRefresher:
+    """
+    Daemon thread checking the table fingerprints of all profiles every interval seconds
+    and patching the definitions of the tables which changed. An interval of 0 disables it.
+    """
+
+    def __init__(self, interval=SCHEMA_REFRESH_INTERVAL):
+        self.interval = interval
+        self.last_results = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the refresher thread, does nothing if it is disabled or already running"""
+        with self._lock:
+            if self.interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='schema-refresher', daemon=True)
+            self._thread.start()
+        logger.info(f'schema refresher started, checking every {self.interval}s')
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.refresh_all()
+
+    def refresh_all(self):
+        for profile_name in ProfileManagement.get_all_profiles():
+            try:
+                self.last_results[profile_name] = ProfileManagement.refresh_changed_tables(profile_name)
+            except Exception as e:
+                logger.opt(exception=e).warning(f'schema refresh of profile {profile_name} failed')
+        return self.last_results
+
+
+schema_refresher = SchemaRefresher()
@@ -1,8 +1,18 @@
+from functools import partial
+
 from loguru import logger
 import sqlalchemy as db
 from sqlalchemy import text
 
 from nlq.data_access.dynamo_connection import ConnectConfigEntity
+from utils.cache import LRUCache, make_cache_key
+from utils.database import get_engine, connect, dispose_engine, get_dll_for_tables, get_table_fingerprints, \
+    reflected_catalog_entry, table_fingerprint
+from utils.env_var import SCHEMA_CACHE_TTL
+from utils.reflection import reflection_executor
+
+# table lists and reflected metadata per connection, tagged with the hashed db url for refresh
+_metadata_cache = LRUCache(max_size=64, ttl=SCHEMA_CACHE_TTL)
 
 
 class RelationDatabase():
@@ -19,11 +29,13 @@ class RelationDatabase():
 
     @classmethod
     def test_connection(cls, db_type, user, password, host, port, db_name) -> bool:
+        db_url = cls.get_db_url(db_type, user, password, host, port, db_name)
         try:
-            engine = db.create_engine(cls.get_db_url(db_type, user, password, host, port, db_name))
-            connection = engine.connect()
-            return True
+            with connect(db_url):
+                return True
         except Exception as e:
+            # do not keep an engine around for credentials which do not work
+            dispose_engine(db_url)
             logger.exception(e)
             logger.error(f"Failed to connect: {str(e)}")
             return False
@@ -34,8 +46,7 @@ class RelationDatabase():
         if connection.db_type == 'postgresql':
             db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
                                     connection.db_port, connection.db_name)
-            engine = db.create_engine(db_url)
-            with engine.connect() as conn:
+            with connect(db_url) as conn:
                 query = text("""
                     SELECT nspname AS schema_name
                     FROM pg_catalog.pg_namespace
@@ -52,26 +63,142 @@ class RelationDatabase():
 
     @classmethod
     def get_all_tables_by_connection(cls, connection: ConnectConfigEntity, schemas=None):
+        """
+        Table names of the schemas plus the default schema, listed with the inspector without reflecting columns.
+        Tables of non default schemas are named schema.table, as in MetaData.tables.
+        """
         if schemas is None:
             schemas = []
-        metadata = cls.get_metadata_by_connection(connection, schemas)
-        return metadata.tables.keys()
+        db_url = cls.get_db_url_by_connection(connection)
+        key = ('tables', db_url, tuple(schemas))
+        table_names = _metadata_cache.get(key)
+        if table_names is None:
+            inspector = db.inspect(get_engine(db_url))
+            table_names = [f'{s}.{t}' for s in schemas for t in inspector.get_table_names(schema=s)]
+            table_names += inspector.get_table_names()
+            _metadata_cache.set(key, table_names, tag=make_cache_key(db_url))
+        return table_names
 
     @classmethod
-    def get_metadata_by_connection(cls, connection, schemas):
-        db_url = cls.get_db_url(connection.db_type, connection.db_user, connection.db_pwd, connection.db_host,
-                                connection.db_port, connection.db_name)
-        engine = db.create_engine(db_url)
-        # connection = engine.connect()
+    def get_metadata_by_connection(cls, connection, schemas, table_names=None):
+        """
+        Reflect the given tables (schema.table for non default schemas), or all tables of the schemas when
+        table_names is empty. Referenced tables are not pulled in, the result is cached per connection.
+        """
+        db_url = cls.get_db_url_by_connection(connection)
+        key = ('metadata', db_url, tuple(schemas), tuple(sorted(table_names or [])))
+        metadata = _metadata_cache.get(key)
+        if metadata is not None:
+            return metadata
+        engine = get_engine(db_url)
         metadata = db.MetaData()
-        for s in schemas:
-            metadata.reflect(bind=engine, schema=s)
-        metadata.reflect(bind=engine)
+        if table_names:
+            for s in [*schemas, None]:
+                wanted = {t.split('.', 1)[1] if s else t for t in table_names
+                          if (s and t.startswith(f'{s}.')) or (not s and '.' not in t)}
+                if wanted:
+                    metadata.reflect(bind=engine, schema=s, only=lambda name, _, wanted=wanted: name in wanted,
+                                     resolve_fks=False)
+        else:
+            for s in schemas:
+                metadata.reflect(bind=engine, schema=s)
+            metadata.reflect(bind=engine)
+        _metadata_cache.set(key, metadata, tag=make_cache_key(db_url))
         return metadata
 
     @classmethod
-    def get_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names):
-        metadata = cls.get_metadata_by_connection(connection, schemas)
+    def refresh_metadata(cls, connection: ConnectConfigEntity):
+        """Drop the cached table lists and metadata of the connection"""
+        _metadata_cache.invalidate(make_cache_key(cls.get_db_url_by_connection(connection)))
+
+    @classmethod
+    def get_schema_table_definition(cls, connection: ConnectConfigEntity, schema, table_names):
+        """
+        tables_info of tables of one schema (None for the default schema), fetched with a few bulk catalog
+        queries; falls back to SQLAlchemy reflection if those fail
+        """
+        try:
+            return get_dll_for_tables(cls.get_db_url_by_connection(connection), False, schema, table_names)
+        except Exception as e:
+            logger.warning(f'bulk table definition fetch of schema {schema} failed, use reflection: {e}')
+        return cls.reflect_table_definition_by_connection(connection, [schema] if schema else [], table_names)
+
+    @classmethod
+    def group_tables_by_schema(cls, schemas, table_names) -> dict:
+        """Map each schema (None for the default schema) to its tables, named as in tables_info"""
+        schema_tables = {}
+        for table_name in table_names:
+            schema = next((s for s in schemas if table_name.startswith(f'{s}.')), None)
+            schema_tables.setdefault(schema, []).append(table_name)
+        return schema_tables
+
+    @classmethod
+    def get_table_fingerprints_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names) -> dict:
+        """
+        Current fingerprint of each table, None for the tables which no longer exist.
+        The tables of a schema whose catalog cannot be read are left out, so they are not mistaken for dropped.
+        """
+        db_url = cls.get_db_url_by_connection(connection)
+        schema_tables = cls.group_tables_by_schema(schemas, table_names)
+        tasks = [(schema or 'default schema', db_url, partial(get_table_fingerprints, db_url, schema, tables))
+                 for schema, tables in schema_tables.items()]
+        results, errors = reflection_executor.run(tasks)
+        fingerprints = {}
+        for schema, tables in schema_tables.items():
+            schema_fingerprints = results.get(schema or 'default schema')
+            if schema_fingerprints is not None:
+                fingerprints.update({table_name: schema_fingerprints.get(table_name) for table_name in tables})
+        return fingerprints
+
+    @classmethod
+    def get_table_definition_tasks(cls, connection: ConnectConfigEntity, schemas, table_names, name=None):
+        """One (label, db_url, func) reflection task per schema of the tables"""
+        if not table_names:
+            table_names = cls.get_all_tables_by_connection(connection, schemas)
+        db_url = cls.get_db_url_by_connection(connection)
+        tasks = []
+        for schema, tables in cls.group_tables_by_schema(schemas, table_names).items():
+            label = schema or 'default schema'
+            tasks.append((f'{name}: {label}' if name else label, db_url,
+                          partial(cls.get_schema_table_definition, connection, schema, tables)))
+        return tasks
+
+    @classmethod
+    def get_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names,
+                                           on_progress=None):
+        """
+        tables_info of the tables (all tables of the schemas when table_names is empty).
+        Schemas are fetched concurrently; the tables of a schema which fails are left out of the result,
+        the failure is logged and reported through on_progress(label, done, total, error).
+        """
+        results, errors = reflection_executor.run(cls.get_table_definition_tasks(connection, schemas, table_names),
+                                                  on_progress)
+        table_info = {}
+        for schema_table_info in results.values():
+            table_info.update(schema_table_info)
+        return table_info
+
+    @classmethod
+    def get_table_definitions_by_connections(cls, requests: dict, on_progress=None):
+        """
+        tables_info of several connections at once, requests maps a name to (connection, schemas, table_names).
+        All schemas of all connections are fetched concurrently, bounded per database server.
+        """
+        tasks = []
+        task_names = {}
+        for name, (connection, schemas, table_names) in requests.items():
+            for task in cls.get_table_definition_tasks(connection, schemas, table_names, name=name):
+                task_names[task[0]] = name
+                tasks.append(task)
+        results, errors = reflection_executor.run(tasks, on_progress)
+        definitions = {name: {} for name in requests}
+        for label, schema_table_info in results.items():
+            definitions[task_names[label]].update(schema_table_info)
+        return definitions
+
+    @classmethod
+    def reflect_table_definition_by_connection(cls, connection: ConnectConfigEntity, schemas, table_names):
+        metadata = cls.get_metadata_by_connection(connection, schemas, table_names)
         tables = metadata.tables
         table_info = {}
 
@@ -90,6 +217,7 @@ class RelationDatabase():
             table_info[table_name] = {}
             table_info[table_name]['ddl'] = ddl
             table_info[table_name]['description'] = table.comment
+            table_info[table_name]['fingerprint'] = table_fingerprint(reflected_catalog_entry(table))
 
             logger.info(f'added table {table_name} to table_info dict')
 
@@ -3,6 +3,8 @@ from loguru import logger
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
+from nlq.data_access.dynamo_scan import scan_table
+
 
 # DynamoDB table name
 CONNECT_CONFIG_TABLE_NAME = 'NlqConnectConfig'
@@ -143,5 +145,8 @@ class ConnectConfigDao:
             raise ValueError(f"{conn_name} not found")
 
     def get_db_list(self):
-        response = self.table.scan()
-        return [ConnectConfigEntity(**item) for item in response['Items']]
+        return [ConnectConfigEntity(**item) for item in scan_table(self.table)]
+
+    def get_db_names(self):
+        return [item['conn_name'] for item in scan_table(self.table, attributes=['conn_name'])]
+
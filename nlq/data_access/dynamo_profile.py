@@ -1,8 +1,13 @@
+import json
+from decimal import Decimal
+
 import boto3
 from loguru import logger
 from boto3.dynamodb.conditions import Key, Attr
 from botocore.exceptions import ClientError
 
+from nlq.data_access.dynamo_scan import scan_table
+
 
 # DynamoDB table name
 PROFILE_CONFIG_TABLE_NAME = 'NlqProfileConfig'
@@ -10,13 +15,19 @@ PROFILE_CONFIG_TABLE_NAME = 'NlqProfileConfig'
 
 class ProfileConfigEntity:
 
-    def __init__(self, profile_name: str, conn_name: str, schemas: list[str], tables: list[str], comments: str, tables_info: dict=None):
+    def __init__(self, profile_name: str, conn_name: str, schemas: list[str], tables: list[str], comments: str, tables_info: dict=None,
+                 column_stats: dict=None, statement_timeout: int=None, cost_guard: dict=None):
         self.profile_name = profile_name
         self.conn_name = conn_name
         self.schemas = schemas
         self.tables = tables
         self.comments = comments
         self.tables_info = tables_info
+        self.column_stats = column_stats
+        # seconds, None uses QUERY_STATEMENT_TIMEOUT
+        self.statement_timeout = statement_timeout
+        # optional cost guard thresholds (limit_rows, refuse_rows, limit_cost, refuse_cost) over the defaults
+        self.cost_guard = cost_guard
 
     def to_dict(self):
         """Convert to DynamoDB item format"""
@@ -27,6 +38,9 @@ class ProfileConfigEntity:
             'tables': self.tables,
             'comments': self.comments,
             'tables_info': self.tables_info,
+            'column_stats': self.column_stats,
+            'statement_timeout': self.statement_timeout,
+            'cost_guard': self.cost_guard,
         }
 
 
@@ -112,8 +126,14 @@ class ProfileConfigDao:
         return True
 
     def get_profile_list(self):
-        response = self.table.scan()
-        return [ProfileConfigEntity(**item) for item in response['Items']]
+        return [ProfileConfigEntity(**item) for item in scan_table(self.table)]
+
+    def get_profile_items(self, attributes):
+        """Only the given attributes of all profiles, without the potentially large tables_info"""
+        return scan_table(self.table, attributes=attributes)
+
+    def get_profile_names(self):
+        return [item['profile_name'] for item in self.get_profile_items(['profile_name'])]
 
     def update_table_def(self, profile_name, tables_info):
         try:
@@ -133,4 +153,64 @@ class ProfileConfigDao:
             )
             raise
         else:
-            return response["Attributes"]
\ No newline at end of file
+            return response["Attributes"]
+
+    def update_column_stats(self, profile_name, column_stats: dict):
+        # DynamoDB does not accept floats, numbers are stored as Decimal
+        column_stats = json.loads(json.dumps(column_stats), parse_float=Decimal)
+        try:
+            self.table.update_item(
+                Key={"profile_name": profile_name},
+                UpdateExpression="set column_stats=:stats",
+                ExpressionAttributeValues={":stats": column_stats},
+            )
+        except ClientError as err:
+            logger.error(
+                "Couldn't update column statistics of profile %s in table %s. Here's why: %s: %s",
+                profile_name,
+                self.table.name,
+                err.response["Error"]["Code"],
+                err.response["Error"]["Message"],
+            )
+            raise
+
+    def update_table_entries(self, profile_name, updated_tables: dict, removed_tables=()):
+        """
+        Patch single entries of tables_info (set the updated tables, remove the dropped ones)
+        instead of rewriting the whole map. Table names go through attribute name placeholders,
+        as they may contain dots.
+        """
+        actions = [('set', name, info) for name, info in updated_tables.items()]
+        actions += [('remove', name, None) for name in removed_tables]
+        # keep each update expression well below the DynamoDB expression size limit
+        for start in range(0, len(actions), 25):
+            set_clauses, remove_clauses, names, values = [], [], {}, {}
+            for i, (action, name, info) in enumerate(actions[start:start + 25]):
+                names[f'#t{i}'] = name
+                if action == 'set':
+                    set_clauses.append(f'tables_info.#t{i} = :t{i}')
+                    values[f':t{i}'] = info
+                else:
+                    remove_clauses.append(f'tables_info.#t{i}')
+            update_expression = ''
+            if set_clauses:
+                update_expression += 'SET ' + ', '.join(set_clauses)
+            if remove_clauses:
+                update_expression += ' REMOVE ' + ', '.join(remove_clauses)
+            kwargs = {'ExpressionAttributeValues': values} if values else {}
+            try:
+                self.table.update_item(
+                    Key={"profile_name": profile_name},
+                    UpdateExpression=update_expression.strip(),
+                    ExpressionAttributeNames=names,
+                    **kwargs,
+                )
+            except ClientError as err:
+                logger.error(
+                    "Couldn't patch tables_info of profile %s in table %s. Here's why: %s: %s",
+                    profile_name,
+                    self.table.name,
+                    err.response["Error"]["Code"],
+                    err.response["Error"]["Message"],
+                )
+                raise
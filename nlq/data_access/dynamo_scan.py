@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from utils.env_var import DYNAMODB_SCAN_SEGMENTS
+
+
+def _scan_segment(table, kwargs):
+    items = []
+    while True:
+        response = table.scan(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs = dict(kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+
+
+def scan_table(table, attributes=None, segments=DYNAMODB_SCAN_SEGMENTS) -> list:
+    """
+    All items of the table, following LastEvaluatedKey across the 1 MB scan pages.
+    attributes limits the returned attributes (ProjectionExpression), segments > 1 scans that many
+    segments of the table in parallel.
+    """
+    kwargs = {}
+    if attributes:
+        # placeholders, as attribute names like comment or name are DynamoDB reserved words
+        names = {f'#a{i}': attribute for i, attribute in enumerate(attributes)}
+        kwargs['ProjectionExpression'] = ', '.join(names)
+        kwargs['ExpressionAttributeNames'] = names
+    if segments <= 1:
+        return _scan_segment(table, kwargs)
+
+    def scan_segment(segment):
+        # boto3 resources are not thread safe, every segment scans through its own
+        segment_table = boto3.session.Session().resource('dynamodb').Table(table.name)
+        return _scan_segment(segment_table, dict(kwargs, Segment=segment, TotalSegments=segments))
+
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix='dynamodb-scan') as executor:
+        return [item for items in executor.map(scan_segment, range(segments)) for item in items]
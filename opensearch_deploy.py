@@ -1,6 +1,5 @@
-import json
 from utils import opensearch
-from opensearchpy import OpenSearch
+from utils.llm import create_vector_embedding_with_bedrock
 from dotenv import load_dotenv
 import os
 import boto3
@@ -77,40 +76,7 @@ def index_to_opensearch():
                                                                      REGION_NAME,
                                                                      index_name)
     else:
-        auth = (opensearch_user, opensearch_password)
-        host = AOS_HOST
-        port = AOS_PORT
-        # Create the client with SSL/TLS enabled, but hostname verification disabled.
-        opensearch_client = OpenSearch(
-            hosts=[{'host': host, 'port': port}],
-            http_compress=True,  # enables gzip compression for request bodies
-            http_auth=auth,
-            use_ssl=True,
-            verify_certs=False,
-            ssl_assert_hostname=False,
-            ssl_show_warn=False
-        )
-
-    def create_vector_embedding_with_bedrock(text, index_name, bedrock_client):
-        payload = {"inputText": f"{text}"}
-        body = json.dumps(payload)
-        modelId = "amazon.titan-embed-text-v1"
-        accept = "application/json"
-        contentType = "application/json"
-
-        response = bedrock_client.invoke_model(
-            body=body, modelId=modelId, accept=accept, contentType=contentType
-        )
-        response_body = json.loads(response.get("body").read())
-
-        embedding = response_body.get("embedding")
-        return {"_index": index_name, "text": text, "vector_field": embedding}
-
-
-    def get_bedrock_client(region):
-        bedrock_client = boto3.client("bedrock-runtime", region_name=region)
-        return bedrock_client
-
+        opensearch_client = opensearch.get_opensearch_client(AOS_HOST, AOS_PORT, opensearch_user, opensearch_password)
 
     # Check if to delete OpenSearch index with the argument passed to the script --recreate 1
     # response = opensearch.delete_opensearch_index(opensearch_client, name)
@@ -130,9 +96,6 @@ def index_to_opensearch():
 
     all_records = bulk_questions
 
-    # Initialize bedrock client
-    bedrock_client = get_bedrock_client(BEDROCK_REGION)
-
     # Vector embedding using Amazon Bedrock Titan text embedding
     all_json_records = []
     print(f"Creating embeddings for records")
@@ -141,7 +104,8 @@ def index_to_opensearch():
     i = 0
     for record in all_records:
         i += 1
-        records_with_embedding = create_vector_embedding_with_bedrock(record['question'], index_name, bedrock_client)
+        # embeddings are shared with the query path through the local embedding cache
+        records_with_embedding = create_vector_embedding_with_bedrock(record['question'], index_name)
         print(f"Embedding for record {i} created")
         records_with_embedding['sql'] = record['sql']
         records_with_embedding['profile'] = record.get('profile', 'default')
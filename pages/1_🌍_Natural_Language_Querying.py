@@ -1,17 +1,32 @@
 import json
 import os
+import time
 import streamlit as st
 import pandas as pd
-import plotly.express as px
 from dotenv import load_dotenv
 from loguru import logger
 
 from nlq.business.connection import ConnectionManagement
 from nlq.business.profile import ProfileManagement
+from nlq.business.schema_refresh import schema_refresher
 from utils.database import get_db_url_dialect
-from utils.llm import claude_to_sql, create_vector_embedding_with_bedrock, retrieve_results_from_opensearch, \
-    upload_results_to_opensearch
-from utils.apis import query_from_sql_pd
+from utils.llm import claude_to_sql_stream, create_vector_embedding_with_bedrock, retrieve_results_from_opensearch, \
+    upload_results_to_opensearch, get_llm_cache_stats, extract_sql_from_response
+from utils.prompt import compile_prompt_prefix, get_profile_version
+from utils.env_var import TABLE_PAGE_SIZE, SQL_REWRITE_ENABLED, SQL_DEFAULT_LIMIT, QUERY_STATEMENT_TIMEOUT, NLQ_RETRIEVAL_TIMEOUT, NLQ_STAGE_TIMEOUT, PROFILE_CACHE_TTL, SCHEMA_LINKING_TOP_N, \
+    SCHEMA_LINKING_MAX_COLUMNS, SCHEMA_LINKING_MIN_SCORE, SCHEMA_LINKING_USE_EMBEDDING
+from utils.pipeline import StageGraph
+from utils.schema_linking import prune_tables_info, embedding_table_scores
+from utils.apis import cached_query_from_sql_pd, submit_query_from_sql_pd
+from utils.chart_data import get_chart_figure, get_page
+from utils.column_stats import annotate_tables_info
+from utils.cost_guard import QueryRefused, get_cost_limits
+from utils.sql_rewrite import rewrite_sql, SqlValidationError
+from utils.query_control import QueryHandle, QueryCancelled, QueryTimeout, get_query_control_stats
+from utils.result_cache import invalidate_result_cache, get_result_cache_stats
+
+# Streamlit >= 1.33 can rerun a fragment on its own when one of its widgets changes
+visualization_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None)
 
 
 class NLQChain:
@@ -22,6 +37,13 @@ class NLQChain:
         self.retrieve_samples = []
         self.generated_sql_response = ''
         self.executed_result_df: pd.DataFrame | None = None
+        self.executed_result_future = None
+        self.executed_sql = ''
+        self.sql_rewrite_notes = []
+        self.query_handle: QueryHandle | None = None
+        self.sql_execution_cancelled = False
+        self.cost_guard_enabled = True
+        self.db_url = None
         self.visualization_config_change: bool = False
 
     def set_question(self, question):
@@ -29,6 +51,10 @@ class NLQChain:
             self.retrieve_samples = []
             self.generated_sql_response = ''
             self.executed_result_df = None
+            self.executed_result_future = None
+            self.executed_sql = ''
+            self.sql_rewrite_notes = []
+            self.query_handle = None
         self.question = question
 
     def get_question(self):
@@ -58,15 +84,71 @@ class NLQChain:
     def set_executed_result_df(self, df):
         self.executed_result_df = df
 
+    def set_db_url(self, db_url):
+        self.db_url = db_url
+
+    def get_db_url(self):
+        if not self.db_url:
+            self.db_url = resolve_profile_db_url(st.session_state['profiles'][self.profile])
+        return self.db_url
+
+    def set_cost_guard_enabled(self, enabled):
+        self.cost_guard_enabled = enabled
+
+    def get_statement_timeout(self):
+        # stored in DynamoDB as a Decimal number of seconds, unset or 0 uses the default
+        statement_timeout = st.session_state['profiles'][self.profile].get('statement_timeout')
+        return float(statement_timeout) if statement_timeout else QUERY_STATEMENT_TIMEOUT
+
+    def rewrite_sql(self, sql):
+        """
+        Validate the generated sql against the profile tables and rewrite it for execution,
+        raises SqlValidationError without a database round trip
+        """
+        if not SQL_REWRITE_ENABLED:
+            return sql
+        database_profile = st.session_state['profiles'][self.profile]
+        sql, self.sql_rewrite_notes = rewrite_sql(sql, get_db_url_dialect(self.get_db_url()),
+                                                  database_profile['tables_info'], max_rows=SQL_DEFAULT_LIMIT,
+                                                  read_dialect=database_profile.get('generated_sql_dialect'))
+        return sql
+
+    def execute_sql_async(self, sql):
+        """Start executing the sql on a worker thread, picked up later by get_executed_result_df"""
+        self.executed_result_df = None
+        self.executed_sql = sql = self.rewrite_sql(sql)
+        self.sql_execution_cancelled = False
+        self.query_handle = QueryHandle(self.get_db_url(), timeout=self.get_statement_timeout())
+        cost_limits = get_cost_limits(st.session_state['profiles'][self.profile]) if self.cost_guard_enabled else None
+        self.executed_result_future = submit_query_from_sql_pd(p_db_url=self.get_db_url(), query=sql,
+                                                               tag=self.profile, handle=self.query_handle,
+                                                               cost_limits=cost_limits)
+
+    def is_sql_execution_done(self):
+        return self.executed_result_future is None or self.executed_result_future.done() or \
+            (self.query_handle is not None and self.query_handle.cancelled)
+
+    def cancel_sql_execution(self):
+        if self.query_handle is not None:
+            self.query_handle.cancel()
+        self.sql_execution_cancelled = True
+
     def get_executed_result_df(self, force_execute_query=True):
+        if self.executed_result_df is None and self.executed_result_future is not None and \
+                (force_execute_query or self.executed_result_future.done()):
+            future = self.executed_result_future
+            self.executed_result_future = None
+            if self.query_handle is not None and self.query_handle.cancelled:
+                # also covers a query shared with another session, which keeps running for the other waiters
+                raise QueryCancelled('The query was cancelled.')
+            self.executed_result_df = future.result()
+
         if self.executed_result_df is None and force_execute_query:
-            db_url = st.session_state['profiles'][self.profile]['db_url']
-            if not db_url:
-                conn_name = st.session_state['profiles'][self.profile]['conn_name']
-                db_url = ConnectionManagement.get_db_url_by_name(conn_name)
-            self.executed_result_df = query_from_sql_pd(
-                p_db_url=db_url,
-                query=self.get_generated_sql())
+            self.executed_sql = self.rewrite_sql(self.get_generated_sql())
+            self.executed_result_df = cached_query_from_sql_pd(
+                p_db_url=self.get_db_url(),
+                query=self.executed_sql,
+                tag=self.profile)
 
         return self.executed_result_df
 
@@ -77,6 +159,113 @@ class NLQChain:
         return self.visualization_config_change
 
 
+@st.cache_resource(ttl=PROFILE_CACHE_TTL, show_spinner=False)
+def load_all_profiles(_env_vars, profiles_version):
+    """
+    Profiles shared by all sessions, with their prompt version stamps computed once per process.
+    profiles_version is the profile cache version stamp, a profile write in this process loads them again.
+    """
+    demo_profile = {}
+    for i, v in _env_vars['data_sources'].items():
+        if 'is_demo' in v and v['is_demo']:
+            demo_profile[i + '(demo)'] = v
+
+    # get all user defined profiles with light info (conn_name, comments), tables_info is loaded once selected
+    all_profiles = ProfileManagement.get_all_profiles_with_info()
+    all_profiles.update(demo_profile)
+    for profile in all_profiles.values():
+        if profile.get('details_loaded', True):
+            get_profile_version(profile)
+    return all_profiles
+
+
+@st.cache_resource(ttl=PROFILE_CACHE_TTL, show_spinner=False)
+def load_profile_details(profile_name, profile_version, _light_profile):
+    """
+    New profile dict of a user defined profile with its tables_info and column statistics,
+    fetched only once it is selected. Precomputed column statistics become value hints in the DDL
+    used for schema linking and prompts.
+    """
+    details = ProfileManagement.get_profile_details(profile_name)
+    details['tables_info'] = annotate_tables_info(details['tables_info'], details['column_stats'])
+    database_profile = dict(_light_profile, **details)
+    database_profile.pop('version', None)
+    get_profile_version(database_profile)
+    return database_profile
+
+
+def ensure_profile_details(profile_name, profiles):
+    """
+    Replace the light entry of the selected profile in the session profiles with the detailed one.
+    The entries are shared by all sessions through the cache, so they are never modified in place.
+    """
+    if not profiles[profile_name].get('details_loaded', True):
+        profiles[profile_name] = load_profile_details(profile_name, ProfileManagement.get_cache_version(profile_name),
+                                                      profiles[profile_name])
+
+
+def resolve_profile_db_url(database_profile):
+    db_url = database_profile['db_url']
+    if not db_url:
+        db_url = ConnectionManagement.get_db_url_by_name(database_profile['conn_name'])
+    return db_url
+
+
+def build_nlq_pipeline(nlq_chain, database_profile, question, aos_config, retrieve, prune_schema=True):
+    """
+    Stages before SQL generation: embedding -> kNN retrieval, schema pruning -> prompt prefix rendering
+    and db url resolving run concurrently.
+    Slow or failed retrieval falls back to no examples instead of blocking generation,
+    failed schema pruning falls back to the full DDL.
+    """
+    pipeline = StageGraph('nlq_pipeline')
+    if retrieve:
+        pipeline.add_stage('embedding',
+                           lambda: create_vector_embedding_with_bedrock(
+                               question, index_name=aos_config['index_name'])['vector_field'],
+                           timeout=NLQ_RETRIEVAL_TIMEOUT, fallback=None)
+        pipeline.add_stage('retrieval',
+                           lambda embedding: retrieve_results_from_opensearch(
+                               index_name=aos_config['index_name'],
+                               region_name=aos_config['region_name'],
+                               domain=aos_config['domain'],
+                               opensearch_user=aos_config['opensearch_user'],
+                               opensearch_password=aos_config['opensearch_password'],
+                               host=aos_config['opensearch_host'],
+                               port=aos_config['opensearch_port'],
+                               query_embedding=embedding,
+                               top_k=3),
+                           deps=['embedding'], timeout=NLQ_RETRIEVAL_TIMEOUT, fallback=[])
+    tables_info = database_profile['tables_info']
+    if not prune_schema:
+        pipeline.add_stage('tables_info', lambda: tables_info)
+    elif retrieve and SCHEMA_LINKING_USE_EMBEDDING:
+        embed = lambda text: create_vector_embedding_with_bedrock(text, index_name=aos_config['index_name'])[
+            'vector_field']
+        pipeline.add_stage('tables_info',
+                           lambda embedding: prune_tables_info(
+                               tables_info, question, top_n=SCHEMA_LINKING_TOP_N,
+                               max_columns=SCHEMA_LINKING_MAX_COLUMNS, min_score=SCHEMA_LINKING_MIN_SCORE,
+                               table_scores=embedding_table_scores(tables_info, embedding, embed)),
+                           deps=['embedding'], timeout=NLQ_STAGE_TIMEOUT, fallback=tables_info)
+    else:
+        pipeline.add_stage('tables_info',
+                           lambda: prune_tables_info(tables_info, question, top_n=SCHEMA_LINKING_TOP_N,
+                                                     max_columns=SCHEMA_LINKING_MAX_COLUMNS,
+                                                     min_score=SCHEMA_LINKING_MIN_SCORE),
+                           timeout=NLQ_STAGE_TIMEOUT, fallback=tables_info)
+    pipeline.add_stage('prompt_prefix',
+                       lambda tables_info: compile_prompt_prefix(nlq_chain.get_profile(), database_profile,
+                                                                 tables_info).prefix,
+                       deps=['tables_info'], timeout=NLQ_STAGE_TIMEOUT, fallback=None)
+    if nlq_chain.db_url:
+        pipeline.add_stage('db_url', lambda: nlq_chain.db_url)
+    else:
+        pipeline.add_stage('db_url', lambda: resolve_profile_db_url(database_profile),
+                           timeout=NLQ_STAGE_TIMEOUT, fallback=None)
+    return pipeline
+
+
 def sample_question_clicked(sample):
     """Update the selected_sample variable with the text of the clicked button"""
     st.session_state['selected_sample'] = sample
@@ -100,46 +289,141 @@ def upvote_clicked(question, sql, env_vars):
     logger.info(f'up voted "{question}" with sql "{sql}"')
 
 
+def render_streaming_response(response_stream, nlq_chain=None):
+    """
+    Render the LLM response incrementally while it is streamed, return the full text.
+    If nlq_chain is given, the SQL is executed as soon as its code block is closed,
+    overlapping the database query with the rest of the generation.
+    """
+    placeholder = st.empty()
+    query_status = st.empty()
+    placeholder.markdown('Generating SQL...')
+    response = ''
+    sql_dispatched = False
+    query_reported = False
+    for piece in response_stream:
+        response += piece
+        placeholder.markdown(response + '▌')
+        if nlq_chain is None:
+            continue
+        if not sql_dispatched:
+            sql = extract_sql_from_response(response)
+            if sql is not None:
+                logger.info('sql block completed, start executing while the explanation is generated')
+                sql_dispatched = True
+                try:
+                    nlq_chain.execute_sql_async(sql)
+                    query_status.caption('Querying database...')
+                except SqlValidationError as e:
+                    # reported when the results are visualized
+                    logger.info(f'generated sql is invalid: {e}')
+                    query_reported = True
+        elif not query_reported and nlq_chain.is_sql_execution_done():
+            query_status.caption('Query finished, results are ready.')
+            query_reported = True
+    placeholder.empty()
+    query_status.empty()
+    return response
+
+
+def wait_for_sql_execution(nlq_chain):
+    """
+    Wait for the query worker with a Cancel button, showing the first chunk as soon as it is fetched.
+    Clicking Cancel reruns the script, the button callback then cancels the query on the database server.
+    """
+    handle = nlq_chain.query_handle
+    status = st.empty()
+    preview = st.empty()
+    cancel = st.empty()
+    cancel.button('Cancel', on_click=nlq_chain.cancel_sql_execution, key='cancel_sql_execution')
+    preview_shown = False
+    while not nlq_chain.is_sql_execution_done():
+        status.caption(f'Querying database... {handle.elapsed():.0f}s')
+        if not preview_shown and handle.preview is not None:
+            preview.dataframe(handle.preview, use_container_width=True)
+            preview_shown = True
+        time.sleep(0.2)
+    status.empty()
+    preview.empty()
+    cancel.empty()
+
+
+def render_visualization(nlq_chain, sql_query_result):
+    """
+    Chart selection and rendering. With st.fragment (Streamlit >= 1.33) a selection change reruns only this function,
+    otherwise it flags the change so the page re-renders the answered question from memory.
+    Figures are memoized on (result fingerprint, chart config) either way.
+    """
+    on_change = None if visualization_fragment is not None else nlq_chain.set_visualization_config_change
+    # Auto-detect columns
+    visualize_config_columns = st.columns(3)
+
+    available_columns = sql_query_result.columns
+
+    chart_type = visualize_config_columns[0].selectbox('Choose the chart type',
+                                                       ['Table', 'Bar', 'Line', 'Pie'],
+                                                       on_change=on_change)
+    if chart_type != 'Table':
+        x_column = visualize_config_columns[1].selectbox('Choose x-axis column', available_columns,
+                                                         on_change=on_change)
+        y_column = visualize_config_columns[2].selectbox('Choose y-axis column',
+                                                         reversed(available_columns.to_list()),
+                                                         on_change=on_change)
+    if chart_type == 'Table':
+        page = 1
+        page_count = max(1, -(-len(sql_query_result) // TABLE_PAGE_SIZE))
+        if page_count > 1:
+            page = st.number_input(f'Page (of {page_count})', min_value=1, max_value=page_count, value=1,
+                                   on_change=on_change)
+        st.dataframe(get_page(sql_query_result, page, TABLE_PAGE_SIZE), use_container_width=True)
+    else:
+        figure, chart_note = get_chart_figure(sql_query_result, chart_type, x_column, y_column)
+        if chart_note:
+            st.caption(chart_note)
+        st.plotly_chart(figure)
+
+
+if visualization_fragment is not None:
+    render_visualization = visualization_fragment(render_visualization)
+
+
 def do_visualize_results(nlq_chain):
     with st.chat_message("assistant"):
-        if nlq_chain.get_executed_result_df(force_execute_query=False) is None:
-            logger.info('try to execute the generated sql')
-            with st.spinner('Querying database...'):
-                sql_query_result = nlq_chain.get_executed_result_df()
-        else:
+        try:
+            if nlq_chain.get_executed_result_df(force_execute_query=False) is None:
+                logger.info('try to execute the generated sql')
+                if nlq_chain.executed_result_future is None:
+                    nlq_chain.execute_sql_async(nlq_chain.get_generated_sql())
+                wait_for_sql_execution(nlq_chain)
             sql_query_result = nlq_chain.get_executed_result_df()
+        except SqlValidationError as e:
+            st.error(f'The generated SQL was not executed: {e}')
+            return
+        except (QueryCancelled, QueryTimeout, QueryRefused) as e:
+            st.warning(str(e))
+            return
+        if nlq_chain.sql_rewrite_notes:
+            with st.expander(' '.join(nlq_chain.sql_rewrite_notes)):
+                st.code(nlq_chain.executed_sql, language='sql')
         st.markdown('Visualizing the results:')
         if sql_query_result is not None:
+            if sql_query_result.attrs.get('cached_at'):
+                age = int(time.time() - sql_query_result.attrs['cached_at'])
+                st.caption(f'Served from the result cache, {age}s old.')
+            if sql_query_result.attrs.get('cost_guard'):
+                st.info(sql_query_result.attrs['cost_guard'])
+            if sql_query_result.attrs.get('truncated'):
+                st.warning(f'Only the first {len(sql_query_result)} rows of the query result are shown.')
             # Reset change flag to False
             nlq_chain.set_visualization_config_change(False)
-            # Auto-detect columns
-            visualize_config_columns = st.columns(3)
-
-            available_columns = sql_query_result.columns
-
-            chart_type = visualize_config_columns[0].selectbox('Choose the chart type',
-                                                               ['Table', 'Bar', 'Line', 'Pie'],
-                                                               on_change=nlq_chain.set_visualization_config_change)
-            if chart_type != 'Table':
-                x_column = visualize_config_columns[1].selectbox('Choose x-axis column', available_columns,
-                                                                 on_change=nlq_chain.set_visualization_config_change)
-                y_column = visualize_config_columns[2].selectbox('Choose y-axis column',
-                                                                 reversed(available_columns.to_list()),
-                                                                 on_change=nlq_chain.set_visualization_config_change)
-            if chart_type == 'Table':
-                st.table(sql_query_result)
-            elif chart_type == 'Bar':
-                st.plotly_chart(px.bar(sql_query_result, x=x_column, y=y_column))
-            elif chart_type == 'Line':
-                st.plotly_chart(px.line(sql_query_result, x=x_column, y=y_column))
-            elif chart_type == 'Pie':
-                st.plotly_chart(px.pie(sql_query_result, names=x_column, values=y_column))
+            render_visualization(nlq_chain, sql_query_result)
         else:
             st.markdown('No visualization generated.')
 
 
 def main():
     load_dotenv()
+    schema_refresher.start()
 
     # load config.json as dictionary
     with open(os.path.join(os.getcwd(), 'config_files', '1_config.json')) as f:
@@ -161,17 +445,9 @@ def main():
     st.divider()
 
     # Initialize or set up state variables
-    if 'profiles' not in st.session_state:
-        demo_profile = {}
-        for i, v in env_vars['data_sources'].items():
-            if 'is_demo' in v and v['is_demo']:
-                demo_profile[i + '(demo)'] = v
-
-        # get all user defined profiles with info (db_url, conn_name, tables_info, hints, search_samples)
-        all_profiles = ProfileManagement.get_all_profiles_with_info()
-        all_profiles.update(demo_profile)
-        st.session_state['profiles'] = all_profiles
-        # logger.info(f'{all_profiles=}')
+    # cached per process, so this is a DynamoDB read only when the profiles changed or their cache expired
+    # copied per session, so replacing the entry of the selected profile does not touch the other sessions
+    st.session_state['profiles'] = dict(load_all_profiles(env_vars, ProfileManagement.get_cache_version()))
 
     if 'option' not in st.session_state:
         st.session_state['option'] = 'Text2SQL'
@@ -203,12 +479,29 @@ def main():
             st.session_state.current_profile = selected_profile
 
             st.session_state.nlq_chain = NLQChain(selected_profile)
+        if selected_profile is not None:
+            ensure_profile_details(selected_profile, st.session_state.profiles)
 
         st.session_state['option'] = st.selectbox("Choose your option", ["Text2SQL"])
         model_type = st.selectbox("Choose your model", bedrock_model_ids)
 
         use_rag = st.checkbox("Using RAG from Q/A Embedding", True)
         visualize_results = st.checkbox("Visualize Results", True)
+        pipelined_execution = st.checkbox("Execute SQL while generating explanation", True)
+        prune_schema = st.checkbox("Send only relevant tables to the model", True)
+        st.session_state.nlq_chain.set_cost_guard_enabled(st.checkbox("Check query cost before execution", True))
+
+        llm_cache_stats = get_llm_cache_stats()
+        st.caption(f"LLM cache: {llm_cache_stats['memory_hits'] + llm_cache_stats['disk_hits']} hits, "
+                   f"{llm_cache_stats['misses']} misses, {llm_cache_stats['saved_seconds']:.1f}s saved")
+        result_cache_stats = get_result_cache_stats()
+        st.caption(f"Result cache: {result_cache_stats['entries']} entries, "
+                   f"{result_cache_stats['bytes'] / 1024 / 1024:.1f} MB, {result_cache_stats['hit_rate']:.0%} hit rate")
+        if st.button('Clear cached results of this profile'):
+            invalidate_result_cache(selected_profile)
+        query_control_stats = get_query_control_stats()
+        st.caption(f"Queries timed out: {query_control_stats['timeouts']}, "
+                   f"cancelled: {query_control_stats['cancels']}")
 
     # Part II: Search Section
     st.subheader("Start Searching")
@@ -259,45 +552,27 @@ def main():
                 current_nlq_chain.set_question(search_box)
                 st.markdown(current_nlq_chain.get_question())
             with st.chat_message("assistant"):
-                retrieve_result = []
-                if not current_nlq_chain.get_retrieve_samples():
-                    logger.info(f'try to get retrieve samples from open search')
-                    with st.spinner('Retrieving Q/A (Take up to 5s)'):
-                        logger.info('Retrieving samples...')
-                        retrieve_result = None
-                        if use_rag:
-                            try:
-                                # HACK: always use first opensearch
-                                origin_selected_profile = selected_profile
-                                selected_profile = "shopping_guide"
-
-                                records_with_embedding = create_vector_embedding_with_bedrock(
-                                    search_box,
-                                    index_name=env_vars['data_sources'][selected_profile]['opensearch']['index_name'])
-                                retrieve_result = retrieve_results_from_opensearch(
-                                    index_name=env_vars['data_sources'][selected_profile]['opensearch']['index_name'],
-                                    region_name=env_vars['data_sources'][selected_profile]['opensearch']['region_name'],
-                                    domain=env_vars['data_sources'][selected_profile]['opensearch']['domain'],
-                                    opensearch_user=env_vars['data_sources'][selected_profile]['opensearch'][
-                                        'opensearch_user'],
-                                    opensearch_password=env_vars['data_sources'][selected_profile]['opensearch'][
-                                        'opensearch_password'],
-                                    host=env_vars['data_sources'][selected_profile]['opensearch'][
-                                        'opensearch_host'],
-                                    port=env_vars['data_sources'][selected_profile]['opensearch'][
-                                        'opensearch_port'],
-                                    query_embedding=records_with_embedding['vector_field'],
-                                    top_k=3)
-                                selected_profile = origin_selected_profile
-
-                                current_nlq_chain.set_retrieve_samples(retrieve_result)
-                            except Exception as e:
-                                logger.exception(e)
-                                logger.info(f"Failed to retrieve Q/A from OpenSearch: {str(e)}")
-                                retrieve_result = []
-                                selected_profile = origin_selected_profile
-                else:
-                    logger.info(f'get retrieve samples from memory: {len(current_nlq_chain.get_retrieve_samples())}')
+                database_profile = st.session_state.profiles[selected_profile]
+                # HACK: always use first opensearch
+                aos_config = env_vars['data_sources']['shopping_guide']['opensearch']
+                retrieve_result = None
+                stage_results = None
+                # reruns for an answered question (e.g. chart changes) need neither retrieval nor the prompt
+                if not current_nlq_chain.get_generated_sql_response():
+                    retrieve = use_rag and not current_nlq_chain.get_retrieve_samples()
+                    if not retrieve:
+                        logger.info(f'get retrieve samples from memory: '
+                                    f'{len(current_nlq_chain.get_retrieve_samples())}')
+                    nlq_pipeline = build_nlq_pipeline(current_nlq_chain, database_profile, search_box, aos_config,
+                                                      retrieve, prune_schema=prune_schema)
+                    with st.spinner('Retrieving Q/A and preparing prompt (Take up to 5s)'):
+                        stage_results = nlq_pipeline.run()
+
+                    if retrieve:
+                        retrieve_result = stage_results['retrieval']
+                        current_nlq_chain.set_retrieve_samples(retrieve_result)
+                    if stage_results['db_url']:
+                        current_nlq_chain.set_db_url(stage_results['db_url'])
 
                 with st.expander(f'Retrieve result: {len(current_nlq_chain.get_retrieve_samples())}'):
                     examples = []
@@ -309,18 +584,20 @@ def main():
 
                 if not current_nlq_chain.get_generated_sql_response():
                     logger.info('try to get generated sql from LLM')
-                    with st.spinner('Generating SQL... (Take up to 20s)'):
-                        # Whether Retrieving Few Shots from Database
-                        logger.info('Sending request...')
-                        database_profile = st.session_state.profiles[selected_profile]
-                        response = claude_to_sql(database_profile['tables_info'],
-                                                 database_profile['hints'],
-                                                 search_box,
-                                                 examples=retrieve_result,
-                                                 dialect=get_db_url_dialect(database_profile['db_url']))
-
-                        logger.info(f'got llm response: {response}')
-                        current_nlq_chain.set_generated_sql_response(response)
+                    # Whether Retrieving Few Shots from Database
+                    logger.info('Sending request...')
+                    response_stream = claude_to_sql_stream(database_profile['tables_info'],
+                                                           database_profile['hints'],
+                                                           search_box,
+                                                           examples=retrieve_result,
+                                                           dialect=get_db_url_dialect(database_profile['db_url']),
+                                                           profile_name=selected_profile,
+                                                           prompt_prefix=stage_results['prompt_prefix'])
+                    response = render_streaming_response(
+                        response_stream, nlq_chain=current_nlq_chain if visualize_results and pipelined_execution else None)
+
+                    logger.info(f'got llm response: {response}')
+                    current_nlq_chain.set_generated_sql_response(response)
                 else:
                     logger.info('get generated sql from memory')
 
@@ -360,6 +637,9 @@ def main():
                 do_visualize_results(current_nlq_chain)
         else:
             st.error("Please enter a valid query.")
+    elif current_nlq_chain.sql_execution_cancelled:
+        current_nlq_chain.sql_execution_cancelled = False
+        st.warning('The query was cancelled.')
 
 
 if __name__ == '__main__':
@@ -4,14 +4,34 @@ from dotenv import load_dotenv
 from loguru import logger
 from nlq.business.connection import ConnectionManagement
 from nlq.business.profile import ProfileManagement
+from nlq.business.schema_refresh import schema_refresher
+from utils.cost_guard import DEFAULT_COST_LIMITS
+
+COST_GUARD_FIELDS = {
+    'limit_rows': 'Limit queries scanning more rows than',
+    'refuse_rows': 'Refuse queries scanning more rows than',
+    'limit_cost': 'Limit queries with a planner cost above',
+    'refuse_cost': 'Refuse queries with a planner cost above',
+}
 
 def new_profile_clicked():
     st.session_state.profile_page_mode = 'new'
     st.session_state.current_profile_name = None
 
 
+def cost_guard_input(current=None):
+    """Optional per-profile cost guard thresholds, None keeps the defaults"""
+    if not st.checkbox("Custom query cost thresholds", value=bool(current)):
+        return None
+    current = current or {}
+    return {key: st.number_input(label, min_value=0, step=1000,
+                                 value=int(current.get(key, DEFAULT_COST_LIMITS[key])))
+            for key, label in COST_GUARD_FIELDS.items()}
+
+
 def main():
     load_dotenv()
+    schema_refresher.start()
     logger.info('start data profile management')
     st.set_page_config(page_title="Data Profile Management", )
 
@@ -36,17 +56,24 @@ def main():
         if selected_conn_name:
             conn_config = ConnectionManagement.get_conn_config_by_name(selected_conn_name)
             schema_names = st.multiselect("Schema Name", ConnectionManagement.get_all_schemas_by_config(conn_config))
+            if st.button('Refresh tables from database'):
+                ConnectionManagement.refresh_schema_cache(conn_config)
             tables_from_db = ConnectionManagement.get_table_name_by_config(conn_config, schema_names)
             print(tables_from_db)
             selected_tables = st.multiselect("Select tables included in this profile", tables_from_db)
             comments = st.text_input("Comments")
+            statement_timeout = st.number_input("Query timeout in seconds (0 uses the default)", min_value=0,
+                                                value=0, step=10)
+            cost_guard = cost_guard_input()
 
             if st.button('Create Profile', type='primary'):
                 if not selected_tables:
                     st.error('Please select at least one table.')
                     return
                 with st.spinner('Creating profile...'):
-                    ProfileManagement.add_profile(profile_name, selected_conn_name, schema_names, selected_tables, comments)
+                    ProfileManagement.add_profile(profile_name, selected_conn_name, schema_names, selected_tables,
+                                                  comments, statement_timeout=statement_timeout or None,
+                                                  cost_guard=cost_guard)
                     st.success('Profile created.')
                     st.session_state.profile_page_mode = 'default'
 
@@ -59,6 +86,8 @@ def main():
         conn_config = ConnectionManagement.get_conn_config_by_name(selected_conn_name)
         schema_names = st.multiselect("Schema Name", ConnectionManagement.get_all_schemas_by_config(conn_config),
                                       default=current_profile.schemas)
+        if st.button('Refresh tables from database'):
+            ConnectionManagement.refresh_schema_cache(conn_config)
         tables_from_db = ConnectionManagement.get_table_name_by_config(conn_config, schema_names)
         # make sure all tables defined in profile are existing in the table list of the current database
         intersection_tables = set(tables_from_db) & set(current_profile.tables)
@@ -70,6 +99,9 @@ def main():
         selected_tables = st.multiselect("Select tables included in this profile", tables_from_db,
                                          default=intersection_tables)
         comments = st.text_input("Comments", value=current_profile.comments)
+        statement_timeout = st.number_input("Query timeout in seconds (0 uses the default)", min_value=0,
+                                            value=int(current_profile.statement_timeout or 0), step=10)
+        cost_guard = cost_guard_input(current_profile.cost_guard)
 
         if st.button('Update Profile', type='primary'):
             if not selected_tables:
@@ -77,19 +109,56 @@ def main():
                 return
             with st.spinner('Updating profile...'):
                 ProfileManagement.update_profile(profile_name, selected_conn_name, schema_names, selected_tables,
-                                                 comments)
+                                                 comments, statement_timeout=statement_timeout or None,
+                                                 cost_guard=cost_guard)
                 st.success('Profile updated. Please click "Fetch table definition" button to continue.')
 
         if st.button('Fetch table definition'):
             if not selected_tables:
                 st.error('Please select at least one table.')
             with st.spinner('fetching...'):
+                progress = st.progress(0.0, text='Fetching table definitions...')
+                failed_schemas = []
+
+                def on_progress(label, done, total, error):
+                    if error is not None:
+                        failed_schemas.append(label)
+                    progress.progress(done / total, text=f'Fetched {label} ({done}/{total})')
+
                 table_definitions = ConnectionManagement.get_table_definition_by_config(conn_config, schema_names,
-                                                                                        selected_tables)
+                                                                                        selected_tables,
+                                                                                        on_progress=on_progress)
+                if failed_schemas:
+                    # keep the stored definitions of the selected tables whose schema failed
+                    stored_tables_info = current_profile.tables_info or {}
+                    kept_tables = [table_name for table_name in selected_tables
+                                   if table_name not in table_definitions and table_name in stored_tables_info]
+                    table_definitions = dict({table_name: stored_tables_info[table_name] for table_name in kept_tables},
+                                             **table_definitions)
+                    st.warning(f'Failed to fetch the tables of {", ".join(failed_schemas)}, '
+                               f'the previously stored definitions of {len(kept_tables)} of their tables are kept.')
                 st.write(table_definitions)
                 ProfileManagement.update_table_def(profile_name, table_definitions)
                 st.session_state.profile_page_mode = 'default'
 
+        if st.button('Refresh changed tables'):
+            with st.spinner('Checking table definitions...'):
+                refreshed = ProfileManagement.refresh_changed_tables(profile_name)
+            if refreshed['changed'] or refreshed['removed']:
+                st.success(f"Updated tables: {', '.join(refreshed['changed']) or 'none'}; "
+                           f"removed tables: {', '.join(refreshed['removed']) or 'none'}")
+            else:
+                st.info('All table definitions are up to date.')
+
+        if st.button('Compute column statistics'):
+            with st.spinner('Sampling table columns...'):
+                column_stats = ProfileManagement.update_column_stats(profile_name)
+            if column_stats:
+                st.success(f'Column statistics computed for {len(column_stats)} tables.')
+                st.write(column_stats)
+            else:
+                st.warning('No column statistics computed, please fetch the table definitions first.')
+
         if st.button('Delete Profile'):
             ProfileManagement.delete_profile(profile_name)
             st.success(f"{profile_name} deleted successfully!")
@@ -0,0 +1,87 @@
+import time
+
+from utils.cache import LRUCache, TieredCache, EmbeddingCache, make_cache_key
+
+
+def test_make_cache_key_is_stable():
+    assert make_cache_key('m', {'a': 1, 'b': 2}) == make_cache_key('m', {'b': 2, 'a': 1})
+    assert make_cache_key('m', {'a': 1}) != make_cache_key('m', {'a': 2})
+
+
+def test_lru_eviction_and_ttl():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+
+    cache.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+
+
+def test_tiered_cache_survives_memory_loss(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    cache = TieredCache('test', path=path)
+    calls = []
+    cache.get_or_compute('k', lambda: calls.append(1) or 'sql', tag='profile_a')
+
+    # a fresh instance simulates a restarted process
+    restarted = TieredCache('test', path=path)
+    assert restarted.get_or_compute('k', lambda: calls.append(1) or 'other', tag='profile_a') == 'sql'
+    assert len(calls) == 1
+    assert restarted.get_stats()['disk_hits'] == 1
+
+    assert restarted.invalidate('profile_a') == 2
+    assert restarted.get('k') is None
+    assert restarted.get_stats()['misses'] == 1
+
+
+def test_embedding_cache_normalizes_text_and_bounds_size(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite3'), max_entries=2)
+    cache.set('titan', 'top  sellers ', [0.5, 0.25])
+    assert cache.get('titan', 'top sellers') == [0.5, 0.25]
+    assert cache.get('other-model', 'top sellers') is None
+
+    cache.set('titan', 'b', [1.0])
+    cache.set('titan', 'c', [2.0])
+    cache.memory.clear()
+    assert cache.get('titan', 'top sellers') is None
+    assert cache.get('titan', 'c') == [2.0]
+
+
+def test_query_result_cache_spills_and_invalidates(tmp_path):
+    import pandas as pd
+    from utils.result_cache import QueryResultCache, canonicalize_sql
+
+    assert canonicalize_sql("SELECT  a -- comment\nFROM t WHERE b = 'x  y';") == "SELECT a FROM t WHERE b = 'x  y'"
+
+    df = pd.DataFrame({'a': range(100), 'b': ['x'] * 100})
+    cache = QueryResultCache(max_bytes=3000, ttl=60, spill_path=str(tmp_path / 'results.sqlite3'))
+    cache.set('sqlite://', 'select * from t', df, tag='profile_a')
+    cache.set('sqlite://', 'select * from u', df, tag='profile_a')
+    assert cache.get_stats()['spilled'] == 1
+
+    cached = cache.get('sqlite://', 'select *\n  from t;')
+    assert cached['a'].tolist() == list(range(100))
+    assert cached.attrs['cached_at'] > 0
+    assert cache.get('other://', 'select * from t') is None
+
+    cache.invalidate('profile_a')
+    assert cache.get('sqlite://', 'select * from t') is None
+    assert cache.get('sqlite://', 'select * from u') is None
+
+
+def test_query_result_cache_keeps_frames_arrow_cannot_represent():
+    import pandas as pd
+    from utils.result_cache import QueryResultCache
+
+    cache = QueryResultCache(max_bytes=10 ** 6, ttl=60)
+    duplicated = pd.DataFrame([[1, 2]], columns=['user_id', 'user_id'])
+    mixed = pd.DataFrame({'value': [1, 'a', None]})
+    cache.set('sqlite://', 'select u.user_id, i.user_id from u, i', duplicated)
+    cache.set('sqlite://', 'select value from t', mixed)
+    assert list(cache.get('sqlite://', 'select u.user_id, i.user_id from u, i').columns) == ['user_id', 'user_id']
+    assert cache.get('sqlite://', 'select value from t')['value'].tolist()[:2] == [1, 'a']
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+from utils.chart_data import prepare_chart_data, lttb_indices, get_chart_figure, OTHER_LABEL
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    y = np.zeros(1000)
+    y[500] = 10.0
+    indices = lttb_indices(np.arange(1000, dtype=np.float64), y, 50)
+    assert len(indices) == 50
+    assert indices[0] == 0 and indices[-1] == 999
+    assert 500 in indices
+
+
+def test_prepare_chart_data_caps_points():
+    df = pd.DataFrame({'day': np.repeat(np.arange(5000), 2), 'sales': np.ones(10000),
+                       'category': [f'c{i % 50}' for i in range(10000)]})
+    line, note = prepare_chart_data(df, 'Line', 'day', 'sales', max_points=500)
+    assert len(line) == 500 and note
+
+    bar, _ = prepare_chart_data(df, 'Bar', 'category', 'sales', top_n=10)
+    assert len(bar) == 11
+    assert bar['category'].iloc[-1] == OTHER_LABEL
+    assert bar['sales'].sum() == 10000
+
+    months = pd.DataFrame({'month': ['Jan', 'Feb', 'Mar'], 'sales': [1, 2, 3]})
+    line, _ = prepare_chart_data(months, 'Line', 'month', 'sales')
+    assert line['month'].tolist() == ['Jan', 'Feb', 'Mar']
+    unordered = pd.DataFrame({'day': [3, 1, 2], 'sales': [1, 2, 3]})
+    assert prepare_chart_data(unordered, 'Line', 'day', 'sales')[0]['day'].tolist() == [1, 2, 3]
+
+    small = pd.DataFrame({'category': ['a', 'b'], 'sales': [1, 2]})
+    pie, note = prepare_chart_data(small, 'Pie', 'category', 'sales')
+    assert pie['sales'].tolist() == [1, 2] and note == ''
+
+
+def test_chart_figure_is_memoized_on_content_and_config():
+    df = pd.DataFrame({'category': ['a', 'b', 'c'], 'sales': [3, 1, 2]})
+    figure, _ = get_chart_figure(df, 'Bar', 'category', 'sales')
+    assert get_chart_figure(df.copy(), 'Bar', 'category', 'sales')[0] is figure
+    assert get_chart_figure(df, 'Pie', 'category', 'sales')[0] is not figure
+    assert get_chart_figure(df.assign(sales=[1, 1, 1]), 'Bar', 'category', 'sales')[0] is not figure
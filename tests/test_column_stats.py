@@ -0,0 +1,32 @@
+import sqlalchemy as db
+from sqlalchemy import text
+
+from utils.column_stats import annotate_tables_info, compute_column_stats
+from utils.database import get_dll_for_tables
+from utils.schema_linking import parse_columns, prune_tables_info
+
+
+def test_column_stats_become_value_hints(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = db.create_engine(db_url)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE events (id INTEGER PRIMARY KEY, event_type VARCHAR(10), payload TEXT)'))
+        connection.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, name VARCHAR(10))'))
+        for i in range(40):
+            connection.execute(text('INSERT INTO events VALUES (:id, :event_type, :payload)'),
+                               {'id': i, 'event_type': ['click', 'buy'][i % 4 == 0], 'payload': f'p{i}' if i % 2 else None})
+    engine.dispose()
+
+    tables_info = get_dll_for_tables(db_url, False)
+    column_stats = compute_column_stats(db_url, tables_info)
+    events = column_stats['events']['columns']
+    assert column_stats['events']['sample_rows'] == 40
+    assert events['payload']['null_fraction'] == 0.5
+    assert events['id'] == {'null_fraction': 0.0, 'distinct': 40, 'min': '0', 'max': '39'}
+    assert events['event_type']['top_values'] == [['click', 30], ['buy', 10]]
+
+    annotated = annotate_tables_info(tables_info, column_stats)
+    assert "event_type VARCHAR(10) -- values: 'click', 'buy'," in annotated['events']['ddl']
+    assert [name for name, _ in parse_columns(annotated['events']['ddl'])] == ['id', 'event_type', 'payload']
+    assert list(prune_tables_info(annotated, 'how many buy events', top_n=1)) == ['events']
+    assert annotated['users'] is tables_info['users']
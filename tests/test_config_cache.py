@@ -0,0 +1,41 @@
+import time
+
+from nlq.business.config_cache import ConfigCache
+
+
+def test_read_through_with_invalidation_and_negative_cache():
+    cache = ConfigCache(ttl=60, negative_ttl=0.05)
+    store = {'a': 1}
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return store.get(key)
+
+    assert cache.get('a', lambda: loader('a')) == 1
+    assert cache.get('a', lambda: loader('a')) == 1
+    assert cache.get('b', lambda: loader('b')) is None
+    assert cache.get('b', lambda: loader('b')) is None
+    assert loads == ['a', 'b']
+
+    store['b'] = 2
+    time.sleep(0.06)
+    assert cache.get('b', lambda: loader('b')) == 2
+
+    store['a'] = 3
+    version = cache.get_version()
+    cache.invalidate('a')
+    assert cache.get_version() == version + 1
+    assert cache.get('a', lambda: loader('a')) == 3
+
+
+def test_load_racing_a_write_is_not_stored():
+    cache = ConfigCache(ttl=60)
+
+    def stale_loader():
+        # a writer updates the item while this load is in flight
+        cache.invalidate('a')
+        return 'stale'
+
+    assert cache.get('a', stale_loader) == 'stale'
+    assert cache.get('a', lambda: 'fresh') == 'fresh'
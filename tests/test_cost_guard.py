@@ -0,0 +1,56 @@
+from utils.cost_guard import parse_explain, decide, is_aggregate_query, get_row_limit, DEFAULT_COST_LIMITS
+
+POSTGRES_PLAN = [{'Plan': {'Node Type': 'Aggregate', 'Total Cost': 2500000.5, 'Plan Rows': 1,
+                           'Plans': [{'Node Type': 'Seq Scan', 'Total Cost': 2000000.0, 'Plan Rows': 30000000}]}}]
+
+# SELECT ... LIMIT 1000 and COUNT(*) over a 2M rows table
+POSTGRES_LIMIT_PLAN = [{'Plan': {'Node Type': 'Limit', 'Total Cost': 17.5, 'Plan Rows': 1000,
+                                 'Plans': [{'Node Type': 'Seq Scan', 'Total Cost': 35000.0, 'Plan Rows': 2000000}]}}]
+POSTGRES_COUNT_PLAN = [{'Plan': {'Node Type': 'Aggregate', 'Total Cost': 40000.0, 'Plan Rows': 1,
+                                 'Plans': [{'Node Type': 'Seq Scan', 'Total Cost': 35000.0, 'Plan Rows': 2000000}]}}]
+
+MYSQL_PLAN = '''{"query_block": {"select_id": 1, "cost_info": {"query_cost": "120.50"},
+    "nested_loop": [{"table": {"table_name": "users", "rows_examined_per_scan": 100, "rows_produced_per_join": 100}},
+                    {"table": {"table_name": "interactions", "rows_examined_per_scan": 20,
+                               "rows_produced_per_join": 2000}}]}}'''
+
+
+def test_parse_explain():
+    assert parse_explain('postgresql', POSTGRES_PLAN) == {'rows': 1.0, 'cost': 2500000.5, 'output_rows': 1.0}
+    assert parse_explain('mysql', MYSQL_PLAN) == {'rows': 100.0, 'cost': 120.5, 'output_rows': 2000.0}
+    assert parse_explain('sqlite', '[]') == {'rows': None, 'cost': None, 'output_rows': None}
+
+
+def test_decide_thresholds():
+    limits = dict(DEFAULT_COST_LIMITS, limit_rows=1000, refuse_rows=10 ** 6, limited_rows=100)
+    assert decide({'rows': 100, 'cost': 10}, limits)[0] == 'run'
+    assert decide({'rows': 5000, 'cost': 10, 'output_rows': 5000}, limits)[0] == 'limit'
+    # a LIMIT would not make an aggregate over many rows cheaper, it runs unless over the refuse thresholds
+    assert decide({'rows': 5000, 'cost': 10, 'output_rows': 1}, limits)[0] == 'run'
+    assert decide({'rows': 5000, 'cost': 10, 'output_rows': None}, limits)[0] == 'run'
+    assert decide({'rows': 5000, 'cost': 10, 'output_rows': 5000, 'limit': 100}, limits)[0] == 'run'
+    assert decide({'rows': 5000, 'cost': 10, 'output_rows': 5000, 'limit': 500}, limits)[0] == 'limit'
+    assert decide({'rows': 10 ** 7, 'cost': None, 'limit': 100}, limits)[0] == 'refuse'
+    assert decide({'rows': None, 'cost': None}, limits)[0] == 'run'
+
+
+def test_decide_postgres_plans_of_big_tables():
+    limits = dict(DEFAULT_COST_LIMITS, limit_rows=10 ** 5, refuse_rows=10 ** 8, limit_cost=10 ** 4,
+                  refuse_cost=10 ** 8, limited_rows=1000)
+    limited = dict(parse_explain('postgresql', POSTGRES_LIMIT_PLAN), limit=1000)
+    assert decide(limited, limits)[0] == 'run'
+    assert decide(parse_explain('postgresql', POSTGRES_COUNT_PLAN), limits)[0] == 'run'
+    assert decide(parse_explain('postgresql', POSTGRES_PLAN), limits)[0] == 'run'
+    assert decide(parse_explain('postgresql', POSTGRES_PLAN), dict(limits, refuse_cost=10 ** 6))[0] == 'refuse'
+
+
+def test_get_row_limit():
+    assert get_row_limit('SELECT * FROM users LIMIT 1000', 'mysql') == 1000
+    assert get_row_limit('SELECT * FROM (SELECT * FROM users LIMIT 5) s', 'mysql') is None
+    assert get_row_limit('SELECT FROM WHERE', 'mysql') is None
+
+
+def test_is_aggregate_query():
+    assert is_aggregate_query('SELECT COUNT(*) FROM interactions', 'mysql')
+    assert is_aggregate_query('SELECT gender, AVG(age) FROM users GROUP BY gender', 'mysql')
+    assert not is_aggregate_query('SELECT user_id FROM (SELECT user_id, COUNT(*) FROM t GROUP BY user_id) s', 'mysql')
@@ -0,0 +1,58 @@
+import sqlalchemy as db
+from sqlalchemy import text
+
+from utils.database import get_dll_for_tables, get_table_fingerprints, render_table_ddl, reflected_catalog_entry, \
+    table_fingerprint, format_column_type
+from utils.schema_linking import parse_columns
+
+
+def test_render_table_ddl_keeps_tables_info_format():
+    ddl = render_table_ddl('orders', {'comment': 'customer orders',
+                                      'columns': [('id', 'INT', None), ('user_id', 'INT', 'buyer')],
+                                      'primary_key': ['id'],
+                                      'foreign_keys': {'fk_user': (['user_id'], 'users', ['id'])}})
+    assert ddl.startswith('CREATE TABLE orders -- customer orders \n (\n  id INT ,\n')
+    assert ddl.endswith('  FOREIGN KEY (user_id) REFERENCES users(id)\n)')
+    assert [name for name, _ in parse_columns(ddl)] == ['id', 'user_id']
+
+
+def test_format_column_type_keeps_literals():
+    assert format_column_type("enum('click','buy','it''s')") == "ENUM('click','buy','it''s')"
+    assert format_column_type('decimal(10,2) unsigned') == 'DECIMAL(10,2) UNSIGNED'
+
+
+def test_get_dll_for_selected_tables(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = db.create_engine(db_url)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER)'))
+        connection.execute(text('CREATE TABLE orders (id INTEGER PRIMARY KEY, user_id INTEGER REFERENCES users(id))'))
+    engine.dispose()
+
+    tables_info = get_dll_for_tables(db_url, False, selected_tables=['orders'])
+    assert list(tables_info) == ['orders']
+    assert 'FOREIGN KEY (user_id) REFERENCES users(id)' in tables_info['orders']['ddl']
+    assert set(get_dll_for_tables(db_url, False)) == {'orders', 'users'}
+
+
+def test_table_fingerprints_change_with_columns_only(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = db.create_engine(db_url)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE users (id INTEGER PRIMARY KEY, age INTEGER)'))
+        connection.execute(text('CREATE TABLE orders (id INTEGER PRIMARY KEY, amount REAL)'))
+    tables_info = get_dll_for_tables(db_url, False)
+    before = get_table_fingerprints(db_url, None, ['users', 'orders', 'missing'])
+    assert before == {name: table_data['fingerprint'] for name, table_data in tables_info.items()}
+    # the reflection fallback of the profile page stores the same fingerprint
+    metadata = db.MetaData()
+    metadata.reflect(bind=engine)
+    assert table_fingerprint(reflected_catalog_entry(metadata.tables['users'])) == before['users']
+
+    with engine.begin() as connection:
+        connection.execute(text('ALTER TABLE users ADD COLUMN name TEXT'))
+        connection.execute(text("INSERT INTO orders VALUES (1, 9.5)"))
+    engine.dispose()
+    after = get_table_fingerprints(db_url, None, ['users', 'orders'])
+    assert after['users'] != before['users']
+    assert after['orders'] == before['orders']
@@ -0,0 +1,28 @@
+from nlq.data_access.dynamo_scan import scan_table
+
+
+class PagedTable:
+    """Serves the items two per scan page, like DynamoDB does past 1 MB"""
+
+    name = 'PagedTable'
+
+    def __init__(self, items):
+        self.items = items
+        self.calls = []
+
+    def scan(self, **kwargs):
+        self.calls.append(kwargs)
+        start = kwargs.get('ExclusiveStartKey', {}).get('index', 0)
+        response = {'Items': self.items[start:start + 2]}
+        if start + 2 < len(self.items):
+            response['LastEvaluatedKey'] = {'index': start + 2}
+        return response
+
+
+def test_scan_table_follows_pages_with_projection():
+    table = PagedTable([{'profile_name': f'p{i}'} for i in range(5)])
+    items = scan_table(table, attributes=['profile_name', 'comments'], segments=1)
+    assert [item['profile_name'] for item in items] == ['p0', 'p1', 'p2', 'p3', 'p4']
+    assert len(table.calls) == 3
+    assert table.calls[0]['ProjectionExpression'] == '#a0, #a1'
+    assert table.calls[0]['ExpressionAttributeNames'] == {'#a0': 'profile_name', '#a1': 'comments'}
@@ -0,0 +1,23 @@
+import time
+
+from utils.pipeline import StageGraph
+
+
+def test_slow_stage_falls_back_without_blocking_others():
+    graph = StageGraph('test')
+    graph.add_stage('embedding', lambda: time.sleep(0.5) or [0.1], timeout=0.1, fallback=None)
+    graph.add_stage('retrieval', lambda embedding: ['example'], deps=['embedding'], timeout=0.1, fallback=[])
+    graph.add_stage('prompt_prefix', lambda: 'prefix')
+
+    start = time.time()
+    results = graph.run()
+    assert time.time() - start < 0.4
+    assert results == {'embedding': None, 'retrieval': [], 'prompt_prefix': 'prefix'}
+
+
+def test_dependency_results_are_passed_to_stages():
+    graph = StageGraph('test')
+    graph.add_stage('a', lambda: 2)
+    graph.add_stage('b', lambda a: a * 3, deps=['a'])
+    graph.add_stage('failing', lambda: 1 / 0, fallback='fallback')
+    assert graph.run() == {'a': 2, 'b': 6, 'failing': 'fallback'}
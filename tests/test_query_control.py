@@ -0,0 +1,104 @@
+import time
+
+import sqlalchemy as db
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+import pytest
+
+import utils.apis
+from utils.apis import query_from_sql_pd, shared_query_from_sql_pd, query_flight, iter_query_from_sql_pd, \
+    cached_query_from_sql_pd, query_from_database, is_limit_wrapper_error
+from utils.cost_guard import DEFAULT_COST_LIMITS
+from utils.env_var import QUERY_MAX_ROWS
+from utils.result_cache import query_result_cache
+from utils.query_control import QueryHandle, QueryCancelled, QueryTimeout, get_query_control_stats
+
+
+@pytest.fixture
+def db_url(tmp_path):
+    url = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = db.create_engine(url)
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE t (a INTEGER)'))
+        connection.execute(text('INSERT INTO t VALUES ' + ','.join(f'({i})' for i in range(50))))
+    engine.dispose()
+    return url
+
+
+def test_cancelled_query_stops_between_chunks(db_url):
+    handle = QueryHandle(db_url, timeout=60)
+    handle.cancel()
+    cancels = get_query_control_stats()['cancels']
+    with pytest.raises(QueryCancelled):
+        query_from_sql_pd(db_url, 'SELECT a FROM t', handle=handle)
+    handle.cancel()
+    assert get_query_control_stats()['cancels'] == cancels
+
+
+def test_query_past_timeout_is_stopped(db_url):
+    assert len(query_from_sql_pd(db_url, 'SELECT a FROM t', handle=QueryHandle(db_url, timeout=60))) == 50
+
+    handle = QueryHandle(db_url, timeout=1)
+    handle.started_at -= 2
+    timeouts = get_query_control_stats()['timeouts']
+    with pytest.raises(QueryTimeout):
+        query_from_sql_pd(db_url, 'SELECT a FROM t', handle=handle)
+    assert get_query_control_stats()['timeouts'] == timeouts + 1
+
+
+def test_waiter_reruns_query_cancelled_by_leader_session(db_url):
+    from concurrent.futures import ThreadPoolExecutor
+
+    key = (query_result_cache.make_key(db_url, 'SELECT a FROM t'), QUERY_MAX_ROWS)
+    _, is_leader = query_flight.join(key)
+    assert is_leader
+    shared = query_flight.get_stats()['shared']
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        waiter = executor.submit(shared_query_from_sql_pd, db_url, 'SELECT a FROM t')
+        while query_flight.get_stats()['shared'] == shared:
+            time.sleep(0.01)
+        # the leader's user pressed Cancel, the waiting session runs the query on its own
+        query_flight.fail(key, QueryCancelled('The query was cancelled.'))
+        assert len(waiter.result(timeout=10)) == 50
+
+
+def test_limited_query_retried_only_when_wrapper_refused(db_url, monkeypatch):
+    assert is_limit_wrapper_error(DBAPIError('q', None, Exception("(1060, \"Duplicate column name 'id'\")")))
+    assert not is_limit_wrapper_error(DBAPIError('q', None, Exception('no such column: b')))
+
+    queries = []
+    iter_query_chunks = utils.apis._iter_query_chunks
+
+    def recording_iter_query_chunks(p_db_url, query, *args):
+        queries.append(query)
+        return iter_query_chunks(p_db_url, query, *args)
+
+    monkeypatch.setattr(utils.apis, '_iter_query_chunks', recording_iter_query_chunks)
+    with pytest.raises(DBAPIError):
+        list(iter_query_from_sql_pd(db_url, 'SELECT b FROM t'))
+    assert len(queries) == 1
+
+
+def test_results_limited_by_cost_guard_are_not_cached(db_url, monkeypatch):
+    monkeypatch.setattr(utils.apis, 'RESULT_CACHE_ENABLED', True)
+    monkeypatch.setattr(utils.apis, 'check_query_cost', lambda *args: ('limit', 'estimated many rows'))
+    df = cached_query_from_sql_pd(db_url, 'SELECT a FROM t', cost_limits=dict(DEFAULT_COST_LIMITS, limited_rows=10))
+    assert len(df) == 10 and df.attrs['cost_guard']
+    assert query_result_cache.get(db_url, 'SELECT a FROM t') is None
+    assert len(cached_query_from_sql_pd(db_url, 'SELECT a FROM t')) == 50
+
+
+def test_query_from_database_retries_refused_limit_wrapper(db_url, monkeypatch):
+    queries = []
+    fetch_rows = utils.apis._fetch_rows
+
+    def refusing_fetch_rows(p_db_url, query, max_rows):
+        queries.append(query)
+        if 'limited_query' in query:
+            raise DBAPIError(query, None, Exception("(1060, \"Duplicate column name 'a'\")"))
+        return fetch_rows(p_db_url, query, max_rows)
+
+    monkeypatch.setattr(utils.apis, '_fetch_rows', refusing_fetch_rows)
+    response = query_from_database(db_url, 'SELECT a FROM t', max_rows=10)
+    assert len(response['data']) == 10 and response['truncated']
+    assert queries[-1] == 'SELECT a FROM t'
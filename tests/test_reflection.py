@@ -0,0 +1,34 @@
+import threading
+import time
+
+from utils.reflection import ReflectionExecutor
+
+
+def test_bounded_per_server_with_partial_results():
+    executor = ReflectionExecutor(max_workers=8, per_server_workers=2)
+    running = {'mysql://a:3306': 0, 'mysql://b:3306': 0}
+    peak = dict(running)
+    lock = threading.Lock()
+
+    def task(server, fail=False):
+        def run():
+            with lock:
+                running[server] += 1
+                peak[server] = max(peak[server], running[server])
+            time.sleep(0.05)
+            with lock:
+                running[server] -= 1
+            if fail:
+                raise RuntimeError('permission denied')
+            return server
+        return run
+
+    tasks = [(f'{server}/{i}', server, task(server, fail=i == 0 and server.endswith('b:3306')))
+             for server in running for i in range(4)]
+    progress = []
+    results, errors = executor.run(tasks, on_progress=lambda label, done, total, error: progress.append(done))
+
+    assert peak == {'mysql://a:3306': 2, 'mysql://b:3306': 2}
+    assert list(errors) == ['mysql://b:3306/0']
+    assert len(results) == 7
+    assert progress == list(range(1, 9))
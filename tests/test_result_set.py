@@ -0,0 +1,40 @@
+from utils.apis import query_from_database
+from utils.result_set import ColumnarResult
+
+
+def test_columnar_result_types_and_text():
+    result = ColumnarResult.from_rows(['id', 'name', 'price'], [(1, 'a', 1.5), (2, None, None), (3, 'c', 2)])
+    assert result.dtypes == ['int64', 'object', 'float64']
+    assert len(result) == 3
+
+    df = result.to_dataframe()
+    assert list(df.columns) == ['id', 'name', 'price']
+    assert df['id'].tolist() == [1, 2, 3]
+
+    text = result.to_text(max_tokens=8)
+    assert text.startswith('id | name | price')
+    assert text.endswith('more rows)')
+
+
+def test_columnar_result_ipc_round_trip():
+    result = ColumnarResult.from_rows(['id', 'name'], [(1, 'a'), (2, 'b')])
+    restored = ColumnarResult.from_ipc_bytes(result.to_ipc_bytes())
+    assert restored.columns == ['id', 'name']
+    assert restored.to_dataframe()['name'].tolist() == ['a', 'b']
+
+
+def test_columnar_result_keeps_duplicate_and_mixed_type_columns(tmp_path):
+    result = ColumnarResult.from_rows(['id', 'id', 'amt'], [(1, 10, 1.5), (2, 20, 2.5)])
+    assert result.dtypes == ['int64', 'int64', 'float64']
+    df = result.to_dataframe()
+    assert list(df.columns) == ['id', 'id', 'amt']
+    assert df.iloc[:, 1].tolist() == [10, 20]
+    assert ColumnarResult.from_ipc_bytes(result.to_ipc_bytes()).columns == ['id', 'id', 'amt']
+
+    mixed = ColumnarResult.from_rows(['id', 'value'], [(1, 'a'), (2, 3.5), (3, None)])
+    assert mixed.to_dataframe()['value'].tolist() == ['a', 3.5, None]
+    assert ColumnarResult.from_ipc_bytes(mixed.to_ipc_bytes()).to_dataframe()['value'].tolist() == ['a', '3.5', None]
+
+    db_url = f"sqlite:///{tmp_path / 'test.db'}"
+    response = query_from_database(db_url, "SELECT 1 AS id, 'a' AS v UNION ALL SELECT 2, 3", with_ipc=True)
+    assert response['dtypes'] == ['int64', 'object'] and response['ipc']
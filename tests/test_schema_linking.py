@@ -0,0 +1,34 @@
+from utils.schema_linking import prune_tables_info, parse_columns
+
+TABLES_INFO = {
+    'orders': {'ddl': 'CREATE TABLE orders (\n  order_id INT,\n  customer_id INT,\n  amount FLOAT -- order amount\n)',
+               'description': 'customer orders'},
+    'customers': {'ddl': 'CREATE TABLE customers (\n  customer_id INT,\n  region VARCHAR(20) -- sales region\n)',
+                  'description': 'customer master data'},
+    'regions': {'ddl': 'CREATE TABLE regions (\n  region_code VARCHAR(20),\n  manager VARCHAR(50)\n)',
+                'description': 'region managers'},
+    'logs': {'ddl': 'CREATE TABLE logs (\n  log_id INT,\n  message TEXT\n)',
+             'description': 'application logs'},
+}
+
+
+def test_parse_columns():
+    assert [name for name, _ in parse_columns(TABLES_INFO['orders']['ddl'])] == ['order_id', 'customer_id', 'amount']
+
+
+def test_prune_keeps_relevant_tables():
+    pruned = prune_tables_info(TABLES_INFO, 'total order amount', top_n=1)
+    assert list(pruned) == ['orders']
+
+
+def test_prune_follows_join_columns():
+    pruned = prune_tables_info(TABLES_INFO, 'order amount by sales region', top_n=2)
+    assert set(pruned) == {'orders', 'customers'}
+
+
+def test_prune_falls_back_to_full_schema_when_nothing_matches():
+    assert prune_tables_info(TABLES_INFO, 'weather tomorrow', top_n=2) is TABLES_INFO
+
+
+def test_prune_keeps_small_profiles_whole():
+    assert prune_tables_info(TABLES_INFO, 'total order amount', top_n=len(TABLES_INFO)) is TABLES_INFO
@@ -0,0 +1,19 @@
+from utils.prompt import compile_prompt_prefix, invalidate_compiled_prompts
+
+TABLES_INFO = {
+    'orders': {'ddl': 'CREATE TABLE orders (\n  order_id INT,\n  amount FLOAT -- order amount\n)',
+               'description': 'customer orders'},
+    'regions': {'ddl': 'CREATE TABLE regions (\n  region_code VARCHAR(20),\n  manager VARCHAR(50)\n)',
+                'description': 'region managers'},
+}
+
+
+def test_invalidate_compiled_prompts_of_changed_tables_only():
+    profile = {'tables_info': TABLES_INFO, 'hints': '', 'db_url': 'mysql+pymysql://u:p@h/db'}
+    subset = {'regions': TABLES_INFO['regions']}
+    full = compile_prompt_prefix('p', profile)
+    pruned = compile_prompt_prefix('p', profile, tables_info=subset)
+
+    invalidate_compiled_prompts('p', table_names=['orders'])
+    assert compile_prompt_prefix('p', profile, tables_info=subset) is pruned
+    assert compile_prompt_prefix('p', profile) is not full
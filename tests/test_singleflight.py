@@ -0,0 +1,40 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight('test')
+    calls = []
+    started = threading.Event()
+
+    def work():
+        calls.append(1)
+        started.set()
+        time.sleep(0.1)
+        return 'result'
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        leader = executor.submit(flight.do, 'k', work)
+        started.wait()
+        followers = [executor.submit(flight.do, 'k', work) for _ in range(3)]
+        assert leader.result() == ('result', False)
+        assert [f.result() for f in followers] == [('result', True)] * 3
+    assert len(calls) == 1
+    assert flight.get_stats() == {'leaders': 1, 'shared': 3, 'in_flight': 0}
+
+
+def test_errors_propagate_to_waiters():
+    flight = SingleFlight('test')
+    future, is_leader = flight.join('k')
+    assert is_leader
+    assert flight.join('k') == (future, False)
+    flight.fail('k', ValueError('throttled'))
+    with pytest.raises(ValueError):
+        flight.wait(future, timeout=1)
+    # the failed call is forgotten, the next caller leads a new one
+    assert flight.do('k', lambda: 'ok') == ('ok', False)
@@ -0,0 +1,52 @@
+import pytest
+
+from utils.sql_rewrite import rewrite_sql, SqlValidationError
+
+TABLES_INFO = {
+    'users': {'ddl': 'CREATE TABLE `users`(\n`user_id` string, --用户ID\n`age` int, --用户年龄\n`gender` string --用户性别\n)'},
+    'interactions': {'ddl': 'CREATE TABLE `interactions`(\n`item_id` string, --商品ID\n`user_id` int, --用户ID\n'
+                            '`event_type` string --交互事件类型\n)'},
+}
+
+
+def test_rewrite_limits_and_strips_statements():
+    sql, notes = rewrite_sql('SELECT AVG(age) FROM users;', 'mysql', TABLES_INFO, max_rows=100)
+    assert sql == 'SELECT AVG(age) FROM users\nLIMIT 100'
+    assert len(notes) == 1
+
+    sql, notes = rewrite_sql('SELECT u.age FROM users u LIMIT 5;\nDROP TABLE users;', 'mysql', TABLES_INFO,
+                             max_rows=100)
+    assert sql == 'SELECT u.age FROM users u LIMIT 5'
+
+    # unchanged queries are passed through as written
+    assert rewrite_sql('SELECT  age FROM users LIMIT 5;', 'mysql', TABLES_INFO, max_rows=100) == \
+        ('SELECT  age FROM users LIMIT 5', [])
+
+    # the LIMIT is appended to the SQL as written, MySQL functions are not rendered again
+    sql = "SELECT gender FROM users WHERE gender REGEXP '^f' AND age < YEAR(CURDATE()) -- adults\n"
+    assert rewrite_sql(sql + ';', 'mysql', TABLES_INFO, max_rows=10)[0] == sql.strip() + '\nLIMIT 10'
+
+
+def test_rewrite_validates_references():
+    sql = 'WITH n AS (SELECT user_id, COUNT(*) AS cnt FROM interactions GROUP BY user_id) ' \
+          'SELECT u.gender, AVG(n.cnt) AS avg_cnt FROM users u JOIN n ON u.user_id = n.user_id GROUP BY u.gender'
+    assert rewrite_sql(sql, 'postgresql', TABLES_INFO)[0] == sql
+
+    for invalid in ['SELECT * FROM orders', 'SELECT u.price FROM users u', 'SELECT price FROM users',
+                    'DELETE FROM users', 'SELECT FROM WHERE']:
+        with pytest.raises(SqlValidationError):
+            rewrite_sql(invalid, 'mysql', TABLES_INFO)
+
+    # columns of a table whose DDL does not parse are not known, unqualified columns are accepted then
+    tables_info = dict(TABLES_INFO, events={'ddl': 'not a create table statement'})
+    sql = 'SELECT u.age, event_type FROM users u JOIN events e ON u.user_id = e.user_id'
+    assert rewrite_sql(sql, 'mysql', tables_info)[0] == sql
+
+
+def test_rewrite_accepts_table_functions_and_rejects_untokenizable_sql():
+    sql = 'SELECT d, COUNT(u.user_id) FROM generate_series(1, 7) AS g(d) LEFT JOIN users u ON u.age = d GROUP BY d'
+    assert rewrite_sql(sql, 'postgresql', TABLES_INFO)[0] == sql
+    assert rewrite_sql('SELECT x FROM unnest(ARRAY[1, 2]) AS t(x)', 'postgresql', TABLES_INFO)[1] == []
+
+    with pytest.raises(SqlValidationError, match='invalid SQL'):
+        rewrite_sql("SELECT 'abc FROM users", 'mysql', TABLES_INFO)
@@ -1,60 +1,254 @@
-import sqlalchemy as db
+import re
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
 from sqlalchemy import text
-from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, RDS_PQ_SCHEMA
+from sqlalchemy.exc import DBAPIError
+from utils.cost_guard import QueryRefused, check_query_cost
+from utils.database import connect
+from utils.query_control import QueryCancelled, QueryTimeout
+from utils.result_cache import query_result_cache
+from utils.result_set import ColumnarResult
+from utils.singleflight import SingleFlight
+from utils.env_var import RDS_PQ_SCHEMA, QUERY_CHUNK_SIZE, QUERY_MAX_ROWS, QUERY_MAX_BYTES, RESULT_CACHE_ENABLED, \
+    COST_GUARD_LIMITED_ROWS
 import pandas as pd
 from loguru import logger
 
+# worker threads for queries dispatched before the LLM response is complete
+query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='query')
+# identical queries run by several sessions at once share one execution
+query_flight = SingleFlight('query')
+
+
+SELECT_PATTERN = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+# errors caused by wrapping the query in the LIMIT subquery, e.g. MySQL refusing derived tables with duplicate columns
+LIMIT_WRAPPER_ERROR_PATTERN = re.compile(
+    r'duplicate column name|specified (more than once|multiple times)|derived table', re.IGNORECASE)
+
 
-def query_from_database(p_db_url: str, query, schema=None):
+def limit_query(query: str, max_rows: int) -> str:
     """
-    Query the database
+    Wrap a SELECT query so the database returns at most max_rows rows
     """
+    query = query.strip().rstrip(';')
+    if not SELECT_PATTERN.match(query):
+        return query
+    return f'SELECT * FROM ({query}\n) AS limited_query LIMIT {max_rows}'
+
+
+def query_from_database(p_db_url: str, query, schema=None, max_rows=QUERY_MAX_ROWS, with_ipc=False):
+    """
+    Query the database, returning the rows as a ColumnarResult in "data".
+    Use data.to_text(max_tokens) to render it for the LLM and data.to_dataframe() to wrap it as a DataFrame.
+    """
+    limited_query = limit_query(query, max_rows + 1)
     try:
-        if '{RDS_MYSQL_USERNAME}' in p_db_url:
-            engine = db.create_engine(p_db_url.format(
-                RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-                RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-                RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-                RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-                RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-            ))
-        else:
-            engine = db.create_engine(p_db_url)
-        with engine.connect() as connection:
-            logger.info(f'{query=}')
-            # if schema and 'postgres' in p_db_url:
-            #     query = f'SET search_path TO {schema}; {query}'
-            cursor = connection.execute(text(query))
-            results = cursor.fetchall()
-            columns = list(cursor.keys())
+        try:
+            results, columns = _fetch_rows(p_db_url, limited_query, max_rows + 1)
+        except DBAPIError as e:
+            if not should_retry_without_limit(e, limited_query, query):
+                raise
+            results, columns = _fetch_rows(p_db_url, query, max_rows + 1)
     except ValueError as e:
         logger.exception(e)
         return {"status": "error", "message": str(e)}
-    return {
+    truncated = len(results) > max_rows
+    data = ColumnarResult.from_rows(columns, results[:max_rows])
+    response = {
         "status": "ok",
-        "data": str(results),
+        "data": data,
+        "dtypes": data.dtypes,
         "query": query,
-        "columns": columns
+        "columns": columns,
+        "truncated": truncated
     }
+    if with_ipc:
+        response["ipc"] = data.to_ipc_bytes()
+    return response
+
+
+def _fetch_rows(p_db_url, query, max_rows):
+    with connect(p_db_url) as connection:
+        logger.info(f'{query=}')
+        # if schema and 'postgres' in p_db_url:
+        #     query = f'SET search_path TO {schema}; {query}'
+        cursor = connection.execute(text(query))
+        return cursor.fetchmany(max_rows), list(cursor.keys())
 
 
-def query_from_sql_pd(p_db_url: str, query, schema=None):
+def iter_query_from_sql_pd(p_db_url: str, query, schema=None, chunk_size=QUERY_CHUNK_SIZE, max_rows=QUERY_MAX_ROWS,
+                           max_bytes=QUERY_MAX_BYTES, handle=None):
     """
-    Query the database
+    Query the database with a server-side cursor, yielding DataFrame chunks of chunk_size rows.
+    Stops after max_rows rows or max_bytes bytes of DataFrame memory; the last chunk then has attrs['truncated'] set.
+    The row limit is also pushed to the database, so drivers draining unread rows on close stay bounded.
+    handle is an optional QueryHandle applying the statement timeout and allowing to cancel the query.
     """
-    if '{RDS_MYSQL_USERNAME}' in p_db_url:
-        engine = db.create_engine(p_db_url.format(
-            RDS_MYSQL_HOST=RDS_MYSQL_HOST,
-            RDS_MYSQL_PORT=RDS_MYSQL_PORT,
-            RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
-            RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
-            RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
-        ))
-    else:
-        engine = db.create_engine(p_db_url)
-
-    with engine.connect() as connection:
+    limited_query = limit_query(query, max_rows + 1)
+    started = False
+    try:
+        for chunk in _iter_query_chunks(p_db_url, limited_query, chunk_size, max_rows, max_bytes, handle):
+            started = True
+            yield chunk
+    except DBAPIError as e:
+        # rows already yielded would be duplicated by running the query again
+        if started or not should_retry_without_limit(e, limited_query, query):
+            raise
+        yield from _iter_query_chunks(p_db_url, query, chunk_size, max_rows, max_bytes, handle)
+
+
+def is_limit_wrapper_error(error: DBAPIError) -> bool:
+    """Whether the database error is likely caused by the LIMIT subquery wrapped around the query"""
+    return bool(LIMIT_WRAPPER_ERROR_PATTERN.search(str(error.orig or error)))
+
+
+def should_retry_without_limit(error: DBAPIError, limited_query: str, query: str) -> bool:
+    """Whether the query should run again as it is, because the database refused the LIMIT subquery around it"""
+    if limited_query == query or not is_limit_wrapper_error(error):
+        return False
+    logger.warning(f'limited query failed, run the original query: {error}')
+    return True
+
+
+def _iter_query_chunks(p_db_url, query, chunk_size, max_rows, max_bytes, handle=None):
+    with connect(p_db_url) as connection:
         logger.info(f'{query=}')
         # if schema and 'postgres' in p_db_url:
         #     query = f'SET search_path TO {RDS_PQ_SCHEMA}; {query}'
-        return pd.read_sql_query(text(query), connection)
+        if handle is not None:
+            handle.attach(connection)
+        try:
+            yield from _read_query_chunks(connection, query, chunk_size, max_rows, max_bytes, handle)
+        except DBAPIError as e:
+            if handle is None:
+                raise
+            error = handle.translate_error(e)
+            if error is e:
+                raise
+            raise error from e
+        finally:
+            if handle is not None:
+                handle.detach(connection)
+
+
+def _read_query_chunks(connection, query, chunk_size, max_rows, max_bytes, handle):
+    streaming_connection = connection.execution_options(stream_results=True, max_row_buffer=chunk_size)
+    row_count = 0
+    byte_count = 0
+    for chunk in pd.read_sql_query(text(query), streaming_connection, chunksize=chunk_size):
+        if handle is not None:
+            handle.check()
+            if handle.preview is None:
+                handle.preview = chunk
+        truncated = False
+        if row_count + len(chunk) > max_rows:
+            chunk = chunk.iloc[:max_rows - row_count]
+            truncated = True
+        row_count += len(chunk)
+        byte_count += int(chunk.memory_usage(deep=True).sum())
+        if byte_count > max_bytes:
+            truncated = True
+        chunk.attrs['truncated'] = truncated
+        yield chunk
+        if truncated:
+            logger.warning(f'query result truncated at {row_count} rows, {byte_count} bytes')
+            return
+
+
+def collect_query_chunks(chunks) -> pd.DataFrame:
+    """
+    Concatenate DataFrame chunks, keeping the truncated flag and row count in attrs
+    """
+    chunks = list(chunks)
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    df.attrs['truncated'] = chunks[-1].attrs.get('truncated', False)
+    df.attrs['row_count'] = len(df)
+    return df
+
+
+def query_from_sql_pd(p_db_url: str, query, schema=None, max_rows=QUERY_MAX_ROWS, max_bytes=QUERY_MAX_BYTES,
+                      handle=None):
+    """
+    Query the database
+    """
+    return collect_query_chunks(iter_query_from_sql_pd(p_db_url, query, schema, max_rows=max_rows,
+                                                       max_bytes=max_bytes, handle=handle))
+
+
+def shared_query_from_sql_pd(p_db_url: str, query, schema=None, handle=None, max_rows=QUERY_MAX_ROWS):
+    """
+    query_from_sql_pd where concurrent queries of the same SQL and row limit on the same connection share one execution.
+    Waiters get a shallow copy, so their attrs stay independent of the leader's DataFrame.
+    Only the leader's handle controls the shared execution. A cancel or statement timeout of the leader
+    belongs to its session, so a waiter then runs the query itself (or joins the next leader).
+    """
+    key = (query_result_cache.make_key(p_db_url, query), max_rows)
+    while True:
+        future, is_leader = query_flight.join(key)
+        if is_leader:
+            break
+        try:
+            return query_flight.wait(future).copy(deep=False)
+        except (QueryCancelled, QueryTimeout):
+            logger.info('the shared query was cancelled or timed out in another session, run it again')
+        except TimeoutError as e:
+            raise QueryTimeout(f'Gave up waiting for the same query running in another session '
+                               f'after {query_flight.timeout:.0f}s.') from e
+    try:
+        df = query_from_sql_pd(p_db_url, query, schema, max_rows=max_rows, handle=handle)
+    except BaseException as e:
+        query_flight.fail(key, e)
+        raise
+    query_flight.complete(key, df)
+    return df
+
+
+def guarded_query_from_sql_pd(p_db_url: str, query, schema=None, handle=None, cost_limits=None):
+    """
+    shared_query_from_sql_pd behind the EXPLAIN cost guard: expensive queries returning many rows get a LIMIT
+    injected, queries over the refuse thresholds raise QueryRefused.
+    The guard note is kept in attrs['cost_guard'].
+    """
+    if cost_limits is None:
+        return shared_query_from_sql_pd(p_db_url, query, schema, handle)
+    action, reason = check_query_cost(p_db_url, query, cost_limits, handle)
+    if action == 'refuse':
+        raise QueryRefused(f'The query was not executed, it is too expensive ({reason}).')
+    if action == 'limit':
+        limited_rows = int(cost_limits.get('limited_rows', COST_GUARD_LIMITED_ROWS))
+        # the row limit goes through the same LIMIT wrapper as any query, with its retry when it is refused
+        df = shared_query_from_sql_pd(p_db_url, query, schema, handle, max_rows=limited_rows)
+        df.attrs['cost_guard'] = f'The query returns too many rows, only the first {limited_rows} result rows ' \
+                                 f'were fetched ({reason}).'
+        return df
+    return shared_query_from_sql_pd(p_db_url, query, schema, handle)
+
+
+def cached_query_from_sql_pd(p_db_url: str, query, schema=None, tag=None, handle=None, cost_limits=None):
+    """
+    guarded_query_from_sql_pd through the cross-session result cache; tag is the profile name used for invalidation.
+    Results served from the cache have attrs['cached_at'] set. Results the cost guard limited are not cached,
+    they depend on the guard settings of the session and not only on the query.
+    """
+    if not RESULT_CACHE_ENABLED:
+        return guarded_query_from_sql_pd(p_db_url, query, schema, handle, cost_limits)
+    df = query_result_cache.get(p_db_url, query)
+    if df is None:
+        df = guarded_query_from_sql_pd(p_db_url, query, schema, handle, cost_limits)
+        if 'cost_guard' in df.attrs:
+            return df
+        try:
+            query_result_cache.set(p_db_url, query, df, tag=tag)
+        except Exception as e:
+            # the query itself succeeded, an uncacheable result must not fail it
+            logger.opt(exception=e).warning('query result could not be cached')
+    return df
+
+
+def submit_query_from_sql_pd(p_db_url: str, query, schema=None, tag=None, handle=None, cost_limits=None):
+    """
+    Run cached_query_from_sql_pd on a worker thread, return a Future of the DataFrame
+    """
+    return query_executor.submit(cached_query_from_sql_pd, p_db_url, query, schema, tag, handle, cost_limits)
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Build a stable sha256 key from JSON-serializable parts
+    """
+    raw = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with optional TTL and tag based invalidation"""
+
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, tag, expires_at = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, tag=None, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, tag, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, tag):
+        with self._lock:
+            keys = [k for k, (_, t, _) in self._data.items() if t == tag]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def delete_where(self, predicate):
+        """Delete the entries for which predicate(key, tag) is true, return how many were deleted"""
+        with self._lock:
+            keys = [k for k, (_, t, _) in self._data.items() if predicate(k, t)]
+            for k in keys:
+                del self._data[k]
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self):
+        return len(self._data)
+
+
+_MISSING = object()
+
+
+class SQLiteStore:
+    """Pickled key/value store persisted in a SQLite file, shared across processes"""
+
+    def __init__(self, path, table='cache', ttl=None):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ('
+                         'key TEXT PRIMARY KEY, tag TEXT, value BLOB, created_at REAL, expires_at REAL)')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_tag ON {table} (tag)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key, default=None):
+        with self._lock, self._connect() as conn:
+            row = conn.execute(f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return default
+            if row[1] is not None and row[1] < time.time():
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return default
+        return pickle.loads(row[0])
+
+    def set(self, key, value, tag=None, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        with self._lock, self._connect() as conn:
+            conn.execute(f'INSERT OR REPLACE INTO {self.table} (key, tag, value, created_at, expires_at) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (key, tag, sqlite3.Binary(pickle.dumps(value)), now, expires_at))
+
+    def delete(self, key):
+        with self._lock, self._connect() as conn:
+            conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def invalidate(self, tag):
+        with self._lock, self._connect() as conn:
+            return conn.execute(f'DELETE FROM {self.table} WHERE tag = ?', (tag,)).rowcount
+
+    def purge_expired(self):
+        with self._lock, self._connect() as conn:
+            return conn.execute(f'DELETE FROM {self.table} WHERE expires_at IS NOT NULL AND expires_at < ?',
+                                (time.time(),)).rowcount
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute(f'DELETE FROM {self.table}')
+
+
+class TieredCache:
+    """
+    Bounded in-memory LRU in front of an on-disk SQLite store.
+    Entries are grouped by tag (e.g. profile name) so they can be invalidated together.
+    """
+
+    def __init__(self, name, path=None, max_size=256, ttl=None):
+        self.name = name
+        self.memory = LRUCache(max_size=max_size, ttl=ttl)
+        self.store = None
+        if path:
+            try:
+                self.store = SQLiteStore(path, table=name, ttl=ttl)
+            except sqlite3.Error as e:
+                logger.warning(f'{name} cache falls back to memory only, cannot open {path}: {e}')
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'saved_seconds': 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            self._count('memory_hits')
+        elif self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self._count('disk_hits')
+                self.memory.set(key, entry, tag=entry.get('tag'))
+        if entry is None:
+            self._count('misses')
+            return None
+        self._count('saved_seconds', entry.get('elapsed', 0.0))
+        return entry['value']
+
+    def set(self, key, value, tag=None, elapsed=0.0):
+        entry = {'value': value, 'tag': tag, 'elapsed': elapsed, 'created_at': time.time()}
+        self.memory.set(key, entry, tag=tag)
+        if self.store is not None:
+            self.store.set(key, entry, tag=tag)
+
+    def get_or_compute(self, key, compute, tag=None):
+        value = self.get(key)
+        if value is None:
+            start = time.time()
+            value = compute()
+            self.set(key, value, tag=tag, elapsed=time.time() - start)
+        return value
+
+    def invalidate(self, tag):
+        count = self.memory.invalidate(tag)
+        if self.store is not None:
+            count += self.store.invalidate(tag)
+        logger.info(f'{self.name} cache invalidated {count} entries of {tag}')
+        return count
+
+    def clear(self):
+        self.memory.clear()
+        if self.store is not None:
+            self.store.clear()
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(unicodedata.normalize('NFKC', text).split())
+
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding cache keyed on (model id, normalized text).
+    Vectors are kept as float32 blobs in SQLite, bounded to max_entries least recently used rows,
+    with an in-memory LRU in front.
+    """
+
+    def __init__(self, path, max_size=2048, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory = LRUCache(max_size=max_size)
+        self.stats = {'hits': 0, 'misses': 0}
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                         'key TEXT PRIMARY KEY, model_id TEXT, dim INTEGER, vector BLOB, last_used REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def make_key(model_id, text):
+        return make_cache_key(model_id, normalize_text(text))
+
+    def get(self, model_id, text):
+        key = self.make_key(model_id, text)
+        vector = self.memory.get(key)
+        if vector is None:
+            with self._lock, self._connect() as conn:
+                row = conn.execute('SELECT vector FROM embeddings WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    conn.execute('UPDATE embeddings SET last_used = ? WHERE key = ?', (time.time(), key))
+            if row is not None:
+                vector = np.frombuffer(row[0], dtype=np.float32)
+                self.memory.set(key, vector)
+        with self._lock:
+            self.stats['hits' if vector is not None else 'misses'] += 1
+        return None if vector is None else vector.tolist()
+
+    def set(self, model_id, text, embedding):
+        key = self.make_key(model_id, text)
+        vector = np.asarray(embedding, dtype=np.float32)
+        self.memory.set(key, vector)
+        with self._lock, self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO embeddings (key, model_id, dim, vector, last_used) '
+                         'VALUES (?, ?, ?, ?, ?)',
+                         (key, model_id, len(vector), sqlite3.Binary(vector.tobytes()), time.time()))
+            conn.execute('DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings '
+                         'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def get_or_compute(self, model_id, text, compute):
+        embedding = self.get(model_id, text)
+        if embedding is None:
+            embedding = compute(text)
+            self.set(model_id, text, embedding)
+        return embedding
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
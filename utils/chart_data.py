@@ -0,0 +1,134 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from utils.cache import LRUCache
+from utils.env_var import CHART_MAX_POINTS, CHART_TOP_N
+
+OTHER_LABEL = 'Other'
+
+# figures shared by reruns and sessions, keyed by result fingerprint and chart config
+_figure_cache = LRUCache(max_size=64)
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling, return the indices of the threshold points to keep.
+    x must be sorted ascending; first and last points are always kept.
+    """
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    selected = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = edges[i + 1], edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[next_start:next_end].mean() if next_end > next_start else x[-1]
+        next_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+        bucket_x = x[start:end]
+        bucket_y = y[start:end]
+        areas = np.abs((x[selected] - next_x) * (bucket_y - y[selected]) -
+                       (x[selected] - bucket_x) * (next_y - y[selected]))
+        selected = start + int(np.argmax(areas))
+        indices[i + 1] = selected
+    return indices
+
+
+def _is_ordered_axis(values: pd.Series) -> bool:
+    return pd.api.types.is_datetime64_any_dtype(values) or pd.api.types.is_numeric_dtype(values)
+
+
+def _numeric_axis(values: pd.Series) -> np.ndarray:
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.astype('int64').to_numpy(dtype=np.float64)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64)
+    return np.arange(len(values), dtype=np.float64)
+
+
+def aggregate_duplicates(df: pd.DataFrame, x, y, how='sum') -> pd.DataFrame:
+    """Collapse rows sharing the same x value into one, vectorized with groupby"""
+    if df[x].is_unique:
+        return df[[x, y]]
+    return df.groupby(x, sort=False, dropna=False)[y].agg(how).reset_index()
+
+
+def top_n_with_other(df: pd.DataFrame, x, y, n=CHART_TOP_N) -> pd.DataFrame:
+    """Keep the n largest categories by y, summing the others into a single 'Other' category"""
+    if len(df) <= n:
+        return df
+    ranked = df.sort_values(y, ascending=False)
+    top = ranked.iloc[:n]
+    other = pd.DataFrame({x: [OTHER_LABEL], y: [ranked[y].iloc[n:].sum()]})
+    return pd.concat([top, other], ignore_index=True)
+
+
+def prepare_chart_data(df: pd.DataFrame, chart_type, x, y, max_points=CHART_MAX_POINTS, top_n=CHART_TOP_N):
+    """
+    Reduce the query result to what the chart can show, return (data, note).
+    Bar and pie charts sum duplicate x values and keep the top_n categories plus 'Other',
+    line charts average duplicate x values, sort numeric or time x values and are downsampled with LTTB;
+    no chart gets more than max_points points.
+    """
+    rows = len(df)
+    if x == y or not pd.api.types.is_numeric_dtype(df[y]):
+        data = df.iloc[:max_points]
+    elif chart_type == 'Line':
+        data = aggregate_duplicates(df, x, y, how='mean')
+        # order numeric and time axes, categorical axes such as month names keep the order of the query
+        if _is_ordered_axis(data[x]):
+            data = data.sort_values(x, kind='stable')
+        if len(data) > max_points:
+            values = data[y].to_numpy(dtype=np.float64)
+            data = data.iloc[lttb_indices(_numeric_axis(data[x]), np.nan_to_num(values), max_points)]
+    else:
+        data = top_n_with_other(aggregate_duplicates(df, x, y, how='sum'), x, y, n=min(top_n, max_points))
+    note = ''
+    if len(data) < rows:
+        note = f'The chart shows {len(data)} aggregated or sampled points of {rows} rows.'
+    return data, note
+
+
+def get_page(df: pd.DataFrame, page: int, page_size: int) -> pd.DataFrame:
+    """Rows of the 1-based page"""
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size]
+
+
+def result_fingerprint(df: pd.DataFrame) -> str:
+    """
+    Content hash of the result; vectorized, a few milliseconds for the capped result sizes.
+    Not kept in attrs, since DataFrames derived with assign or copy inherit their attrs.
+    """
+    try:
+        values = pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()
+    except TypeError:
+        # unhashable cell values, e.g. JSON columns, fall back to the identity of this DataFrame
+        values = str(id(df)).encode()
+    return hashlib.sha256(str(list(df.columns)).encode() + values).hexdigest()
+
+
+def get_chart_figure(df: pd.DataFrame, chart_type, x, y):
+    """
+    Return (figure, note) of the chart, memoized on (result fingerprint, chart config)
+    so reruns with the same selection skip data preparation and figure building
+    """
+    key = (result_fingerprint(df), chart_type, x, y, CHART_MAX_POINTS, CHART_TOP_N)
+    cached = _figure_cache.get(key)
+    if cached is not None:
+        return cached
+    data, note = prepare_chart_data(df, chart_type, x, y)
+    if chart_type == 'Bar':
+        figure = px.bar(data, x=x, y=y)
+    elif chart_type == 'Line':
+        figure = px.line(data, x=x, y=y)
+    else:
+        figure = px.pie(data, names=x, values=y)
+    _figure_cache.set(key, (figure, note))
+    return figure, note
@@ -0,0 +1,135 @@
+import re
+from functools import partial
+
+import sqlalchemy as db
+from loguru import logger
+
+from utils.database import connect
+from utils.env_var import COLUMN_STATS_SAMPLE_ROWS, COLUMN_STATS_TOP_K, COLUMN_STATS_MAX_DISTINCT
+from utils.reflection import reflection_executor
+from utils.schema_linking import parse_columns, COLUMN_LINE_PATTERN
+
+ORDERABLE_TYPE_PATTERN = re.compile(r'INT|DEC|NUM|FLOAT|DOUBLE|REAL|DATE|TIME|YEAR|SERIAL|MONEY', re.IGNORECASE)
+# types without equality / ordering in some databases, or too large to be useful as value hints
+SKIPPED_TYPE_PATTERN = re.compile(r'JSON|BLOB|BYTEA|BINARY|GEOMETRY|XML|\[\]', re.IGNORECASE)
+MAX_HINT_VALUE_LENGTH = 30
+
+
+def get_profiled_columns(ddl: str) -> list:
+    """(column name, orderable) of the DDL columns statistics are computed for"""
+    columns = []
+    for column_name, line in parse_columns(ddl):
+        column_type = COLUMN_LINE_PATTERN.match(line).group(2)
+        if not SKIPPED_TYPE_PATTERN.search(column_type):
+            columns.append((column_name, bool(ORDERABLE_TYPE_PATTERN.search(column_type))))
+    return columns
+
+
+def profile_table(connection, table_name: str, columns: list, sample_rows=COLUMN_STATS_SAMPLE_ROWS,
+                  top_k=COLUMN_STATS_TOP_K, max_distinct=COLUMN_STATS_MAX_DISTINCT) -> dict:
+    """
+    Statistics of the columns of one table, computed over its first sample_rows rows with two set based queries:
+    one aggregate query for null fraction, distinct count and min/max of all columns,
+    one UNION ALL of per-column GROUP BYs for the top values of the low cardinality columns.
+    """
+    schema, _, name = table_name.rpartition('.')
+    table = db.table(name, *[db.column(column_name) for column_name, _ in columns], schema=schema or None)
+    sample = db.select(*table.c).limit(sample_rows).subquery('sample')
+
+    aggregates = [db.func.count()]
+    for column_name, orderable in columns:
+        column = sample.c[column_name]
+        aggregates += [db.func.count(column), db.func.count(column.distinct())]
+        if orderable:
+            aggregates += [db.func.min(column), db.func.max(column)]
+    row = iter(connection.execute(db.select(*aggregates)).one())
+    row_count = next(row)
+    stats = {}
+    for column_name, orderable in columns:
+        non_null, distinct = next(row), next(row)
+        column_stats = {'null_fraction': round(1 - non_null / row_count, 4) if row_count else None,
+                        'distinct': distinct}
+        if orderable:
+            minimum, maximum = next(row), next(row)
+            column_stats['min'] = None if minimum is None else str(minimum)
+            column_stats['max'] = None if maximum is None else str(maximum)
+        stats[column_name] = column_stats
+
+    low_cardinality = [column_name for column_name, _ in columns if 0 < stats[column_name]['distinct'] <= max_distinct]
+    if low_cardinality:
+        parts = [db.select(db.literal(column_name).label('column_name'),
+                           db.cast(sample.c[column_name], db.String).label('value'),
+                           db.func.count().label('count'))
+                 .where(sample.c[column_name].isnot(None)).group_by(sample.c[column_name])
+                 for column_name in low_cardinality]
+        query = db.union_all(*parts) if len(parts) > 1 else parts[0]
+        for column_name, value, count in connection.execute(query):
+            stats[column_name].setdefault('top_values', []).append([value, count])
+        for column_name in low_cardinality:
+            top_values = stats[column_name].get('top_values', [])
+            stats[column_name]['top_values'] = sorted(top_values, key=lambda item: item[1], reverse=True)[:top_k]
+    return {'sample_rows': row_count, 'columns': stats}
+
+
+def _profile_table_by_url(db_url, table_name, columns):
+    with connect(db_url) as connection:
+        return profile_table(connection, table_name, columns)
+
+
+def compute_column_stats(db_url: str, tables_info: dict, table_names=None) -> dict:
+    """
+    Column statistics of the tables of a profile (all of them unless table_names is given),
+    table name -> {'sample_rows', 'columns': {column -> stats}}. Tables run concurrently, bounded per server;
+    a table which fails is logged and left out.
+    """
+    tasks = []
+    for table_name in tables_info if table_names is None else table_names:
+        columns = get_profiled_columns(tables_info[table_name].get('ddl', ''))
+        if columns:
+            tasks.append((table_name, db_url, partial(_profile_table_by_url, db_url, table_name, columns)))
+    results, errors = reflection_executor.run(tasks)
+    logger.info(f'computed column statistics of {len(results)} tables, {len(errors)} failed')
+    return results
+
+
+def _format_value(value) -> str:
+    value = str(value)
+    return value if len(value) <= MAX_HINT_VALUE_LENGTH else value[:MAX_HINT_VALUE_LENGTH] + '...'
+
+
+def format_value_hint(column_stats: dict) -> str:
+    """Compact hint of a column: its values when there are few of them, otherwise its range"""
+    if column_stats.get('top_values'):
+        return 'values: ' + ', '.join(f"'{_format_value(value)}'" for value, _ in column_stats['top_values'])
+    if column_stats.get('min') is not None:
+        return f"range: {_format_value(column_stats['min'])} ~ {_format_value(column_stats['max'])}"
+    return ''
+
+
+def annotate_tables_info(tables_info: dict, column_stats: dict) -> dict:
+    """
+    Copy of tables_info with value hints appended to the column comments of the DDL,
+    so schema linking matches question words against values and the prompt shows valid literals
+    """
+    if not tables_info or not column_stats:
+        return tables_info
+    annotated = {}
+    for table_name, table_data in tables_info.items():
+        table_stats = column_stats.get(table_name, {}).get('columns', {})
+        hints = {column_name: format_value_hint(stats) for column_name, stats in table_stats.items()}
+        if not any(hints.values()):
+            annotated[table_name] = table_data
+            continue
+        lines = table_data['ddl'].splitlines()
+        for i, line in enumerate(lines[1:], start=1):
+            match = COLUMN_LINE_PATTERN.match(line)
+            hint = hints.get(match.group(1)) if match else None
+            if not hint:
+                continue
+            body = line.rstrip()
+            comma = body.endswith(',')
+            body = body.rstrip(',').rstrip()
+            body += f'; {hint}' if '--' in body else f' -- {hint}'
+            lines[i] = body + (',' if comma else '')
+        annotated[table_name] = dict(table_data, ddl='\n'.join(lines))
+    return annotated
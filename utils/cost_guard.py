@@ -0,0 +1,169 @@
+import json
+
+import sqlglot
+from loguru import logger
+from sqlalchemy import text
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+
+from utils.database import connect, get_db_url_dialect
+from utils.query_control import QueryCancelled, QueryTimeout
+from utils.env_var import COST_GUARD_LIMIT_ROWS, COST_GUARD_REFUSE_ROWS, COST_GUARD_LIMIT_COST, \
+    COST_GUARD_REFUSE_COST, COST_GUARD_LIMITED_ROWS
+from utils.sql_rewrite import to_sqlglot_dialect
+
+DEFAULT_COST_LIMITS = {
+    'limit_rows': COST_GUARD_LIMIT_ROWS,
+    'refuse_rows': COST_GUARD_REFUSE_ROWS,
+    'limit_cost': COST_GUARD_LIMIT_COST,
+    'refuse_cost': COST_GUARD_REFUSE_COST,
+    'limited_rows': COST_GUARD_LIMITED_ROWS,
+}
+
+
+class QueryRefused(Exception):
+    pass
+
+
+def get_cost_limits(database_profile: dict) -> dict:
+    """
+    Cost guard thresholds of a profile: its optional cost_guard dict over the environment defaults
+    """
+    # numbers come back from DynamoDB as Decimal
+    custom = {key: float(value) for key, value in (database_profile.get('cost_guard') or {}).items()}
+    return dict(DEFAULT_COST_LIMITS, **custom)
+
+
+def _walk(node, key):
+    """Yield every value stored under key in a nested JSON document"""
+    if isinstance(node, dict):
+        for k, v in node.items():
+            if k == key:
+                yield v
+            yield from _walk(v, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk(item, key)
+
+
+def parse_explain(dialect: str, plan) -> dict:
+    """
+    Extract the estimated rows, cost and output rows from an EXPLAIN ... JSON plan.
+    For PostgreSQL rows and cost are those of the top plan node, which already accounts for a LIMIT,
+    for MySQL the largest rows examined per scan and the query cost.
+    output_rows is the estimated size of the result: the top plan node on PostgreSQL, the rows produced by the
+    last joined table on MySQL, unknown (None) when MySQL groups or deduplicates the rows.
+    """
+    if isinstance(plan, (str, bytes)):
+        plan = json.loads(plan)
+    if dialect == 'postgresql':
+        top_plan = plan[0].get('Plan', {}) if isinstance(plan, list) and plan else {}
+        rows = float(top_plan['Plan Rows']) if 'Plan Rows' in top_plan else None
+        cost = float(top_plan['Total Cost']) if 'Total Cost' in top_plan else None
+        output_rows = rows
+    elif dialect == 'mysql':
+        rows = max((float(v) for v in _walk(plan, 'rows_examined_per_scan')), default=None)
+        cost = max((float(v) for v in _walk(plan, 'query_cost')), default=None)
+        produced = [float(v) for v in _walk(plan, 'rows_produced_per_join')]
+        grouped = next(_walk(plan, 'grouping_operation'), None) or next(_walk(plan, 'duplicates_removal'), None)
+        output_rows = produced[-1] if produced and not grouped else None
+    else:
+        rows, cost, output_rows = None, None, None
+    return {'rows': rows, 'cost': cost, 'output_rows': output_rows}
+
+
+def is_aggregate_query(query: str, dialect: str) -> bool:
+    """True when the top level select aggregates or groups rows, or the query cannot be parsed"""
+    try:
+        tree = sqlglot.parse_one(query, read=to_sqlglot_dialect(dialect))
+    except SqlglotError:
+        return True
+    if not isinstance(tree, exp.Select):
+        return False
+    return bool(tree.args.get('group') or tree.args.get('distinct') or
+                any(expression.find(exp.AggFunc) for expression in tree.expressions))
+
+
+def get_row_limit(query: str, dialect: str):
+    """The constant top level LIMIT of the query, None when it has none or cannot be parsed"""
+    try:
+        tree = sqlglot.parse_one(query, read=to_sqlglot_dialect(dialect))
+    except SqlglotError:
+        return None
+    limit = tree.args.get('limit')
+    value = limit.args.get('expression') if isinstance(limit, exp.Limit) else None
+    if isinstance(value, exp.Literal) and value.is_int:
+        return int(value.this)
+    return None
+
+
+def explain_query(db_url: str, query: str, handle=None) -> dict:
+    """
+    Estimated rows and cost of the query from the database planner, None values when unknown,
+    and the LIMIT the query already has. handle is the optional QueryHandle of the query, its timeout and cancel cover the EXPLAIN too.
+    """
+    dialect = get_db_url_dialect(db_url)
+    query = query.strip().rstrip(';')
+    if dialect == 'postgresql':
+        statement = f'EXPLAIN (FORMAT JSON) {query}'
+    elif dialect == 'mysql':
+        statement = f'EXPLAIN FORMAT=JSON {query}'
+    else:
+        return {'rows': None, 'cost': None, 'output_rows': None, 'limit': None}
+    with connect(db_url) as connection:
+        if handle is None:
+            plan = connection.execute(text(statement)).scalar()
+        else:
+            handle.attach(connection)
+            try:
+                plan = connection.execute(text(statement)).scalar()
+            except Exception as e:
+                error = handle.translate_error(e)
+                if error is e:
+                    raise
+                raise error from e
+            finally:
+                handle.detach(connection)
+    estimate = parse_explain(dialect, plan)
+    if dialect == 'mysql' and is_aggregate_query(query, dialect):
+        # MySQL plans show no aggregation step for aggregates without GROUP BY
+        estimate['output_rows'] = None
+    estimate['limit'] = get_row_limit(query, dialect)
+    return estimate
+
+
+def decide(estimate: dict, limits: dict) -> tuple:
+    """
+    Return ('run' | 'limit' | 'refuse', reason) for the estimate.
+    Only queries over the refuse thresholds are refused. Between the limit and refuse thresholds a query
+    returning more than limited_rows rows is limited; queries which already have a LIMIT of at most
+    limited_rows rows, aggregates and small results run as they are, a LIMIT would not make them cheaper.
+    """
+    rows, cost, output_rows = estimate.get('rows'), estimate.get('cost'), estimate.get('output_rows')
+    limit = estimate.get('limit')
+    reason = f'estimated {rows or 0:,.0f} rows at cost {cost or 0:,.0f}'
+    if (rows is not None and rows > limits['refuse_rows']) or (cost is not None and cost > limits['refuse_cost']):
+        return 'refuse', reason
+    if (rows is not None and rows > limits['limit_rows']) or (cost is not None and cost > limits['limit_cost']):
+        if limit is not None and limit <= limits['limited_rows']:
+            return 'run', ''
+        if output_rows is not None and output_rows > limits['limited_rows']:
+            return 'limit', f'estimated {output_rows:,.0f} result rows, {reason}'
+    return 'run', ''
+
+
+def check_query_cost(db_url: str, query: str, limits: dict, handle=None) -> tuple:
+    """
+    Pre-flight EXPLAIN of the query against the thresholds, returns (action, reason).
+    Queries the planner cannot estimate are run as they are; a cancel or timeout of handle is raised.
+    """
+    try:
+        estimate = explain_query(db_url, query, handle)
+    except (QueryCancelled, QueryTimeout):
+        raise
+    except Exception as e:
+        logger.warning(f'cannot explain query, run it without cost check: {e}')
+        return 'run', ''
+    action, reason = decide(estimate, limits)
+    logger.info(f'cost guard: {estimate=}, {action=}')
+    return action, reason
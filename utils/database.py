@@ -1,39 +1,313 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+
 import sqlalchemy as db
+from loguru import logger
+from utils.cache import make_cache_key
 from utils.env_var import RDS_MYSQL_HOST, RDS_MYSQL_PORT, RDS_MYSQL_USERNAME, RDS_MYSQL_PASSWORD, RDS_MYSQL_DBNAME, \
-    RDS_PQ_SCHEMA
+    RDS_PQ_SCHEMA, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING, \
+    DB_ENGINE_IDLE_TIMEOUT
 
+# process-wide engine registry, keyed by the resolved db url
+_engines = {}
+_engine_stats = {}
+_engine_lock = threading.Lock()
 
-def get_all_table_names(db_url: str, is_sample_db: bool, schema: str = None):
-    if is_sample_db:
-        print('checking connection...')
-        db_url = db_url.format(
+
+def resolve_db_url(db_url: str) -> str:
+    """
+    Fill in the RDS placeholders used by the demo profiles
+    """
+    if '{RDS_MYSQL_USERNAME}' in db_url:
+        return db_url.format(
             RDS_MYSQL_HOST=RDS_MYSQL_HOST,
             RDS_MYSQL_PORT=RDS_MYSQL_PORT,
             RDS_MYSQL_USERNAME=RDS_MYSQL_USERNAME,
             RDS_MYSQL_PASSWORD=RDS_MYSQL_PASSWORD,
             RDS_MYSQL_DBNAME=RDS_MYSQL_DBNAME,
         )
-    engine = db.create_engine(db_url)
+    return db_url
+
+
+def get_engine(db_url: str):
+    """
+    Return the shared pooled engine of the db url, creating it on first use
+    """
+    db_url = resolve_db_url(db_url)
+    with _engine_lock:
+        engine = _engines.get(db_url)
+        if engine is None:
+            engine = db.create_engine(db_url,
+                                      pool_size=DB_POOL_SIZE,
+                                      max_overflow=DB_MAX_OVERFLOW,
+                                      pool_timeout=DB_POOL_TIMEOUT,
+                                      pool_recycle=DB_POOL_RECYCLE,
+                                      pool_pre_ping=DB_POOL_PRE_PING)
+            _engines[db_url] = engine
+            _engine_stats[db_url] = {'connections': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                                     'last_used': time.time()}
+            logger.info(f'created engine for {engine.url.render_as_string(hide_password=True)}')
+        _engine_stats[db_url]['last_used'] = time.time()
+    dispose_idle_engines()
+    return engine
+
+
+@contextmanager
+def connect(db_url: str):
+    """
+    Check out a connection from the shared engine of the db url, recording the pool wait time
+    """
+    engine = get_engine(db_url)
+    start = time.time()
     with engine.connect() as connection:
-        print('connected to database')
+        wait = time.time() - start
+        with _engine_lock:
+            stats = _engine_stats.get(resolve_db_url(db_url))
+            if stats is not None:
+                stats['connections'] += 1
+                stats['wait_seconds'] += wait
+                stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait)
+        yield connection
+
+
+def dispose_engine(db_url: str):
+    db_url = resolve_db_url(db_url)
+    with _engine_lock:
+        engine = _engines.pop(db_url, None)
+        _engine_stats.pop(db_url, None)
+    if engine is not None:
+        engine.dispose()
 
-        metadata = db.MetaData()
-        if schema:
-            metadata.reflect(bind=connection, schema=schema)
-        else:
-            metadata.reflect(bind=connection)
-        tables = metadata.tables
-        table_name_list = []
 
-        for table_name, _ in tables.items():
-            table_name_list.append(table_name)
+def dispose_idle_engines(idle_timeout=DB_ENGINE_IDLE_TIMEOUT):
+    """
+    Dispose engines which have not been used for idle_timeout seconds and have no checked out connection
+    """
+    now = time.time()
+    with _engine_lock:
+        idle_urls = [url for url, stats in _engine_stats.items()
+                     if now - stats['last_used'] > idle_timeout and _engines[url].pool.checkedout() == 0]
+        idle_engines = [_engines.pop(url) for url in idle_urls]
+        for url in idle_urls:
+            _engine_stats.pop(url)
+    for engine in idle_engines:
+        logger.info(f'dispose idle engine {engine.url.render_as_string(hide_password=True)}')
+        engine.dispose()
 
-    return table_name_list
+
+def get_pool_metrics():
+    """
+    Pool metrics of every registered engine, keyed by the db url without password
+    """
+    metrics = {}
+    with _engine_lock:
+        for url, engine in _engines.items():
+            stats = _engine_stats[url]
+            pool = engine.pool
+            metrics[engine.url.render_as_string(hide_password=True)] = {
+                'pool_size': pool.size() if hasattr(pool, 'size') else None,
+                'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+                'connections': stats['connections'],
+                'avg_wait_seconds': stats['wait_seconds'] / stats['connections'] if stats['connections'] else 0.0,
+                'max_wait_seconds': stats['max_wait_seconds'],
+            }
+    return metrics
+
+
+def get_all_table_names(db_url: str, is_sample_db: bool, schema: str = None):
+    if is_sample_db:
+        print('checking connection...')
+        db_url = resolve_db_url(db_url)
+    # list the names with the inspector, reflecting every column of every table is not needed here
+    inspector = db.inspect(get_engine(db_url))
+    print('connected to database')
+    if schema:
+        return [f'{schema}.{table_name}' for table_name in inspector.get_table_names(schema=schema)]
+    return inspector.get_table_names()
 
 
 def get_db_url_dialect(db_url: str) -> str:
     return db_url.split("://")[0].split('+')[0]
 
 
+MYSQL_COLUMNS_QUERY = """
+    SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.COLUMN_COMMENT, t.TABLE_COMMENT
+    FROM information_schema.COLUMNS c
+    JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+    WHERE c.TABLE_SCHEMA = COALESCE(:schema, DATABASE()) AND c.TABLE_NAME IN :table_names
+    ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+MYSQL_KEYS_QUERY = """
+    SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM information_schema.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = COALESCE(:schema, DATABASE()) AND TABLE_NAME IN :table_names
+        AND (CONSTRAINT_NAME = 'PRIMARY' OR REFERENCED_TABLE_NAME IS NOT NULL)
+    ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION
+"""
+
+POSTGRES_COLUMNS_QUERY = """
+    SELECT c.relname, a.attname, pg_catalog.format_type(a.atttypid, a.atttypmod),
+        pg_catalog.col_description(c.oid, a.attnum), pg_catalog.obj_description(c.oid, 'pg_class')
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+    WHERE n.nspname = COALESCE(:schema, current_schema()) AND c.relname IN :table_names
+        AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum
+"""
+
+POSTGRES_KEYS_QUERY = """
+    SELECT cl.relname, CASE con.contype WHEN 'p' THEN 'PRIMARY' ELSE con.conname END,
+        att.attname, fcl.relname, fatt.attname
+    FROM pg_catalog.pg_constraint con
+    JOIN pg_catalog.pg_class cl ON cl.oid = con.conrelid
+    JOIN pg_catalog.pg_namespace n ON n.oid = cl.relnamespace
+    CROSS JOIN LATERAL unnest(con.conkey, con.confkey) WITH ORDINALITY AS k(attnum, fattnum, ord)
+    JOIN pg_catalog.pg_attribute att ON att.attrelid = con.conrelid AND att.attnum = k.attnum
+    LEFT JOIN pg_catalog.pg_class fcl ON fcl.oid = con.confrelid
+    LEFT JOIN pg_catalog.pg_attribute fatt ON fatt.attrelid = con.confrelid AND fatt.attnum = k.fattnum
+    WHERE n.nspname = COALESCE(:schema, current_schema()) AND cl.relname IN :table_names
+        AND con.contype IN ('p', 'f')
+    ORDER BY cl.relname, con.conname, k.ord
+"""
+
+# quoted literals ('a', 'it''s') or runs of text between them
+QUOTED_OR_PLAIN_PATTERN = re.compile(r"'(?:[^']|'')*'|[^']+")
+
+CATALOG_QUERIES = {
+    'mysql': (MYSQL_COLUMNS_QUERY, MYSQL_KEYS_QUERY),
+    'postgresql': (POSTGRES_COLUMNS_QUERY, POSTGRES_KEYS_QUERY),
+}
+
+
+def format_column_type(column_type: str) -> str:
+    """Upper case column type, quoted literals such as ENUM / SET values are kept as they are"""
+    return QUOTED_OR_PLAIN_PATTERN.sub(lambda m: m.group(0) if m.group(0).startswith("'") else m.group(0).upper(),
+                                       column_type)
+
+
+def fetch_table_catalog(connection, dialect: str, schema: str, table_names: list) -> dict:
+    """
+    Columns, types, comments, primary keys and foreign keys of all the tables in two set based catalog queries.
+    Returns table name -> {'comment', 'columns': [(name, type, comment)], 'primary_key', 'foreign_keys'}
+    """
+    columns_query, keys_query = CATALOG_QUERIES[dialect]
+    params = {'schema': schema, 'table_names': list(table_names)}
+    catalog = {}
+    statement = db.text(columns_query).bindparams(db.bindparam('table_names', expanding=True))
+    for table_name, column_name, column_type, column_comment, table_comment in connection.execute(statement, params):
+        table = catalog.setdefault(table_name, {'comment': table_comment, 'columns': [], 'primary_key': [],
+                                                'foreign_keys': {}})
+        table['columns'].append((column_name, format_column_type(column_type), column_comment))
+    statement = db.text(keys_query).bindparams(db.bindparam('table_names', expanding=True))
+    for table_name, constraint_name, column_name, ref_table, ref_column in connection.execute(statement, params):
+        if table_name not in catalog:
+            continue
+        if constraint_name == 'PRIMARY':
+            catalog[table_name]['primary_key'].append(column_name)
+        else:
+            foreign_key = catalog[table_name]['foreign_keys'].setdefault(constraint_name, ([], ref_table, []))
+            foreign_key[0].append(column_name)
+            foreign_key[2].append(ref_column)
+    return catalog
+
+
+def render_table_ddl(table_name: str, table: dict) -> str:
+    """
+    Render a catalog entry in the DDL format used in tables_info
+    """
+    table_comment = f'-- {table["comment"]}' if table['comment'] else ''
+    ddl = f"CREATE TABLE {table_name} {table_comment} \n (\n"
+    for column_name, column_type, column_comment in table['columns']:
+        column_comment = f'-- {column_comment}' if column_comment else ''
+        ddl += f"  {column_name} {column_type} {column_comment},\n"
+    if table['primary_key']:
+        ddl += f"  PRIMARY KEY ({', '.join(table['primary_key'])}),\n"
+    for columns, ref_table, ref_columns in table['foreign_keys'].values():
+        ddl += f"  FOREIGN KEY ({', '.join(columns)}) REFERENCES {ref_table}({', '.join(ref_columns)}),\n"
+    return ddl.rstrip(',\n') + "\n)"
+
+
+def _reflect_catalog(connection, schema: str, table_names: list) -> dict:
+    """Catalog entries from SQLAlchemy reflection, for dialects without a bulk catalog query"""
+    wanted = set(table_names)
+    metadata = db.MetaData()
+    metadata.reflect(bind=connection, schema=schema, only=lambda name, _: name in wanted, resolve_fks=False)
+    return {table.name: reflected_catalog_entry(table) for table in metadata.tables.values()}
+
+
+def reflected_catalog_entry(table: db.Table) -> dict:
+    """Catalog entry of a reflected SQLAlchemy table"""
+    return {
+        'comment': table.comment,
+        'columns': [(column.name, str(column.type), column.comment) for column in table.columns],
+        'primary_key': [column.name for column in table.primary_key.columns],
+        # referenced tables are not reflected, so the targets are read from their names
+        'foreign_keys': {fk.name or f'fk_{i}': ([element.parent.name for element in fk.elements],
+                                               fk.elements[0].target_fullname.split('.')[-2],
+                                               [element.target_fullname.split('.')[-1] for element in fk.elements])
+                         for i, fk in enumerate(table.foreign_key_constraints) if fk.elements},
+    }
+
+
+def table_fingerprint(table: dict) -> str:
+    """
+    Hash of everything the rendered DDL depends on: table comment, columns, primary key and foreign keys
+    """
+    return make_cache_key(table['comment'], table['columns'], table['primary_key'],
+                          sorted(table['foreign_keys'].values()))
+
+
+def _fetch_catalog(connection, dialect: str, schema: str, table_names: list) -> dict:
+    if dialect in CATALOG_QUERIES:
+        return fetch_table_catalog(connection, dialect, schema, table_names)
+    return _reflect_catalog(connection, schema, table_names)
+
+
+def _split_schema(schema: str, table_names: list) -> list:
+    return [t.split('.', 1)[1] if schema and t.startswith(f'{schema}.') else t for t in table_names]
+
+
+def get_table_fingerprints(db_url: str, schema: str, table_names: list) -> dict:
+    """
+    Fingerprint of each table (named as in tables_info) of one schema, from the catalog queries only.
+    Tables which no longer exist are missing from the result.
+    """
+    dialect = get_db_url_dialect(db_url)
+    with connect(db_url) as connection:
+        catalog = _fetch_catalog(connection, dialect, schema, _split_schema(schema, table_names))
+    return {f'{schema}.{table_name}' if schema else table_name: table_fingerprint(table)
+            for table_name, table in catalog.items()}
+
+
 def get_dll_for_tables(db_url: str, is_sample_db: bool, schema: str = None, selected_tables: list = []):
-    pass
\ No newline at end of file
+    """
+    tables_info dict ({'ddl', 'description', 'fingerprint'} per table) of the selected tables of one schema,
+    all tables of the schema when none are selected. Tables of a non default schema are named schema.table.
+    MySQL and PostgreSQL use bulk information_schema / pg_catalog queries, other dialects reflection.
+    """
+    if is_sample_db:
+        db_url = resolve_db_url(db_url)
+    dialect = get_db_url_dialect(db_url)
+    with connect(db_url) as connection:
+        table_names = _split_schema(schema, selected_tables)
+        if not table_names:
+            table_names = db.inspect(connection).get_table_names(schema=schema)
+        if not table_names:
+            return {}
+        catalog = _fetch_catalog(connection, dialect, schema, table_names)
+    tables_info = {}
+    for table_name in table_names:
+        if table_name not in catalog:
+            logger.warning(f'table {table_name} not found in schema {schema}')
+            continue
+        name = f'{schema}.{table_name}' if schema else table_name
+        tables_info[name] = {'ddl': render_table_ddl(name, catalog[table_name]),
+                             'description': catalog[table_name]['comment'],
+                             'fingerprint': table_fingerprint(catalog[table_name])}
+    logger.info(f'fetched definitions of {len(tables_info)} tables of schema {schema}')
+    return tables_info
@@ -9,4 +9,76 @@ RDS_MYSQL_HOST = os.getenv('RDS_MYSQL_HOST')
 RDS_MYSQL_PORT = os.getenv('RDS_MYSQL_PORT')
 RDS_MYSQL_DBNAME = os.getenv('RDS_MYSQL_DBNAME')
 
-RDS_PQ_SCHEMA = os.getenv('RDS_PQ_SCHEMA')
\ No newline at end of file
+RDS_PQ_SCHEMA = os.getenv('RDS_PQ_SCHEMA')
+
+CACHE_DIR = os.getenv('CACHE_DIR', os.path.join(os.getcwd(), '.cache'))
+
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', 7 * 24 * 3600))
+LLM_CACHE_MAX_SIZE = int(os.getenv('LLM_CACHE_MAX_SIZE', 256))
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_ENGINE_IDLE_TIMEOUT = int(os.getenv('DB_ENGINE_IDLE_TIMEOUT', 3600))
+
+OPENSEARCH_POOL_MAXSIZE = int(os.getenv('OPENSEARCH_POOL_MAXSIZE', 10))
+OPENSEARCH_ENDPOINT_TTL = int(os.getenv('OPENSEARCH_ENDPOINT_TTL', 3600))
+
+EMBEDDING_CACHE_MAX_SIZE = int(os.getenv('EMBEDDING_CACHE_MAX_SIZE', 2048))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', 100000))
+
+NLQ_RETRIEVAL_TIMEOUT = float(os.getenv('NLQ_RETRIEVAL_TIMEOUT', 5))
+NLQ_STAGE_TIMEOUT = float(os.getenv('NLQ_STAGE_TIMEOUT', 10))
+
+SCHEMA_LINKING_TOP_N = int(os.getenv('SCHEMA_LINKING_TOP_N', 5))
+SCHEMA_LINKING_MAX_COLUMNS = int(os.getenv('SCHEMA_LINKING_MAX_COLUMNS', 30))
+SCHEMA_LINKING_MIN_SCORE = float(os.getenv('SCHEMA_LINKING_MIN_SCORE', 1.0))
+SCHEMA_LINKING_USE_EMBEDDING = os.getenv('SCHEMA_LINKING_USE_EMBEDDING', 'false').lower() == 'true'
+
+PROMPT_CACHE_MAX_SIZE = int(os.getenv('PROMPT_CACHE_MAX_SIZE', 512))
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 60))
+
+QUERY_CHUNK_SIZE = int(os.getenv('QUERY_CHUNK_SIZE', 1000))
+QUERY_MAX_ROWS = int(os.getenv('QUERY_MAX_ROWS', 10000))
+QUERY_MAX_BYTES = int(os.getenv('QUERY_MAX_BYTES', 100 * 1024 * 1024))
+
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_TTL = int(os.getenv('RESULT_CACHE_TTL', 600))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+RESULT_CACHE_SPILL = os.getenv('RESULT_CACHE_SPILL', 'true').lower() == 'true'
+
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', 300))
+
+QUERY_STATEMENT_TIMEOUT = float(os.getenv('QUERY_STATEMENT_TIMEOUT', 60))
+
+COST_GUARD_LIMIT_ROWS = float(os.getenv('COST_GUARD_LIMIT_ROWS', 1e6))
+COST_GUARD_REFUSE_ROWS = float(os.getenv('COST_GUARD_REFUSE_ROWS', 1e8))
+COST_GUARD_LIMIT_COST = float(os.getenv('COST_GUARD_LIMIT_COST', 1e6))
+COST_GUARD_REFUSE_COST = float(os.getenv('COST_GUARD_REFUSE_COST', 1e8))
+COST_GUARD_LIMITED_ROWS = int(os.getenv('COST_GUARD_LIMITED_ROWS', 1000))
+
+SQL_REWRITE_ENABLED = os.getenv('SQL_REWRITE_ENABLED', 'true').lower() == 'true'
+SQL_DEFAULT_LIMIT = int(os.getenv('SQL_DEFAULT_LIMIT', 1000))
+
+CHART_MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', 2000))
+CHART_TOP_N = int(os.getenv('CHART_TOP_N', 20))
+TABLE_PAGE_SIZE = int(os.getenv('TABLE_PAGE_SIZE', 100))
+
+SCHEMA_CACHE_TTL = int(os.getenv('SCHEMA_CACHE_TTL', 600))
+
+REFLECTION_MAX_WORKERS = int(os.getenv('REFLECTION_MAX_WORKERS', 8))
+REFLECTION_WORKERS_PER_SERVER = int(os.getenv('REFLECTION_WORKERS_PER_SERVER', 2))
+
+SCHEMA_REFRESH_INTERVAL = int(os.getenv('SCHEMA_REFRESH_INTERVAL', 3600))
+
+COLUMN_STATS_SAMPLE_ROWS = int(os.getenv('COLUMN_STATS_SAMPLE_ROWS', 10000))
+COLUMN_STATS_TOP_K = int(os.getenv('COLUMN_STATS_TOP_K', 10))
+COLUMN_STATS_MAX_DISTINCT = int(os.getenv('COLUMN_STATS_MAX_DISTINCT', 20))
+
+DYNAMODB_SCAN_SEGMENTS = int(os.getenv('DYNAMODB_SCAN_SEGMENTS', 1))
+
+CONFIG_CACHE_TTL = int(os.getenv('CONFIG_CACHE_TTL', 300))
+CONFIG_CACHE_NEGATIVE_TTL = int(os.getenv('CONFIG_CACHE_NEGATIVE_TTL', 5))
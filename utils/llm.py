@@ -1,11 +1,14 @@
 import requests
 import json
-import boto3
+import os
+import time
 import boto3
 from botocore.config import Config
-from opensearchpy import OpenSearch
 from utils import opensearch
-import os
+from utils.cache import TieredCache, EmbeddingCache, make_cache_key
+from utils.singleflight import SingleFlight
+from utils.env_var import CACHE_DIR, LLM_CACHE_ENABLED, LLM_CACHE_TTL, LLM_CACHE_MAX_SIZE, EMBEDDING_CACHE_MAX_SIZE, \
+    EMBEDDING_CACHE_MAX_ENTRIES
 from loguru import logger
 
 BEDROCK_AWS_REGION = os.environ.get('BEDROCK_REGION', 'us-west-2')
@@ -23,6 +26,17 @@ config = Config(
 
 bedrock = None
 
+# completions are deterministic enough (temperature 0) to be reused across reruns, sessions and restarts
+llm_cache = TieredCache('llm_response', path=os.path.join(CACHE_DIR, 'llm_cache.sqlite3'),
+                        max_size=LLM_CACHE_MAX_SIZE, ttl=LLM_CACHE_TTL)
+
+EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v1'
+embedding_cache = EmbeddingCache(os.path.join(CACHE_DIR, 'embedding_cache.sqlite3'),
+                                 max_size=EMBEDDING_CACHE_MAX_SIZE, max_entries=EMBEDDING_CACHE_MAX_ENTRIES)
+
+# identical prompts sent by several sessions at once share one Bedrock call
+llm_flight = SingleFlight('llm')
+
 
 @logger.catch
 def get_bedrock_client():
@@ -52,6 +66,96 @@ def invoke_model(payload, model_id='anthropic.claude-v2:1'):
     return response_body['completion']
 
 
+def invoke_model_stream(payload, model_id='anthropic.claude-v2:1'):
+    """
+    Yield completion text pieces as Bedrock streams them back
+    """
+    body = json.dumps(payload)
+
+    accept = 'application/json'
+    contentType = 'application/json'
+
+    start = time.time()
+    response = get_bedrock_client().invoke_model_with_response_stream(body=body, modelId=model_id, accept=accept,
+                                                                      contentType=contentType)
+    first_token = True
+    for event in response.get('body'):
+        chunk = event.get('chunk')
+        if chunk:
+            chunk_obj = json.loads(chunk.get('bytes').decode())
+            if first_token:
+                logger.info(f'time to first token: {time.time() - start:.2f}s')
+                first_token = False
+            yield chunk_obj.get('completion', '')
+
+
+def invoke_model_shared(payload, model_id='anthropic.claude-v2:1'):
+    """
+    invoke_model where concurrent calls with the same model id and payload share a single request
+    """
+    response, shared = llm_flight.do(make_cache_key(model_id, payload),
+                                     lambda: invoke_model(payload, model_id=model_id))
+    return response
+
+
+def invoke_model_cached(payload, model_id='anthropic.claude-v2:1', profile_name=None):
+    """
+    invoke_model with a response cache keyed on model id and the full payload (prompt and sampling params).
+    Entries are tagged with the profile name so they can be invalidated when the profile changes.
+    """
+    if not LLM_CACHE_ENABLED:
+        return invoke_model_shared(payload, model_id=model_id)
+    key = make_cache_key(model_id, payload)
+    response = llm_cache.get_or_compute(key, lambda: invoke_model_shared(payload, model_id=model_id),
+                                        tag=profile_name)
+    logger.info(f'llm cache stats: {llm_cache.get_stats()}')
+    return response
+
+
+def invoke_model_stream_cached(payload, model_id='anthropic.claude-v2:1', profile_name=None):
+    """
+    Streaming counterpart of invoke_model_cached, a cached response is yielded as a single piece.
+    While an identical request is streaming for another session, its full response is awaited and yielded instead.
+    """
+    key = make_cache_key(model_id, payload)
+    if LLM_CACHE_ENABLED:
+        response = llm_cache.get(key)
+        if response is not None:
+            yield response
+            return
+    future, is_leader = llm_flight.join(key)
+    if not is_leader:
+        yield llm_flight.wait(future)
+        return
+    start = time.time()
+    pieces = []
+    try:
+        for piece in invoke_model_stream(payload, model_id=model_id):
+            pieces.append(piece)
+            yield piece
+        response = ''.join(pieces)
+        llm_flight.complete(key, response)
+    except Exception as e:
+        llm_flight.fail(key, e)
+        raise
+    finally:
+        # the consumer may stop iterating early (e.g. a Streamlit rerun), waiters must not hang on it
+        llm_flight.fail(key, RuntimeError('the shared llm request was abandoned'))
+    if LLM_CACHE_ENABLED:
+        llm_cache.set(key, response, tag=profile_name, elapsed=time.time() - start)
+
+
+def invalidate_llm_cache(profile_name=None):
+    if profile_name is None:
+        llm_cache.clear()
+    else:
+        llm_cache.invalidate(profile_name)
+
+
+def get_llm_cache_stats():
+    return llm_cache.get_stats()
+
+
 def claude_select_table():
     pass
 
@@ -71,7 +175,10 @@ Never query for all columns from a table. You must query only the columns that a
 Pay attention to use only the column names you can see in the tables below. Be careful to not query for columns that do not exist. Also, pay attention to which column is in which table.
 Pay attention to use CURDATE() function to get the current date, if the question involves "today".""".format(top_k=TOP_K)
 
-def claude_to_sql(ddl, hints, search_box, examples=None, model_id='anthropic.claude-v2:1', dialect='mysql'):
+def build_sql_prompt_prefix(ddl, hints, dialect='mysql'):
+    """
+    Render the static part of the text-to-SQL prompt: dialect instructions, DDL of the tables and hints
+    """
     long_string = ""
     for table_name, table_data in ddl.items():
         ddl_string = table_data["ddl"]
@@ -91,8 +198,7 @@ def claude_to_sql(ddl, hints, search_box, examples=None, model_id='anthropic.cla
     else:
         dialect_prompt = DEFAULT_DIALECT_PROMPT
 
-    if not examples:
-        prompt = '''Human:
+    return '''Human:
 {dialect_prompt}
 Here is DDL of the database you are working on:
 ```sql
@@ -102,9 +208,16 @@ Please do not perform any modifications to SQL tables.
 Absolutely do not output any columns, tables, or other information that is not mentioned in the database. Ensure that the program runs without errors.
 Here are some hints:
 {hints}
-You need to answer the question: "{question}" in SQL. Please give the SQL statement that can answer the question. Aside from giving the SQL answer, concisely explain yourself after giving the answer in same language as the question.
-Assistant:'''.format(dialect_prompt=dialect_prompt, ddl=ddl, hints=hints, question=search_box)
-        logger.info(f'{prompt=}')
+'''.format(dialect_prompt=dialect_prompt, ddl=ddl, hints=hints)
+
+
+def build_claude_to_sql_payload(ddl, hints, search_box, examples=None, dialect='mysql', prompt_prefix=None):
+    if prompt_prefix is None:
+        prompt_prefix = build_sql_prompt_prefix(ddl, hints, dialect=dialect)
+
+    if not examples:
+        prompt = prompt_prefix + '''You need to answer the question: "{question}" in SQL. Please give the SQL statement that can answer the question. Aside from giving the SQL answer, concisely explain yourself after giving the answer in same language as the question.
+Assistant:'''.format(question=search_box)
     else:
         # assemble examples into a string
 
@@ -113,20 +226,10 @@ Assistant:'''.format(dialect_prompt=dialect_prompt, ddl=ddl, hints=hints, questi
             example_prompt += "Q: " + item['_source']['text'] + "\n"
             example_prompt += "A: ```sql\n" + item['_source']['sql'] + "```\n"
 
-        prompt = '''Human:
-{dialect_prompt}
-Here is DDL of the database you are working on:
-```sql
-{ddl}
-```
-Please do not perform any modifications to SQL tables.
-Absolutely do not output any columns, tables, or other information that is not mentioned in the database. Ensure that the program runs without errors.
-Here are some hints:
-{hints}
-Also, here are some examples of generating SQL using natural language:
+        prompt = prompt_prefix + '''Also, here are some examples of generating SQL using natural language:
 {examples}
 Now, you need to answer the question: "{question}" in SQL. Please give the SQL statement that can answer the question. Aside from giving the SQL answer, concisely explain yourself after giving the answer in same language as the question.
-Assistant:'''.format(dialect_prompt=dialect_prompt, ddl=ddl, hints=hints, examples=example_prompt, question=search_box)
+Assistant:'''.format(examples=example_prompt, question=search_box)
     payload = {
         "prompt": prompt,
         "max_tokens_to_sample": 1024,
@@ -134,43 +237,62 @@ Assistant:'''.format(dialect_prompt=dialect_prompt, ddl=ddl, hints=hints, exampl
         "top_p": 0.9,
     }
     logger.info(f'prompt: {prompt}')
-    response = invoke_model(payload, model_id=model_id)
+    return payload
+
+
+def claude_to_sql(ddl, hints, search_box, examples=None, model_id='anthropic.claude-v2:1', dialect='mysql',
+                  profile_name=None):
+    payload = build_claude_to_sql_payload(ddl, hints, search_box, examples=examples, dialect=dialect)
+    response = invoke_model_cached(payload, model_id=model_id, profile_name=profile_name)
     return response
 
 
-def create_vector_embedding_with_bedrock(text, index_name):
+def extract_sql_from_response(response):
+    """
+    Return the SQL in the ```sql block of a (possibly partial) response, or None while the block is not closed
+    """
+    if '```sql' not in response:
+        return None
+    sql_part = response.split('```sql', 1)[1]
+    if '```' not in sql_part:
+        return None
+    return sql_part.split('```')[0]
+
+
+def claude_to_sql_stream(ddl, hints, search_box, examples=None, model_id='anthropic.claude-v2:1', dialect='mysql',
+                         profile_name=None, prompt_prefix=None):
+    """
+    Same as claude_to_sql, but yields the response text incrementally.
+    prompt_prefix can be rendered ahead of time with build_sql_prompt_prefix.
+    """
+    payload = build_claude_to_sql_payload(ddl, hints, search_box, examples=examples, dialect=dialect,
+                                          prompt_prefix=prompt_prefix)
+    yield from invoke_model_stream_cached(payload, model_id=model_id, profile_name=profile_name)
+
+
+def invoke_embedding_model(text, model_id=EMBEDDING_MODEL_ID):
     payload = {"inputText": f"{text}"}
     body = json.dumps(payload)
-    modelId = "amazon.titan-embed-text-v1"
     accept = "application/json"
     contentType = "application/json"
 
     response = get_bedrock_client().invoke_model(
-        body=body, modelId=modelId, accept=accept, contentType=contentType
+        body=body, modelId=model_id, accept=accept, contentType=contentType
     )
     response_body = json.loads(response.get("body").read())
 
-    embedding = response_body.get("embedding")
+    return response_body.get("embedding")
+
+
+def create_vector_embedding_with_bedrock(text, index_name):
+    embedding = embedding_cache.get_or_compute(EMBEDDING_MODEL_ID, text, invoke_embedding_model)
     return {"_index": index_name, "text": text, "vector_field": embedding}
 
 
 def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch_user, opensearch_password,
                                      query_embedding, top_k=3, host='', port=443):
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
-        host = opensearch.get_opensearch_endpoint(domain, region_name)
-        port = 443
-
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
+    opensearch_client = opensearch.get_opensearch_client(host, port, opensearch_user, opensearch_password,
+                                                         domain=domain, region_name=region_name)
     search_query = {
         "size": top_k,  # Adjust the size as needed to retrieve more or fewer results
         "query": {
@@ -194,20 +316,8 @@ def retrieve_results_from_opensearch(index_name, region_name, domain, opensearch
 
 def upload_results_to_opensearch(region_name, domain, opensearch_user, opensearch_password, index_name, query, sql,
                                  host='', port=443):
-    auth = (opensearch_user, opensearch_password)
-    if len(host) == 0:
-        host = opensearch.get_opensearch_endpoint(domain, region_name)
-        port = 443
-    # Create the client with SSL/TLS enabled, but hostname verification disabled.
-    opensearch_client = OpenSearch(
-        hosts=[{'host': host, 'port': port}],
-        http_compress=True,  # enables gzip compression for request bodies
-        http_auth=auth,
-        use_ssl=True,
-        verify_certs=False,
-        ssl_assert_hostname=False,
-        ssl_show_warn=False
-    )
+    opensearch_client = opensearch.get_opensearch_client(host, port, opensearch_user, opensearch_password,
+                                                         domain=domain, region_name=region_name)
 
     # Vector embedding using Amazon Bedrock Titan text embedding
     logger.info(f"Creating embeddings for records")
@@ -1,7 +1,17 @@
+import hashlib
+import threading
+
 import boto3
 from opensearchpy import OpenSearch, RequestsHttpConnection
 from opensearchpy.helpers import bulk
 from loguru import logger
+from utils.cache import LRUCache
+from utils.env_var import OPENSEARCH_POOL_MAXSIZE, OPENSEARCH_ENDPOINT_TTL
+
+# shared clients keep their http keep-alive connection pools between requests
+_opensearch_clients = {}
+_client_lock = threading.Lock()
+_endpoint_cache = LRUCache(max_size=64, ttl=OPENSEARCH_ENDPOINT_TTL)
 
 def get_opensearch_cluster_client(domain, user, password, region, index_name):
     opensearch_endpoint = get_opensearch_endpoint(domain, region)
@@ -20,11 +30,44 @@ def get_opensearch_cluster_client(domain, user, password, region, index_name):
     return opensearch_client
     
 def get_opensearch_endpoint(domain, region):
-    client = boto3.client('es', region_name=region)
-    response = client.describe_elasticsearch_domain(
-        DomainName=domain
-    )
-    return response['DomainStatus']['Endpoint']
+    key = (domain, region)
+    endpoint = _endpoint_cache.get(key)
+    if endpoint is None:
+        client = boto3.client('es', region_name=region)
+        response = client.describe_elasticsearch_domain(
+            DomainName=domain
+        )
+        endpoint = response['DomainStatus']['Endpoint']
+        _endpoint_cache.set(key, endpoint)
+    return endpoint
+
+
+def get_opensearch_client(host, port, user, password, domain='', region_name=''):
+    """
+    Return a shared client for the host (resolved from the domain when host is empty),
+    with SSL/TLS enabled, but hostname verification disabled.
+    """
+    if not host:
+        host = get_opensearch_endpoint(domain, region_name)
+        port = 443
+    credential = hashlib.sha256(f'{user}:{password}'.encode('utf-8')).hexdigest()
+    key = (host, str(port), credential)
+    with _client_lock:
+        client = _opensearch_clients.get(key)
+        if client is None:
+            client = OpenSearch(
+                hosts=[{'host': host, 'port': port}],
+                http_compress=True,  # enables gzip compression for request bodies
+                http_auth=(user, password),
+                use_ssl=True,
+                verify_certs=False,
+                ssl_assert_hostname=False,
+                ssl_show_warn=False,
+                pool_maxsize=OPENSEARCH_POOL_MAXSIZE
+            )
+            _opensearch_clients[key] = client
+            logger.info(f'created opensearch client for {host}:{port}')
+    return client
 
 def put_bulk_in_opensearch(list, client):
     logger.info(f"Putting {len(list)} documents in OpenSearch")
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from loguru import logger
+
+_NO_FALLBACK = object()
+
+
+class StageSkipped(Exception):
+    pass
+
+
+class Stage:
+
+    def __init__(self, name, func, deps=(), timeout=None, fallback=_NO_FALLBACK):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+    def has_fallback(self):
+        return self.fallback is not _NO_FALLBACK
+
+
+class StageGraph:
+    """
+    A small graph of pipeline stages executed concurrently on a thread pool.
+
+    Each stage function receives the results of its dependencies as keyword arguments.
+    A stage timeout is a deadline in seconds from the start of the run. When a stage times out or fails,
+    its fallback value is used instead; stages depending on a failed stage are skipped and fall back too.
+    Stage functions run outside the Streamlit script thread, so they must not call st.* APIs.
+    """
+
+    def __init__(self, name='pipeline'):
+        self.name = name
+        self.stages = {}
+        self.timings = {}
+        self._results = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, func, deps=(), timeout=None, fallback=_NO_FALLBACK):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f'stage {name} depends on unknown stage {dep}')
+        self.stages[name] = Stage(name, func, deps, timeout, fallback)
+        return self
+
+    def run(self):
+        if not self.stages:
+            return {}
+        start = time.time()
+        self._results = {}
+        # every stage gets its own worker, so stages waiting on dependencies cannot starve the pool
+        executor = ThreadPoolExecutor(max_workers=len(self.stages), thread_name_prefix=self.name)
+        futures = {}
+        try:
+            for name, stage in self.stages.items():
+                futures[name] = executor.submit(self._run_stage, stage, futures, start)
+            results = {name: self._resolve(self.stages[name], futures[name], start)[0] for name in self.stages}
+        finally:
+            # stages which timed out keep running in the background, nobody waits for them
+            executor.shutdown(wait=False)
+        logger.info(f'{self.name} finished in {time.time() - start:.2f}s, stage timings: {self.timings}')
+        return results
+
+    def _run_stage(self, stage, futures, start):
+        kwargs = {}
+        for dep in stage.deps:
+            value, ok = self._resolve(self.stages[dep], futures[dep], start)
+            if not ok:
+                raise StageSkipped(f'dependency {dep} failed')
+            kwargs[dep] = value
+        stage_start = time.time()
+        result = stage.func(**kwargs)
+        self.timings[stage.name] = round(time.time() - stage_start, 3)
+        return result
+
+    def _resolve(self, stage, future, start):
+        """Return (value, ok) of the stage, applying its deadline and fallback once"""
+        with self._lock:
+            if stage.name in self._results:
+                return self._results[stage.name]
+        timeout = None if stage.timeout is None else max(0.0, start + stage.timeout - time.time())
+        try:
+            resolved = (future.result(timeout=timeout), True)
+        except Exception as e:
+            if not stage.has_fallback():
+                raise
+            if isinstance(e, TimeoutError):
+                logger.warning(f'{self.name} stage {stage.name} timed out after {stage.timeout}s, use fallback')
+            elif isinstance(e, StageSkipped):
+                logger.info(f'{self.name} stage {stage.name} skipped: {e}')
+            else:
+                logger.opt(exception=e).warning(f'{self.name} stage {stage.name} failed, use fallback')
+            resolved = (stage.fallback, False)
+        with self._lock:
+            return self._results.setdefault(stage.name, resolved)
@@ -0,0 +1,74 @@
+import threading
+
+from loguru import logger
+
+from utils.cache import LRUCache, make_cache_key
+from utils.database import get_db_url_dialect
+from utils.env_var import PROMPT_CACHE_MAX_SIZE
+from utils.llm import build_sql_prompt_prefix
+from utils.schema_linking import estimate_tokens
+
+# compiled prompt prefixes, keyed by profile name, dialect, hints and the DDL of the included tables.
+# The key holds the content the prefix is rendered from, so a table change only affects the subsets containing it.
+_compiled_prompts = LRUCache(max_size=PROMPT_CACHE_MAX_SIZE)
+_version_lock = threading.Lock()
+
+
+class CompiledPrompt:
+    """Static prompt prefix of a profile, rendered once per profile version"""
+
+    def __init__(self, profile_name, version, prefix):
+        self.profile_name = profile_name
+        self.version = version
+        self.prefix = prefix
+        self.token_count = estimate_tokens(prefix)
+
+
+def get_profile_version(database_profile: dict) -> str:
+    """
+    Version stamp of the prompt relevant content of a profile, computed once and kept in the profile dict
+    """
+    with _version_lock:
+        if 'version' not in database_profile:
+            database_profile['version'] = make_cache_key(database_profile['tables_info'],
+                                                         database_profile['hints'],
+                                                         database_profile['db_url'])
+        return database_profile['version']
+
+
+def compile_prompt_prefix(profile_name, database_profile, tables_info=None, dialect=None) -> CompiledPrompt:
+    """
+    Return the compiled prompt prefix (dialect prompt, DDL and hints) of the profile.
+    tables_info can be a pruned subset of the profile tables; each subset is compiled and cached separately.
+    """
+    if tables_info is None:
+        tables_info = database_profile['tables_info']
+    if dialect is None:
+        dialect = get_db_url_dialect(database_profile['db_url'])
+    version = get_profile_version(database_profile)
+    # str hashes are cached by the interpreter, so building this key does not rehash unchanged DDL
+    tables_key = tuple((table_name, table_data['ddl']) for table_name, table_data in tables_info.items())
+    key = (profile_name, dialect, database_profile['hints'], tables_key)
+    compiled = _compiled_prompts.get(key)
+    if compiled is None:
+        compiled = CompiledPrompt(profile_name, version,
+                                  build_sql_prompt_prefix(tables_info, database_profile['hints'], dialect=dialect))
+        _compiled_prompts.set(key, compiled, tag=profile_name)
+        logger.info(f'compiled prompt prefix of {profile_name} ({len(tables_info)} tables, '
+                    f'about {compiled.token_count} tokens)')
+    return compiled
+
+
+def invalidate_compiled_prompts(profile_name=None, table_names=None):
+    """
+    Drop the compiled prefixes of the profile, or with table_names only those including one of the tables
+    """
+    if profile_name is None:
+        _compiled_prompts.clear()
+    elif table_names is None:
+        _compiled_prompts.invalidate(profile_name)
+    else:
+        table_names = set(table_names)
+        count = _compiled_prompts.delete_where(
+            lambda key, tag: tag == profile_name and any(table_name in table_names for table_name, _ in key[3]))
+        logger.info(f'dropped {count} compiled prompt prefixes of {profile_name} including {sorted(table_names)}')
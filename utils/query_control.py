@@ -0,0 +1,118 @@
+import threading
+import time
+
+from loguru import logger
+from sqlalchemy import text
+
+from utils.database import connect, get_db_url_dialect
+
+TIMEOUT_MESSAGES = ('statement timeout', 'maximum statement execution time exceeded')
+
+_stats = {'timeouts': 0, 'cancels': 0}
+_stats_lock = threading.Lock()
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def _count(key):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def get_query_control_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+class QueryHandle:
+    """
+    Control handle of a query running on a worker thread.
+    The worker attaches its connection, which applies the statement timeout of the dialect
+    (statement_timeout on PostgreSQL, MAX_EXECUTION_TIME on MySQL) and records the server side session id,
+    so cancel can interrupt the query from another thread with pg_cancel_backend or KILL QUERY.
+    Other dialects are only checked between fetched chunks.
+    """
+
+    def __init__(self, db_url, timeout=None):
+        self.db_url = db_url
+        self.dialect = get_db_url_dialect(db_url)
+        self.timeout = timeout
+        self.backend_id = None
+        self.cancelled = False
+        self.preview = None
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    def attach(self, connection):
+        timeout_ms = int(self.timeout * 1000) if self.timeout else 0
+        if self.dialect == 'postgresql':
+            # a plain SET is rolled back with the transaction, so it does not leak to the next pool user
+            if timeout_ms:
+                connection.execute(text(f'SET statement_timeout = {timeout_ms}'))
+            backend_id = connection.execute(text('SELECT pg_backend_pid()')).scalar()
+        elif self.dialect == 'mysql':
+            if timeout_ms:
+                connection.execute(text(f'SET SESSION MAX_EXECUTION_TIME = {timeout_ms}'))
+            backend_id = connection.execute(text('SELECT CONNECTION_ID()')).scalar()
+        else:
+            backend_id = None
+        with self._lock:
+            self.backend_id = backend_id
+        self.check()
+
+    def detach(self, connection):
+        with self._lock:
+            self.backend_id = None
+        if self.dialect == 'mysql' and self.timeout:
+            try:
+                connection.execute(text('SET SESSION MAX_EXECUTION_TIME = 0'))
+            except Exception as e:
+                logger.warning(f'cannot reset MAX_EXECUTION_TIME: {e}')
+
+    def check(self):
+        """Raise if the query was cancelled or ran past its timeout, called between chunks"""
+        if self.cancelled:
+            raise QueryCancelled('The query was cancelled.')
+        if self.timeout and self.elapsed() > self.timeout:
+            _count('timeouts')
+            raise QueryTimeout(f'The query was stopped after the {self.timeout:.0f}s timeout.')
+
+    def cancel(self):
+        """Cancel the query, interrupting it on the database server when the session id is known"""
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            backend_id = self.backend_id
+        _count('cancels')
+        if backend_id is None:
+            return
+        try:
+            with connect(self.db_url) as connection:
+                if self.dialect == 'postgresql':
+                    connection.execute(text('SELECT pg_cancel_backend(:pid)'), {'pid': backend_id})
+                elif self.dialect == 'mysql':
+                    connection.execute(text(f'KILL QUERY {int(backend_id)}'))
+            logger.info(f'cancelled query of {self.dialect} session {backend_id}')
+        except Exception as e:
+            logger.warning(f'cannot cancel query of {self.dialect} session {backend_id}: {e}')
+
+    def translate_error(self, error):
+        """Map a database error caused by cancel or timeout to QueryCancelled / QueryTimeout, else return it"""
+        if self.cancelled:
+            return QueryCancelled('The query was cancelled.')
+        message = str(error).lower()
+        if getattr(getattr(error, 'orig', None), 'pgcode', None) == '57014' or \
+                any(m in message for m in TIMEOUT_MESSAGES):
+            _count('timeouts')
+            return QueryTimeout(f'The query was stopped after the {self.timeout or 0:.0f}s timeout.')
+        return error
@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from loguru import logger
+from sqlalchemy.engine import make_url
+
+from utils.database import resolve_db_url
+from utils.env_var import REFLECTION_MAX_WORKERS, REFLECTION_WORKERS_PER_SERVER
+
+
+class ReflectionExecutor:
+    """
+    Thread pool for schema reflection / catalog queries.
+    At most per_server_workers tasks run against one database server at a time, across all callers,
+    so onboarding many schemas does not flood a single server with catalog queries.
+    """
+
+    def __init__(self, max_workers=REFLECTION_MAX_WORKERS, per_server_workers=REFLECTION_WORKERS_PER_SERVER):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='reflection')
+        self.per_server_workers = per_server_workers
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, db_url):
+        url = make_url(resolve_db_url(db_url))
+        server = (url.host, url.port) if url.host else url.render_as_string(hide_password=True)
+        with self._lock:
+            if server not in self._semaphores:
+                self._semaphores[server] = threading.BoundedSemaphore(self.per_server_workers)
+            return self._semaphores[server]
+
+    @staticmethod
+    def _run(func, semaphore):
+        try:
+            return func()
+        finally:
+            semaphore.release()
+
+    def run(self, tasks, on_progress=None):
+        """
+        Run (label, db_url, func) tasks concurrently, return (results, errors) dicts keyed by label.
+        A failing task does not stop the others. on_progress(label, done, total, error) is called
+        in the calling thread as tasks finish, so it may update the Streamlit page.
+        """
+        pending = list(tasks)
+        running = {}
+        results, errors = {}, {}
+        while pending or running:
+            for task in list(pending):
+                label, db_url, func = task
+                semaphore = self._get_semaphore(db_url)
+                if semaphore.acquire(blocking=False):
+                    pending.remove(task)
+                    running[self.executor.submit(self._run, func, semaphore)] = label
+            if not running:
+                # every slot of the servers is taken by other callers, check again shortly
+                time.sleep(0.1)
+                continue
+            done, _ = wait(running, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                label = running.pop(future)
+                try:
+                    results[label] = future.result()
+                except Exception as e:
+                    logger.opt(exception=e).warning(f'reflection task {label} failed')
+                    errors[label] = e
+                if on_progress is not None:
+                    on_progress(label, len(results) + len(errors), len(tasks), errors.get(label))
+        return results, errors
+
+
+reflection_executor = ReflectionExecutor()
@@ -0,0 +1,176 @@
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+from loguru import logger
+
+from utils.cache import SQLiteStore, make_cache_key
+from utils.env_var import CACHE_DIR, RESULT_CACHE_TTL, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_SPILL
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# quoted literals / identifiers are kept verbatim, runs of whitespace and comments collapse to one space
+SQL_TOKEN_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`)|((?:\s|--[^\n]*|/\*.*?\*/)+)", re.DOTALL)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """
+    Canonical form of a SQL text for cache keys: comments removed, whitespace collapsed, trailing semicolons stripped
+    """
+    sql = SQL_TOKEN_PATTERN.sub(lambda m: m.group(1) or ' ', sql)
+    return sql.strip().rstrip(';').strip()
+
+
+def dataframe_to_bytes(df: pd.DataFrame) -> bytes:
+    """
+    Arrow IPC stream of the DataFrame. Frames Arrow cannot represent (duplicate column names,
+    object columns mixing types) are pickled instead.
+    """
+    if pa is None:
+        return pickle.dumps(df)
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowException, ValueError, TypeError) as e:
+        logger.info(f'query result is not Arrow compatible, pickle it: {e}')
+        return pickle.dumps(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def dataframe_from_bytes(buffer: bytes) -> pd.DataFrame:
+    # pickles start with the PROTO opcode, Arrow IPC streams with the 0xFFFFFFFF continuation marker
+    if pa is None or buffer[:1] == pickle.PROTO:
+        return pickle.loads(buffer)
+    return pa.ipc.open_stream(buffer).read_all().to_pandas()
+
+
+class QueryResultCache:
+    """
+    Query results shared by all sessions, keyed on (connection url, canonical SQL).
+    Results are kept as Arrow IPC buffers in an LRU bounded by max_bytes; entries evicted from memory
+    spill to a SQLite file when spill_path is set. Entries are tagged with the profile name for invalidation.
+    """
+
+    def __init__(self, max_bytes=RESULT_CACHE_MAX_BYTES, ttl=RESULT_CACHE_TTL, spill_path=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.store = None
+        if spill_path:
+            try:
+                self.store = SQLiteStore(spill_path, table='query_results', ttl=ttl)
+            except sqlite3.Error as e:
+                logger.warning(f'query result cache does not spill to disk, cannot open {spill_path}: {e}')
+        self.stats = {'hits': 0, 'spill_hits': 0, 'misses': 0, 'spilled': 0}
+
+    @staticmethod
+    def make_key(db_url, sql):
+        return make_cache_key(db_url, canonicalize_sql(sql))
+
+    def get(self, db_url, sql):
+        """Return a fresh DataFrame of the cached result with attrs['cached_at'] set, or None"""
+        key = self.make_key(db_url, sql)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry['created_at'] + self.ttl < time.time():
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.stats['hits'] += 1
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None:
+                self.store.delete(key)
+                with self._lock:
+                    self.stats['spill_hits'] += 1
+                    self._insert(key, entry)
+        if entry is None:
+            with self._lock:
+                self.stats['misses'] += 1
+            return None
+        df = dataframe_from_bytes(entry['buffer'])
+        df.attrs.update(entry['attrs'])
+        df.attrs['cached_at'] = entry['created_at']
+        return df
+
+    def set(self, db_url, sql, df: pd.DataFrame, tag=None):
+        buffer = dataframe_to_bytes(df)
+        if len(buffer) > self.max_bytes:
+            logger.info(f'query result of {len(buffer)} bytes exceeds the result cache budget, not cached')
+            return
+        attrs = {k: v for k, v in df.attrs.items() if k != 'cached_at'}
+        entry = {'buffer': buffer, 'attrs': attrs, 'tag': tag, 'created_at': time.time()}
+        with self._lock:
+            self._insert(self.make_key(db_url, sql), entry)
+
+    def _insert(self, key, entry):
+        self._remove(key)
+        self._data[key] = entry
+        self.current_bytes += len(entry['buffer'])
+        while self.current_bytes > self.max_bytes and self._data:
+            evicted_key, evicted = self._data.popitem(last=False)
+            self.current_bytes -= len(evicted['buffer'])
+            self._spill(evicted_key, evicted)
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= len(entry['buffer'])
+
+    def _spill(self, key, entry):
+        remaining = entry['created_at'] + self.ttl - time.time()
+        if self.store is None or remaining <= 0:
+            return
+        self.store.set(key, entry, tag=entry['tag'], ttl=remaining)
+        self.stats['spilled'] += 1
+
+    def invalidate(self, tag):
+        with self._lock:
+            keys = [key for key, entry in self._data.items() if entry['tag'] == tag]
+            for key in keys:
+                self._remove(key)
+        if self.store is not None:
+            self.store.invalidate(tag)
+        logger.info(f'query result cache invalidated {len(keys)} in-memory entries of {tag}')
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats, entries=len(self._data), bytes=self.current_bytes)
+        lookups = stats['hits'] + stats['spill_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['spill_hits']) / lookups if lookups else 0.0
+        return stats
+
+
+query_result_cache = QueryResultCache(
+    spill_path=os.path.join(CACHE_DIR, 'query_results.sqlite3') if RESULT_CACHE_SPILL else None)
+
+
+def invalidate_result_cache(profile_name=None):
+    if profile_name is None:
+        query_result_cache.clear()
+    else:
+        query_result_cache.invalidate(profile_name)
+
+
+def get_result_cache_stats():
+    return query_result_cache.get_stats()
@@ -0,0 +1,120 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+
+from utils.schema_linking import estimate_tokens
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+
+def _to_column_array(values: tuple) -> np.ndarray:
+    """
+    Convert the values of one column: numbers become int64/float64 arrays (None as NaN), anything else object
+    """
+    non_null = [v for v in values if v is not None]
+    if non_null and all(isinstance(v, numbers.Number) and not isinstance(v, bool) for v in non_null):
+        try:
+            if len(non_null) == len(values) and all(isinstance(v, numbers.Integral) for v in non_null):
+                return np.asarray(values, dtype=np.int64)
+            return np.asarray(values, dtype=np.float64)
+        except (OverflowError, TypeError, ValueError):
+            pass
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _to_arrow_array(array: np.ndarray):
+    try:
+        return pa.array(array)
+    except (pa.ArrowException, ValueError, TypeError):
+        return pa.array([None if value is None else str(value) for value in array], type=pa.string())
+
+
+class ColumnarResult:
+    """
+    Query result stored column by column as NumPy arrays.
+    Text rendering for LLM prompts is only produced on demand, via to_text.
+    """
+
+    def __init__(self, columns: list, arrays: list):
+        self.columns = list(columns)
+        self.arrays = list(arrays)
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        if rows:
+            arrays = [_to_column_array(values) for values in zip(*rows)]
+        else:
+            arrays = [np.asarray([], dtype=object) for _ in columns]
+        return cls(columns, arrays)
+
+    @classmethod
+    def from_ipc_bytes(cls, buffer: bytes):
+        if pa is None:
+            raise ImportError('pyarrow is required to read Arrow IPC buffers')
+        table = pa.ipc.open_stream(buffer).read_all()
+        return cls(table.column_names, [column.to_numpy(zero_copy_only=False) for column in table.columns])
+
+    @property
+    def dtypes(self) -> list:
+        """dtype of each column, in the order of columns (names may repeat, e.g. a.id and b.id of a join)"""
+        return [str(array.dtype) for array in self.arrays]
+
+    def __len__(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    def to_arrow(self):
+        """
+        Arrow table of the columns, built positionally so duplicate column names are kept.
+        Object columns Arrow cannot convert (mixing Python types) are rendered as strings.
+        """
+        if pa is None:
+            raise ImportError('pyarrow is required for Arrow conversion')
+        return pa.Table.from_arrays([_to_arrow_array(array) for array in self.arrays], names=self.columns)
+
+    def to_ipc_bytes(self) -> bytes:
+        table = self.to_arrow()
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Wrap the column arrays as a DataFrame, without copying the numeric buffers where possible.
+        Results with columns Arrow cannot convert are wrapped by pandas directly, keeping the values as they are.
+        """
+        if pa is not None:
+            try:
+                arrays = [pa.array(array) for array in self.arrays]
+            except (pa.ArrowException, ValueError, TypeError):
+                arrays = None
+            if arrays is not None:
+                # Arrow refuses duplicate names when converting to pandas, the names are set afterwards
+                df = pa.Table.from_arrays(arrays, names=[str(i) for i in range(len(arrays))]).to_pandas(
+                    split_blocks=True)
+                df.columns = self.columns
+                return df
+        df = pd.DataFrame(dict(enumerate(self.arrays)), copy=False)
+        df.columns = self.columns
+        return df
+
+    def to_text(self, max_tokens=2000) -> str:
+        """
+        Render the result as header plus one line per row, truncated to about max_tokens tokens
+        """
+        lines = [' | '.join(str(column) for column in self.columns)]
+        token_count = estimate_tokens(lines[0])
+        for row_index in range(len(self)):
+            line = ' | '.join(str(array[row_index]) for array in self.arrays)
+            token_count += estimate_tokens(line)
+            if token_count > max_tokens:
+                lines.append(f'... ({len(self) - row_index} more rows)')
+                break
+            lines.append(line)
+        return '\n'.join(lines)
@@ -0,0 +1,225 @@
+import math
+import re
+from collections import Counter, deque
+
+from loguru import logger
+
+from utils.cache import LRUCache, make_cache_key
+
+COLUMN_LINE_PATTERN = re.compile(r'^\s*[`"\[]?(\w+)[`"\]]?\s+([A-Za-z][^\s,]*)(.*)$')
+REFERENCES_PATTERN = re.compile(r'REFERENCES\s+[`"]?(?:\w+\.)?(\w+)[`"]?', re.IGNORECASE)
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+CJK_PATTERN = re.compile(r'[一-鿿]+')
+TRAILING_COMMA_PATTERN = re.compile(r',(\s*(?:--.*)?)$')
+DDL_KEYWORDS = {'create', 'primary', 'foreign', 'key', 'constraint', 'unique', 'index', 'references'}
+
+_index_cache = LRUCache(max_size=64)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate: one token per CJK character, one per four other characters
+    """
+    cjk_chars = sum(len(m) for m in CJK_PATTERN.findall(text))
+    return cjk_chars + math.ceil((len(text) - cjk_chars) / 4)
+
+
+def tokenize(text: str) -> list:
+    """
+    Lowercase word tokens (snake_case split into parts) plus character bigrams for CJK text
+    """
+    if not text:
+        return []
+    text = str(text).lower()
+    tokens = []
+    for word in WORD_PATTERN.findall(text.replace('_', ' ')):
+        tokens.append(word)
+        if len(word) > 3 and word.endswith('s'):
+            tokens.append(word[:-1])
+    for segment in CJK_PATTERN.findall(text):
+        if len(segment) == 1:
+            tokens.append(segment)
+        tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+    return tokens
+
+
+def parse_columns(ddl: str) -> list:
+    """
+    Extract (column name, ddl line) pairs from a CREATE TABLE statement rendered one column per line
+    """
+    columns = []
+    for line in ddl.splitlines()[1:]:
+        match = COLUMN_LINE_PATTERN.match(line)
+        if match and match.group(1).lower() not in DDL_KEYWORDS:
+            columns.append((match.group(1), line))
+    return columns
+
+
+class SchemaIndex:
+    """
+    Lexical index over the table names, descriptions, column names and comments of a profile
+    """
+
+    def __init__(self, tables_info: dict):
+        self.tables_info = tables_info
+        self.table_columns = {}
+        self.table_terms = {}
+        self.column_terms = {}
+        for table_name, table_data in tables_info.items():
+            ddl = table_data.get('ddl', '')
+            columns = parse_columns(ddl)
+            self.table_columns[table_name] = columns
+            terms = Counter(tokenize(table_name.split('.')[-1]) * 3 + tokenize(table_data.get('description')))
+            for column_name, line in columns:
+                column_terms = set(tokenize(column_name) + tokenize(line.split('--', 1)[-1] if '--' in line else ''))
+                self.column_terms[(table_name, column_name)] = column_terms
+                terms.update(column_terms)
+            self.table_terms[table_name] = terms
+        document_frequency = Counter(term for terms in self.table_terms.values() for term in terms)
+        table_count = max(len(tables_info), 1)
+        self.idf = {term: math.log(1 + table_count / df) for term, df in document_frequency.items()}
+        self.join_graph = self._build_join_graph()
+
+    def _build_join_graph(self):
+        """Edges from declared foreign keys and from shared *_id columns"""
+        graph = {table_name: set() for table_name in self.tables_info}
+        short_names = {table_name.split('.')[-1]: table_name for table_name in self.tables_info}
+        key_columns = {}
+        for table_name, table_data in self.tables_info.items():
+            for referenced in REFERENCES_PATTERN.findall(table_data.get('ddl', '')):
+                if referenced in short_names and short_names[referenced] != table_name:
+                    graph[table_name].add(short_names[referenced])
+                    graph[short_names[referenced]].add(table_name)
+            for column_name, _ in self.table_columns[table_name]:
+                if column_name.lower().endswith('_id') or column_name.lower() == 'id':
+                    key_columns.setdefault(column_name.lower(), set()).add(table_name)
+        for column_name, tables in key_columns.items():
+            if column_name == 'id':
+                continue
+            for table_name in tables:
+                graph[table_name].update(tables - {table_name})
+        return graph
+
+    def is_key_column(self, table_name, column_name):
+        column_name = column_name.lower()
+        if column_name == 'id' or column_name.endswith('_id'):
+            return True
+        return any(column_name == line_column.lower() and ('primary key' in line.lower() or 'references' in line.lower())
+                   for line_column, line in self.table_columns[table_name])
+
+    def score_tables(self, question: str) -> dict:
+        question_terms = set(tokenize(question))
+        scores = {}
+        for table_name, terms in self.table_terms.items():
+            scores[table_name] = sum(self.idf[term] for term in question_terms if term in terms)
+        return scores
+
+    def connect_tables(self, selected: list) -> list:
+        """Add the tables on the shortest join paths between the selected tables"""
+        result = list(selected)
+        for target in selected[1:]:
+            path = self._shortest_path(selected[0], target)
+            for table_name in path or []:
+                if table_name not in result:
+                    result.append(table_name)
+        return result
+
+    def _shortest_path(self, source, target):
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            node = queue.popleft()
+            if node == target:
+                path = []
+                while node is not None:
+                    path.append(node)
+                    node = previous[node]
+                return path[::-1]
+            for neighbour in self.join_graph[node]:
+                if neighbour not in previous:
+                    previous[neighbour] = node
+                    queue.append(neighbour)
+        return None
+
+    def prune_columns(self, table_name, question_terms, max_columns):
+        """Render the table DDL keeping key columns and the columns matching the question"""
+        table_data = self.tables_info[table_name]
+        columns = self.table_columns[table_name]
+        if len(columns) <= max_columns:
+            return table_data
+        keep = []
+        ranked = []
+        for column_name, line in columns:
+            if self.is_key_column(table_name, column_name):
+                keep.append(column_name)
+            else:
+                score = sum(self.idf.get(term, 0) for term in question_terms & self.column_terms[(table_name, column_name)])
+                ranked.append((score, column_name))
+        ranked.sort(key=lambda item: item[0], reverse=True)
+        keep.extend(column_name for score, column_name in ranked[:max(max_columns - len(keep), 0)] if score > 0)
+        kept_lines = {line for column_name, line in columns if column_name in set(keep)}
+        column_lines = {line for column_name, line in columns}
+        pruned_lines = [line for line in table_data['ddl'].splitlines() if line not in column_lines or line in kept_lines]
+        # the last kept column must not be followed by a comma
+        for i in range(len(pruned_lines) - 1, -1, -1):
+            if pruned_lines[i] in column_lines:
+                pruned_lines[i] = TRAILING_COMMA_PATTERN.sub(r'\1', pruned_lines[i].rstrip())
+                break
+        return dict(table_data, ddl='\n'.join(pruned_lines))
+
+
+def embedding_table_scores(tables_info: dict, question_embedding, embed, weight=5.0) -> dict:
+    """
+    Extra table scores from the cosine similarity between the question and the table descriptions.
+    embed maps a text to its embedding vector, scores are centered so only above-average tables gain.
+    """
+    similarities = {}
+    question_norm = math.sqrt(sum(x * x for x in question_embedding)) or 1.0
+    for table_name, table_data in tables_info.items():
+        vector = embed(f"{table_name} {table_data.get('description') or ''}")
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        similarities[table_name] = sum(a * b for a, b in zip(question_embedding, vector)) / (question_norm * norm)
+    mean = sum(similarities.values()) / len(similarities) if similarities else 0.0
+    return {table_name: weight * (similarity - mean) for table_name, similarity in similarities.items()}
+
+
+def get_schema_index(tables_info: dict) -> SchemaIndex:
+    key = make_cache_key(tables_info)
+    index = _index_cache.get(key)
+    if index is None:
+        index = SchemaIndex(tables_info)
+        _index_cache.set(key, index)
+    return index
+
+
+def prune_tables_info(tables_info: dict, question: str, top_n=5, max_columns=30, min_score=1.0,
+                      table_scores=None) -> dict:
+    """
+    Select the tables (and for wide tables the columns) relevant to the question.
+    The tables on the join paths between selected tables are kept, so joins stay valid.
+    Falls back to the full tables_info when the profile has at most top_n tables or no table matches the question well.
+    table_scores can carry additional per-table scores, e.g. from embedding similarity.
+    """
+    if len(tables_info) <= top_n:
+        return tables_info
+    index = get_schema_index(tables_info)
+    scores = index.score_tables(question)
+    for table_name, score in (table_scores or {}).items():
+        if table_name in scores:
+            scores[table_name] += score
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    if scores[ranked[0]] < min_score:
+        logger.info(f'schema linking confidence too low ({scores[ranked[0]]:.2f}), use full schema')
+        return tables_info
+
+    selected = [t for t in ranked[:top_n] if scores[t] >= min_score * 0.5]
+    selected = index.connect_tables(selected)
+    question_terms = set(tokenize(question))
+    pruned = {table_name: index.prune_columns(table_name, question_terms, max_columns)
+              for table_name in tables_info if table_name in selected}
+
+    full_tokens = estimate_tokens(''.join(t['ddl'] + str(t.get('description')) for t in tables_info.values()))
+    pruned_tokens = estimate_tokens(''.join(t['ddl'] + str(t.get('description')) for t in pruned.values()))
+    logger.info(f'schema linking kept {len(pruned)}/{len(tables_info)} tables, '
+                f'saved about {full_tokens - pruned_tokens} of {full_tokens} ddl tokens')
+    return pruned
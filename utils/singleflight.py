@@ -0,0 +1,67 @@
+import threading
+from concurrent.futures import Future
+
+from loguru import logger
+
+from utils.env_var import SINGLE_FLIGHT_TIMEOUT
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent identical calls: the first caller of a key (the leader) does the work,
+    callers arriving while it is in flight wait on the same future and get its result or its exception.
+    Nothing is kept once the call finishes, caching is left to the callers.
+    """
+
+    def __init__(self, name, timeout=SINGLE_FLIGHT_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'leaders': 0, 'shared': 0}
+
+    def join(self, key):
+        """Return (future, is_leader); the leader must finish the call with complete or fail"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.stats['shared'] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.stats['leaders'] += 1
+            return future, True
+
+    def complete(self, key, result):
+        with self._lock:
+            future = self._calls.pop(key, None)
+        if future is not None:
+            future.set_result(result)
+
+    def fail(self, key, exception):
+        with self._lock:
+            future = self._calls.pop(key, None)
+        if future is not None:
+            future.set_exception(exception)
+
+    def wait(self, future, timeout=None):
+        """Wait for the leader, raises concurrent.futures.TimeoutError after timeout seconds"""
+        logger.info(f'{self.name}: waiting for an identical call in flight')
+        return future.result(timeout=self.timeout if timeout is None else timeout)
+
+    def do(self, key, func, timeout=None):
+        """Return (result, shared), shared is True when the result came from another caller's call"""
+        future, is_leader = self.join(key)
+        if not is_leader:
+            return self.wait(future, timeout), True
+        try:
+            result = func()
+        except BaseException as e:
+            self.fail(key, e)
+            raise
+        self.complete(key, result)
+        return result, False
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))
@@ -0,0 +1,137 @@
+import sqlglot
+from loguru import logger
+from sqlglot import exp
+from sqlglot.errors import SqlglotError
+from sqlglot.tokens import TokenType
+
+from utils.schema_linking import parse_columns
+
+# our dialect names (from the db url) to sqlglot dialect names
+SQLGLOT_DIALECTS = {'postgresql': 'postgres', 'mssql': 'tsql'}
+QUERY_TYPES = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+# dialects without a LIMIT clause, sqlglot renders the row limit (TOP, FETCH FIRST) for them
+NO_LIMIT_CLAUSE_DIALECTS = {'tsql', 'oracle'}
+
+
+class SqlValidationError(Exception):
+    pass
+
+
+def to_sqlglot_dialect(dialect):
+    return SQLGLOT_DIALECTS.get(dialect, dialect) if dialect else None
+
+
+def get_known_columns(tables_info: dict) -> dict:
+    """Lowercase table name (without schema) -> set of lowercase column names parsed from its DDL"""
+    known = {}
+    for table_name, table_data in tables_info.items():
+        columns = {column_name.lower() for column_name, _ in parse_columns(table_data.get('ddl', ''))}
+        known[table_name.split('.')[-1].lower()] = columns
+    return known
+
+
+def validate_references(tree, tables_info: dict):
+    """
+    Check the tables and columns referenced by the query against tables_info, raise SqlValidationError.
+    Columns are only checked for tables whose DDL could be parsed, names defined by the query
+    itself (CTEs, derived tables, select aliases) are accepted.
+    """
+    known = get_known_columns(tables_info)
+    cte_names = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    subquery_names = {subquery.alias_or_name.lower() for subquery in tree.find_all(exp.Subquery)}
+    # table valued functions (generate_series, unnest, ...) define their alias and column aliases
+    function_tables = [table for table in tree.find_all(exp.Table) if isinstance(table.this, exp.Func)]
+    function_tables += list(tree.find_all(exp.Unnest))
+    function_names = set()
+    for function_table in function_tables:
+        table_alias = function_table.args.get('alias')
+        if table_alias is not None:
+            function_names.add(table_alias.name.lower())
+            function_names.update(column.name.lower() for column in table_alias.columns)
+    aliases = {}
+    for table in tree.find_all(exp.Table):
+        name = table.name.lower()
+        if isinstance(table.this, exp.Func) or name in cte_names or name in subquery_names:
+            continue
+        if name not in known:
+            raise SqlValidationError(f'unknown table {table.name}')
+        aliases[table.alias_or_name.lower()] = name
+    defined = {alias.alias.lower() for alias in tree.find_all(exp.Alias)}
+    defined.update(subquery_names)
+    defined.update(cte_names)
+    defined.update(function_names)
+    referenced_columns = set().union(*(known[name] for name in aliases.values())) if aliases else set()
+    # an unqualified column may belong to a table whose DDL could not be parsed, those are not checked then
+    check_unqualified = bool(referenced_columns) and all(known[name] for name in aliases.values())
+
+    unknown = []
+    for column in tree.find_all(exp.Column):
+        name = column.name.lower()
+        qualifier = column.table.lower()
+        if not name or name in defined:
+            continue
+        if qualifier:
+            if qualifier in aliases and known[aliases[qualifier]] and name not in known[aliases[qualifier]]:
+                unknown.append(f'{column.table}.{column.name}')
+        elif check_unqualified and name not in referenced_columns:
+            unknown.append(column.name)
+    if unknown:
+        raise SqlValidationError(f'unknown columns {", ".join(sorted(set(unknown)))}')
+
+
+def first_statement(sql: str, read) -> str:
+    """Text of the first non empty statement of the SQL, as written"""
+    start = 0
+    for token in sqlglot.tokenize(sql, read=read):
+        if token.token_type == TokenType.SEMICOLON:
+            statement = sql[start:token.start].strip()
+            if statement:
+                return statement
+            start = token.end + 1
+    return sql[start:].strip()
+
+
+def rewrite_sql(sql: str, dialect: str, tables_info: dict = None, max_rows=None, read_dialect=None) -> tuple:
+    """
+    Parse generated SQL and return (sql, notes):
+    only the first statement is kept, trailing semicolons are removed, a top-level LIMIT of max_rows is added
+    when the query has none, and the query is transpiled from read_dialect when it differs from dialect.
+    Otherwise the SQL is kept as written, the LIMIT clause is appended to its text.
+    Raises SqlValidationError for SQL which does not parse, is not a query, or references unknown
+    tables or columns of tables_info.
+    """
+    read = to_sqlglot_dialect(read_dialect or dialect)
+    write = to_sqlglot_dialect(dialect)
+    try:
+        statements = [statement for statement in sqlglot.parse(sql, read=read) if statement is not None]
+    except SqlglotError as e:
+        raise SqlValidationError(f'invalid SQL: {e}') from e
+    if not statements:
+        raise SqlValidationError('no SQL statement found')
+    tree = statements[0]
+    if not isinstance(tree, QUERY_TYPES):
+        raise SqlValidationError(f'only queries can be executed, got {tree.key.upper()}')
+    if tables_info:
+        validate_references(tree, tables_info)
+
+    notes = []
+    add_limit = bool(max_rows) and tree.args.get('limit') is None
+    if len(statements) > 1:
+        notes.append(f'Only the first of {len(statements)} statements is executed.')
+    if add_limit:
+        notes.append(f'A LIMIT {max_rows} was added.')
+    if read == write and (not add_limit or write not in NO_LIMIT_CLAUSE_DIALECTS):
+        # the SQL is kept as written, rendering it again through sqlglot could change valid functions
+        rewritten = first_statement(sql, read)
+        if add_limit:
+            rewritten += f'\nLIMIT {max_rows}'
+    else:
+        if add_limit:
+            tree = tree.limit(max_rows)
+        try:
+            rewritten = tree.sql(dialect=write)
+        except SqlglotError as e:
+            raise SqlValidationError(f'cannot convert the SQL to {dialect}: {e}') from e
+    if notes or read != write:
+        logger.info(f'rewritten sql: {rewritten}')
+    return rewritten, notes